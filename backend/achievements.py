@@ -0,0 +1,229 @@
+"""Rule-driven achievements, evaluated incrementally from a per-user stats document.
+
+Every user has one `user_stats` document with the counters the rules look
+at (conversations, questions, messages, distinct conversation subjects, day
+streak, xp) and the set of unlocked achievement ids. Events update it with
+one atomic upsert and only the rules whose counter changed are re-evaluated,
+so the dashboard reads counts and achievements from a single document
+instead of counting conversations and messages on every request. Counters
+are lifetime totals: deleting a conversation doesn't take an achievement
+back.
+
+Rules are Achievement definitions (see server.py): an achievement unlocks
+when the counter named by condition_type reaches condition_value and the
+user has at least xp_required XP. backfill_user_stats builds the counters of
+users that predate this document from their messages and conversations.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+# condition_type -> stats document field
+CONDITION_FIELDS = {
+    "xp_total": "xp",
+    "conversations_count": "conversations",
+    "questions_count": "questions",
+    "messages_count": "messages",
+    "subjects_count": "subjects",
+    "streak_days": "streak_days",
+}
+
+DEFAULT_ACHIEVEMENTS = [
+    {"id": "primeiro-chat", "name": "Primeiro Chat", "description": "Completou sua primeira conversa",
+     "icon": "💬", "xp_required": 0, "condition_type": "conversations_count", "condition_value": 1},
+    {"id": "estudante-dedicado", "name": "Estudante Dedicado", "description": "Alcançou 100 XP",
+     "icon": "⭐", "xp_required": 0, "condition_type": "xp_total", "condition_value": 100},
+    {"id": "explorador", "name": "Explorador", "description": "Estudou 3 matérias diferentes",
+     "icon": "🧭", "xp_required": 0, "condition_type": "subjects_count", "condition_value": 3},
+    {"id": "curioso", "name": "Curioso", "description": "Fez 50 perguntas",
+     "icon": "❓", "xp_required": 0, "condition_type": "questions_count", "condition_value": 50},
+    {"id": "persistente", "name": "Persistente", "description": "Estudou 7 dias seguidos",
+     "icon": "🔥", "xp_required": 0, "condition_type": "streak_days", "condition_value": 7},
+]
+
+
+def counter(stats: Dict[str, Any], condition_type: str) -> int:
+    value = stats.get(CONDITION_FIELDS[condition_type], 0)
+    return len(value) if isinstance(value, list) else int(value or 0)
+
+
+class AchievementEngine:
+    def __init__(self):
+        self.rules: List[Any] = []
+        self.collection = None
+        self.unlocks = 0
+
+    def configure(self, rules: Iterable[Any], collection):
+        """rules are Achievement models; collection is db.user_stats."""
+        self.rules = list(rules)
+        self.collection = collection
+        for rule in self.rules:
+            if rule.condition_type not in CONDITION_FIELDS:
+                raise ValueError(f"Unknown achievement condition: {rule.condition_type}")
+
+    def satisfied(self, stats: Dict[str, Any], xp: int = 0) -> List[Any]:
+        xp = max(xp, counter(stats, "xp_total"))
+        stats = {**stats, "xp": xp}
+        return [
+            rule for rule in self.rules
+            if xp >= rule.xp_required and counter(stats, rule.condition_type) >= rule.condition_value
+        ]
+
+    async def _apply(self, user_id: str, pipeline: List[Dict[str, Any]], changed: Iterable[str],
+                     xp: int = 0) -> List[Any]:
+        """Run an update pipeline on the user's stats and unlock what it satisfied."""
+        try:
+            stats = await self.collection.find_one_and_update(
+                {"user_id": user_id},
+                [{"$set": {"user_id": user_id}}] + pipeline,
+                upsert=True,
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+        except PyMongoError as e:
+            logging.error(f"Achievement stats update failed: {str(e)}")
+            return []
+        changed = set(changed) | {"xp_total"}
+        candidates = [rule for rule in self.satisfied(stats, xp) if rule.condition_type in changed]
+        return await self._unlock(user_id, stats, candidates)
+
+    async def _unlock(self, user_id: str, stats: Dict[str, Any], rules: List[Any]) -> List[Any]:
+        unlocked = set(stats.get("unlocked", []))
+        new = [rule for rule in rules if rule.id not in unlocked]
+        if not new:
+            return []
+        now = datetime.utcnow()
+        try:
+            await self.collection.update_one(
+                {"user_id": user_id},
+                {
+                    "$addToSet": {"unlocked": {"$each": [rule.id for rule in new]}},
+                    "$set": {f"unlocked_at.{rule.id}": now for rule in new},
+                }
+            )
+        except PyMongoError as e:
+            logging.error(f"Achievement unlock failed: {str(e)}")
+            return []
+        self.unlocks += len(new)
+        return new
+
+    async def conversation_created(self, user_id: str, subject: str) -> List[Any]:
+        pipeline = [{"$set": {
+            "conversations": {"$add": [{"$ifNull": ["$conversations", 0]}, 1]},
+            "subjects": {"$setUnion": [{"$ifNull": ["$subjects", []]}, [subject]]},
+        }}]
+        return await self._apply(user_id, pipeline, ["conversations_count", "subjects_count"])
+
+    async def chat_turn_saved(self, user_id: str, xp_total: int) -> List[Any]:
+        """A question and its answer were saved; xp_total is the user's XP after the turn."""
+        today = datetime.utcnow().date()
+        yesterday = (today - timedelta(days=1)).isoformat()
+        today = today.isoformat()
+        pipeline = [{"$set": {
+            "questions": {"$add": [{"$ifNull": ["$questions", 0]}, 1]},
+            "messages": {"$add": [{"$ifNull": ["$messages", 0]}, 2]},
+            "xp": {"$max": [{"$ifNull": ["$xp", 0]}, xp_total]},
+            "streak_days": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$last_active_day", today]}, "then": "$streak_days"},
+                    {"case": {"$eq": ["$last_active_day", yesterday]},
+                     "then": {"$add": [{"$ifNull": ["$streak_days", 0]}, 1]}},
+                ],
+                "default": 1,
+            }},
+            "last_active_day": today,
+        }}]
+        return await self._apply(
+            user_id, pipeline, ["questions_count", "messages_count", "streak_days"], xp_total
+        )
+
+    async def load(self, user_id: str, xp: int = 0) -> Dict[str, Any]:
+        """The user's stats document, unlocking anything a backfill made reachable."""
+        stats = await self.collection.find_one({"user_id": user_id}, {"_id": 0}) or {"user_id": user_id}
+        new = await self._unlock(user_id, stats, self.satisfied(stats, xp))
+        if new:
+            stats["unlocked"] = list(stats.get("unlocked", [])) + [rule.id for rule in new]
+        return stats
+
+    def summary(self, stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+        unlocked = set(stats.get("unlocked", []))
+        return [
+            {
+                "id": rule.id,
+                "name": rule.name,
+                "description": rule.description,
+                "icon": rule.icon,
+                "unlocked": rule.id in unlocked,
+            } for rule in self.rules
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        return {"rules": len(self.rules), "unlocks": self.unlocks}
+
+
+async def backfill_user_stats(db):
+    """Add the history of users that predate their stats document to it.
+
+    The backfill runs in the background while requests are served, so a user
+    may already have a live stats document counting from zero. Only the
+    conversations and messages created before that document (its ObjectId
+    time; now for users without one) are counted, and the result is added to
+    the live counters instead of replacing or skipping them. Messages come
+    from the messages collection, since conversations saved before
+    message_count existed don't have it. Run once per database through
+    migrations.run_once; errors propagate so a failed run is retried.
+    """
+    def add(field):
+        return {"$add": [{"$ifNull": [f"${field}", 0]}, f"$$new.{field}"]}
+
+    await db.conversations.aggregate([
+        {"$match": {"is_active": True}},
+        {"$lookup": {
+            "from": "user_stats", "localField": "user_id", "foreignField": "user_id", "as": "stats",
+            "pipeline": [{"$project": {"_id": 0, "since": {"$toDate": "$_id"}}}],
+        }},
+        {"$set": {"since": {"$ifNull": [{"$first": "$stats.since"}, "$$NOW"]}}},
+        {"$lookup": {
+            "from": "messages", "let": {"conversation": "$id", "since": "$since"}, "as": "counts",
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$conversation_id", "$$conversation"]},
+                    {"$lt": ["$created_at", "$$since"]},
+                ]}}},
+                {"$group": {
+                    "_id": None,
+                    "messages": {"$sum": 1},
+                    "questions": {"$sum": {"$cond": [{"$eq": ["$role", "user"]}, 1, 0]}},
+                }},
+            ],
+        }},
+        {"$group": {
+            "_id": "$user_id",
+            "conversations": {"$sum": {"$cond": [{"$lt": ["$created_at", "$since"]}, 1, 0]}},
+            "messages": {"$sum": {"$ifNull": [{"$first": "$counts.messages"}, 0]}},
+            "questions": {"$sum": {"$ifNull": [{"$first": "$counts.questions"}, 0]}},
+            "subjects": {"$addToSet": "$subject"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id",
+            "conversations": 1,
+            "messages": 1,
+            "questions": 1,
+            "subjects": 1,
+        }},
+        {"$merge": {"into": "user_stats", "on": "user_id", "whenNotMatched": "insert", "whenMatched": [
+            {"$set": {
+                "conversations": add("conversations"),
+                "messages": add("messages"),
+                "questions": add("questions"),
+                "subjects": {"$setUnion": [{"$ifNull": ["$subjects", []]}, "$$new.subjects"]},
+            }},
+        ]}},
+    ], allowDiskUse=True).to_list(None)
+
+
+achievement_engine = AchievementEngine()
@@ -0,0 +1,255 @@
+"""Cache of AI answers for repeated student questions.
+
+Entries are keyed on the normalized question text plus subject, request type,
+AI style and grade. Lookups try, in order: the in-memory exact key, the
+in-memory nearest neighbour by embedding similarity (when
+ANSWER_CACHE_SIMILARITY > 0), and the optional Mongo-backed tier. Memory
+entries expire after ANSWER_CACHE_TTL seconds and are evicted LRU beyond
+ANSWER_CACHE_MAX_SIZE; Mongo entries expire through a TTL index.
+
+Embeddings are kept normalized in one float32 matrix per bucket
+(VectorIndex), so the nearest-neighbour search is a single mat-vec instead
+of a Python loop over every entry.
+
+Only context-free turns (no history, no summary) are cached, since follow-up
+answers depend on the conversation. A miss returns the question's embedding
+so the caller can hand it to set() instead of embedding the question again.
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalized(vector: List[float]) -> Optional[np.ndarray]:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else None
+
+
+class VectorIndex:
+    """Normalized embeddings as rows of one matrix; freed rows are reused."""
+
+    def __init__(self):
+        self.matrix: Optional[np.ndarray] = None
+        self.keys: List[Optional[str]] = []
+        self.slots: Dict[str, int] = {}
+        self.free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def add(self, key: str, vector: np.ndarray):
+        if self.matrix is not None and vector.shape[0] != self.matrix.shape[1]:
+            return  # embedding model changed; entries of the old size age out
+        self.remove(key)
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.keys)
+            self.keys.append(None)
+            if self.matrix is None:
+                self.matrix = np.zeros((64, vector.shape[0]), dtype=np.float32)
+            elif slot >= self.matrix.shape[0]:
+                grown = np.zeros((self.matrix.shape[0] * 2, self.matrix.shape[1]), dtype=np.float32)
+                grown[:slot] = self.matrix
+                self.matrix = grown
+        self.matrix[slot] = vector
+        self.keys[slot] = key
+        self.slots[key] = slot
+
+    def remove(self, key: str):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.matrix[slot] = 0.0
+            self.keys[slot] = None
+            self.free.append(slot)
+
+    def nearest(self, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        if not self.slots or vector.shape[0] != self.matrix.shape[1]:
+            return None, 0.0
+        scores = self.matrix[:len(self.keys)] @ vector
+        slot = int(np.argmax(scores))
+        return self.keys[slot], float(scores[slot])
+
+
+class AnswerCache:
+    def __init__(self, max_size: int = 5000, ttl: float = 86400.0, enabled: bool = True,
+                 similarity: float = 0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.similarity = similarity
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.indexes: Dict[str, VectorIndex] = {}
+        self.collection = None
+        self.embed: Optional[Callable[[str], Awaitable[List[float]]]] = None
+        self.hits = {"exact": 0, "similar": 0, "mongo": 0}
+        self.misses = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def attach(self, collection=None, embed: Optional[Callable[[str], Awaitable[List[float]]]] = None):
+        """Enable the Mongo tier and/or similarity matching."""
+        self.collection = collection
+        self.embed = embed if self.similarity > 0 else None
+
+    @staticmethod
+    def cacheable(history: Optional[List[Dict]], summary: str = "") -> bool:
+        return not history and not summary
+
+    @staticmethod
+    def bucket(subject: str, request_type: str, style: str, grade: str) -> str:
+        return "|".join([subject, request_type, style, grade])
+
+    @staticmethod
+    def key(question: str, bucket: str) -> str:
+        return hashlib.sha256(f"{normalize_question(question)}|{bucket}".encode()).hexdigest()
+
+    @property
+    def average_llm_seconds(self) -> float:
+        return self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+
+    def _live(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] < time.monotonic():
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry["bucket"] in self.indexes:
+            self.indexes[entry["bucket"]].remove(key)
+
+    def _hit(self, tier: str, ai_response: Dict[str, Any]) -> Dict[str, Any]:
+        self.hits[tier] += 1
+        self.saved_seconds += self.average_llm_seconds
+        return dict(ai_response)
+
+    async def get(self, question: str, subject: str, request_type: str, style: str,
+                  grade: str) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """(cached answer or None, the question's embedding if one was computed)."""
+        if not self.enabled:
+            return None, None
+        bucket = self.bucket(subject, request_type, style, grade)
+        key = self.key(question, bucket)
+
+        entry = self._live(key)
+        if entry is not None:
+            return self._hit("exact", entry["ai_response"]), None
+
+        embedding = None
+        if self.embed is not None:
+            try:
+                embedding = await self.embed(normalize_question(question))
+            except Exception as e:
+                logging.warning(f"Answer cache embedding failed: {str(e)}")
+            vector = normalized(embedding) if embedding is not None else None
+            index = self.indexes.get(bucket)
+            while vector is not None and index is not None and len(index):
+                best_key, score = index.nearest(vector)
+                if best_key is None or score < self.similarity:
+                    break
+                # _live refreshes the LRU position, or drops the entry if it expired
+                best = self._live(best_key)
+                if best is not None:
+                    return self._hit("similar", best["ai_response"]), embedding
+
+        if self.collection is not None:
+            try:
+                doc = await self.collection.find_one({"key": key}, {"_id": 0, "ai_response": 1})
+            except PyMongoError as e:
+                logging.warning(f"Answer cache lookup failed: {str(e)}")
+                doc = None
+            if doc:
+                self._store(key, bucket, doc["ai_response"], embedding)
+                return self._hit("mongo", doc["ai_response"]), embedding
+
+        self.misses += 1
+        return None, embedding
+
+    async def set(self, question: str, subject: str, request_type: str, style: str, grade: str,
+                  ai_response: Dict[str, Any], llm_seconds: float = 0.0,
+                  embedding: Optional[List[float]] = None):
+        """Store an answer; embedding is the one get() returned, if any."""
+        if not self.enabled:
+            return
+        self.llm_calls += 1
+        self.llm_seconds += llm_seconds
+        bucket = self.bucket(subject, request_type, style, grade)
+        key = self.key(question, bucket)
+        if embedding is None and self.embed is not None:
+            try:
+                embedding = await self.embed(normalize_question(question))
+            except Exception as e:
+                logging.warning(f"Answer cache embedding failed: {str(e)}")
+        self._store(key, bucket, ai_response, embedding)
+
+        if self.collection is not None:
+            try:
+                await self.collection.update_one(
+                    {"key": key},
+                    {"$set": {
+                        "key": key,
+                        "bucket": bucket,
+                        "question": normalize_question(question),
+                        "ai_response": ai_response,
+                        "created_at": datetime.utcnow()
+                    }},
+                    upsert=True
+                )
+            except PyMongoError as e:
+                logging.warning(f"Answer cache write failed: {str(e)}")
+
+    def _store(self, key: str, bucket: str, ai_response: Dict[str, Any], embedding: Optional[List[float]]):
+        self.entries[key] = {
+            "bucket": bucket,
+            "ai_response": ai_response,
+            "expires": time.monotonic() + self.ttl,
+        }
+        self.entries.move_to_end(key)
+        vector = normalized(embedding) if embedding is not None else None
+        if vector is not None:
+            self.indexes.setdefault(bucket, VectorIndex()).add(key, vector)
+        while len(self.entries) > self.max_size:
+            self._drop(next(iter(self.entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.entries),
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+answer_cache = AnswerCache(
+    max_size=int(os.getenv('ANSWER_CACHE_MAX_SIZE', 5000)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 86400)),
+    enabled=os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true',
+    similarity=float(os.getenv('ANSWER_CACHE_SIMILARITY', 0)),
+)
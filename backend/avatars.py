@@ -0,0 +1,121 @@
+"""Avatar images, stored once and served as cacheable resized files.
+
+An uploaded avatar is keyed by the SHA-256 of its bytes and rendered once into
+each of AVATAR_SIZES (square, AVATAR_FORMAT) under
+LOCAL_STORAGE_PATH/avatars/<hash>_<size>.<format>. User documents keep only
+avatar_hash; clients load the image from avatar_url(), which never changes
+for a given hash and can therefore be cached forever.
+
+Avatars saved by older versions as base64 PNG in users.avatar are converted
+at startup, or by hand with:
+
+    python avatars.py --migrate
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import re
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+from storage import storage_dir
+
+AVATAR_SIZES = sorted(int(size) for size in os.getenv('AVATAR_SIZES', '64,128,256').split(','))
+AVATAR_FORMAT = os.getenv('AVATAR_FORMAT', 'webp').lower()
+AVATAR_MEDIA_TYPES = {"webp": "image/webp", "png": "image/png"}
+AVATAR_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+def avatar_dir() -> Path:
+    path = storage_dir() / "avatars"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def avatar_path(avatar_hash: str, size: int) -> Path:
+    return avatar_dir() / f"{avatar_hash}_{size}.{AVATAR_FORMAT}"
+
+
+def avatar_url(avatar_hash: str, size: Optional[int] = None) -> str:
+    if not avatar_hash:
+        return ""
+    url = f"/api/avatars/{avatar_hash}"
+    return f"{url}?size={size}" if size else url
+
+
+def closest_size(size: Optional[int]) -> int:
+    """Smallest rendered size not below the requested one."""
+    if size is None:
+        return AVATAR_SIZES[-1]
+    return next((rendered for rendered in AVATAR_SIZES if rendered >= size), AVATAR_SIZES[-1])
+
+
+def render_avatar(data: bytes, avatar_hash: str):
+    """Write every size of an avatar; blocking, run in a thread."""
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for size in AVATAR_SIZES:
+            path = avatar_path(avatar_hash, size)
+            if path.exists():
+                continue
+            resized = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            resized.save(tmp_path, format=AVATAR_FORMAT.upper())
+            os.replace(tmp_path, path)
+
+
+async def save_avatar(data: bytes, avatar_hash: Optional[str] = None) -> str:
+    """Store an avatar's rendered sizes and return its hash."""
+    avatar_hash = avatar_hash or hashlib.sha256(data).hexdigest()
+    if not all(avatar_path(avatar_hash, size).exists() for size in AVATAR_SIZES):
+        await asyncio.to_thread(render_avatar, data, avatar_hash)
+    return avatar_hash
+
+
+async def migrate_base64_avatars(db) -> int:
+    """Move base64 avatars out of user documents into avatar files."""
+    migrated = 0
+    cursor = db.users.find({"avatar": {"$type": "string", "$ne": ""}}, {"_id": 0, "id": 1, "avatar": 1})
+    async for user in cursor:
+        try:
+            avatar_hash = await save_avatar(base64.b64decode(user["avatar"]))
+        except Exception as e:
+            logging.warning(f"Could not migrate avatar of user {user['id']}: {str(e)}")
+            continue
+        await db.users.update_one(
+            {"id": user["id"]},
+            {"$set": {"avatar_hash": avatar_hash}, "$unset": {"avatar": ""}}
+        )
+        migrated += 1
+    if migrated:
+        logging.info(f"Migrated {migrated} base64 avatars")
+    return migrated
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Maintain ProfAI avatar files")
+    parser.add_argument("--migrate", action="store_true", help="convert base64 avatars stored in users")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.print_help()
+        return
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    migrated = asyncio.run(migrate_base64_avatars(client[os.environ['DB_NAME']]))
+    print(f"Migrated {migrated} avatars")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
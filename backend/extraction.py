@@ -0,0 +1,392 @@
+"""Text extraction (OCR / PDF) for uploaded files, off the request path.
+
+Uploads are saved and answered right away with status "processing"; an
+extraction job then runs on extraction_queue, which limits how many jobs run
+at once. The CPU-heavy work (tesseract, partition_pdf) happens in a process
+pool, each attempt bounded by EXTRACTION_TIMEOUT and retried up to
+EXTRACTION_RETRIES times. A timed-out attempt recycles the pool (its worker
+processes are terminated), since cancelling the future alone leaves a hung
+tesseract or partition_pdf occupying a worker. Only a failure in the current
+pool recycles it: jobs that the recycle killed alongside the hung one retry
+in the fresh pool without recycling it again. Status readers can long-poll
+through wait_for().
+
+PDFs are extracted page by page, in chunks of PDF_PAGES_PER_TASK spread over
+the pool. Each page is read from its text layer first (pypdf) and only pages
+with fewer than PDF_MIN_PAGE_CHARS characters are rendered and OCR'd. Reading
+stops after PDF_MAX_PAGES pages or PDF_MAX_CHARS characters, so a long book
+doesn't flood the prompt.
+
+Images are preprocessed before OCR (IMAGE_PREPROCESS): EXIF rotation,
+grayscale, downscaling to IMAGE_OCR_DPI for an A4 page, Otsu binarization
+and cropping to the text region. Each step is timed and the averages are
+reported by stats().
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import processing_duration
+from tasks import BackgroundQueue
+
+IMAGE_TYPES = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+PDF_TYPES = {'pdf'}
+
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', 50))
+PDF_MAX_CHARS = int(os.getenv('PDF_MAX_CHARS', 20000))
+PDF_MIN_PAGE_CHARS = int(os.getenv('PDF_MIN_PAGE_CHARS', 20))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 4))
+PDF_OCR_DPI = int(os.getenv('PDF_OCR_DPI', 200))
+
+IMAGE_PREPROCESS = os.getenv('IMAGE_PREPROCESS', 'true').lower() == 'true'
+IMAGE_OCR_DPI = int(os.getenv('IMAGE_OCR_DPI', 300))
+A4_LONG_SIDE_INCHES = 11.69
+CROP_MARGIN = 16
+
+
+def extract_text(file_path: str, file_ext: str) -> str:
+    """Run in a worker process: OCR an image or partition a PDF."""
+    if file_ext in IMAGE_TYPES:
+        return ocr_image(file_path)[0]
+    if file_ext in PDF_TYPES:
+        from unstructured.partition.pdf import partition_pdf
+
+        elements = partition_pdf(file_path)
+        return "\n".join([str(element) for element in elements])
+    raise ValueError(f"Unsupported file type: {file_ext}")
+
+
+def otsu_threshold(histogram: List[int]) -> int:
+    """Gray level that best separates a 256-bin histogram into two classes."""
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background, weighted_background = 0, 0
+    best_level, best_variance = 127, 0.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def preprocess_image(image, timings: Dict[str, float]):
+    """EXIF-rotate, grayscale, downscale, binarize and crop an image for OCR."""
+    from PIL import Image, ImageOps
+
+    def step(name, func, value):
+        started = time.perf_counter()
+        result = func(value)
+        timings[name] = time.perf_counter() - started
+        return result
+
+    def downscale(img):
+        max_side = int(IMAGE_OCR_DPI * A4_LONG_SIDE_INCHES)
+        scale = max_side / max(img.size)
+        if scale >= 1:
+            return img
+        return img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+
+    def binarize(img):
+        threshold = otsu_threshold(img.histogram())
+        return img.point(lambda level: 255 if level > threshold else 0)
+
+    def crop(img):
+        bbox = ImageOps.invert(img).getbbox()
+        if bbox is None:
+            return img
+        left, top, right, bottom = bbox
+        return img.crop((max(left - CROP_MARGIN, 0), max(top - CROP_MARGIN, 0),
+                         min(right + CROP_MARGIN, img.width), min(bottom + CROP_MARGIN, img.height)))
+
+    image = step("exif", ImageOps.exif_transpose, image)
+    image = step("grayscale", lambda img: img.convert("L"), image)
+    image = step("downscale", downscale, image)
+    image = step("binarize", binarize, image)
+    return step("crop", crop, image)
+
+
+def ocr_image(file_path: str, preprocess: Optional[bool] = None) -> Tuple[str, Dict[str, float]]:
+    """Run in a worker process: OCR an image, returning (text, seconds per step)."""
+    from PIL import Image
+    import pytesseract
+
+    if preprocess is None:
+        preprocess = IMAGE_PREPROCESS
+    timings: Dict[str, float] = {}
+    with Image.open(file_path) as image:
+        image.load()
+        config = ""
+        if preprocess:
+            image = preprocess_image(image, timings)
+            config = f"--dpi {IMAGE_OCR_DPI}"
+        started = time.perf_counter()
+        text = pytesseract.image_to_string(image, lang='por', config=config)
+        timings["ocr"] = time.perf_counter() - started
+    return text, timings
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Page count; raises ValueError for a PDF pypdf cannot open."""
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    try:
+        return len(PdfReader(file_path).pages)
+    except PyPdfError as e:
+        # PdfReadError/PdfStreamError don't subclass ValueError
+        raise ValueError(f"pypdf cannot read {file_path}: {str(e)}") from None
+
+
+def page_text(reader, page_number: int) -> str:
+    """Text layer of one page, or "" when pypdf fails on it (the page is then OCR'd)."""
+    try:
+        return reader.pages[page_number].extract_text() or ""
+    except Exception as e:
+        logging.warning(f"Text layer of page {page_number + 1} unreadable: {str(e)}")
+        return ""
+
+
+def extract_pdf_pages(file_path: str, page_numbers: List[int],
+                      ocr: str = "auto") -> List[Tuple[str, str, float]]:
+    """Run in a worker process: (text, tier, seconds) for each 0-based page.
+
+    ocr is "auto" (OCR only pages without a usable text layer), "never" or
+    "always".
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    results = []
+    for page_number in page_numbers:
+        started = time.perf_counter()
+        text = "" if ocr == "always" else page_text(reader, page_number)
+        tier = "text"
+        if ocr != "never" and len(text.strip()) < PDF_MIN_PAGE_CHARS:
+            text, tier = ocr_pdf_page(file_path, page_number), "ocr"
+        results.append((text.strip(), tier, time.perf_counter() - started))
+    return results
+
+
+def ocr_pdf_page(file_path: str, page_number: int) -> str:
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    images = convert_from_path(file_path, dpi=PDF_OCR_DPI, first_page=page_number + 1,
+                               last_page=page_number + 1)
+    return "\n".join(pytesseract.image_to_string(image, lang='por') for image in images)
+
+
+def placeholder_text(filename: str, file_ext: str, error: Optional[str] = None) -> str:
+    """Text stored when nothing could be extracted."""
+    if file_ext in IMAGE_TYPES:
+        return f"Imagem enviada: {filename} (OCR não disponível: {error})"
+    if file_ext in PDF_TYPES:
+        return f"PDF enviado: {filename} (Processamento não disponível: {error})"
+    return f"Arquivo enviado: {filename} (Tipo não suportado para extração de texto)"
+
+
+def _report_pid(pids):
+    """Pool initializer: tell the parent which process to kill on recycle."""
+    pids.put(os.getpid())
+
+
+class ExtractionPool:
+    def __init__(self, workers: int = 2, timeout: float = 120.0, retries: int = 1):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pids = None  # worker PIDs of the current executor
+        self.lock = threading.Lock()
+        self.events: Dict[str, list] = {}  # file_id -> [event, waiters]
+        self.pages = {"text": 0, "ocr": 0}
+        self.page_seconds = {"text": 0.0, "ocr": 0.0}
+        self.truncated = 0
+        self.images = 0
+        self.image_step_seconds: Dict[str, float] = {}
+        self.recycles = 0
+
+    def start(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.pids = multiprocessing.SimpleQueue()
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_report_pid, initargs=(self.pids,)
+                )
+            return self.executor
+
+    def close(self):
+        with self.lock:
+            self._shutdown()
+
+    def _shutdown(self, kill: bool = False):
+        if self.executor is None:
+            return
+        pids = []
+        while not self.pids.empty():
+            pids.append(self.pids.get())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        if kill:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def recycle(self, executor: ProcessPoolExecutor, kill: bool = True):
+        """Replace the pool if `executor` is still the current one; kill its workers if asked.
+
+        Other jobs running in the pool fail with BrokenProcessPool and retry in
+        the new one. A failure from an already replaced pool is ignored.
+        """
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self._shutdown(kill)
+            self.recycles += 1
+        self.start()
+
+    async def extract(self, file_path: str, file_ext: str) -> str:
+        """Extract text in the process pool, with per-attempt timeout and retries."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            executor = self.start()
+            try:
+                if file_ext in PDF_TYPES:
+                    return await asyncio.wait_for(
+                        self.extract_pdf(file_path, executor=executor), timeout=self.timeout
+                    )
+                if file_ext in IMAGE_TYPES:
+                    text, timings = await asyncio.wait_for(
+                        loop.run_in_executor(executor, ocr_image, file_path),
+                        timeout=self.timeout
+                    )
+                    self.images += 1
+                    for name, seconds in timings.items():
+                        self.image_step_seconds[name] = self.image_step_seconds.get(name, 0.0) + seconds
+                    processing_duration.observe(sum(timings.values()), "ocr_image")
+                    return text
+                return await asyncio.wait_for(
+                    loop.run_in_executor(executor, extract_text, file_path, file_ext),
+                    timeout=self.timeout
+                )
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge scan, or a recycle); start a fresh pool
+                self.recycle(executor, kill=False)
+                if attempt == self.retries:
+                    raise
+            except asyncio.TimeoutError:
+                # The worker is still running the hung job; free it before retrying
+                self.recycle(executor)
+                if attempt == self.retries:
+                    raise
+            except OSError:
+                if attempt == self.retries:
+                    raise
+            logging.warning(f"Extraction of {file_path} failed (attempt {attempt + 1}), retrying")
+
+    async def extract_pdf(self, file_path: str, ocr: str = "auto",
+                          executor: Optional[ProcessPoolExecutor] = None) -> str:
+        """Page-parallel PDF extraction within the page/character budget."""
+        executor = executor or self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            page_count = await loop.run_in_executor(executor, pdf_page_count, file_path)
+        except (ImportError, ValueError) as e:
+            # No pypdf or a PDF it can't parse: partition the whole document
+            logging.warning(f"Page extraction unavailable for {file_path}: {str(e)}")
+            return await loop.run_in_executor(executor, extract_text, file_path, "pdf")
+
+        pages = list(range(min(page_count, PDF_MAX_PAGES)))
+        futures = [
+            loop.run_in_executor(executor, extract_pdf_pages, file_path,
+                                 pages[start:start + PDF_PAGES_PER_TASK], ocr)
+            for start in range(0, len(pages), PDF_PAGES_PER_TASK)
+        ]
+        texts, chars = [], 0
+        try:
+            # Chunks complete in parallel but are consumed in page order
+            for future in futures:
+                for text, tier, seconds in await future:
+                    self.pages[tier] += 1
+                    self.page_seconds[tier] += seconds
+                    processing_duration.observe(seconds, f"pdf_page_{tier}")
+                    if text:
+                        texts.append(text)
+                        chars += len(text) + 2
+                if chars >= PDF_MAX_CHARS:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+
+        text = "\n\n".join(texts)
+        if chars >= PDF_MAX_CHARS or page_count > len(pages):
+            self.truncated += 1
+            text = text[:PDF_MAX_CHARS] + "\n[...]"
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pages": dict(self.pages),
+            "pages_per_s": {
+                tier: round(self.pages[tier] / self.page_seconds[tier], 2) if self.page_seconds[tier] else 0.0
+                for tier in self.pages
+            },
+            "truncated": self.truncated,
+            "pool_recycles": self.recycles,
+            "images": self.images,
+            "image_step_ms": {
+                name: round(seconds / self.images * 1000, 1)
+                for name, seconds in self.image_step_seconds.items()
+            },
+        }
+
+    def notify(self, file_id: str):
+        entry = self.events.pop(file_id, None)
+        if entry is not None:
+            entry[0].set()
+
+    async def wait_for(self, file_id: str, timeout: float):
+        """Wait until notify(file_id) or timeout, whichever comes first."""
+        entry = self.events.get(file_id)
+        if entry is None:
+            entry = self.events[file_id] = [asyncio.Event(), 0]
+        entry[1] += 1
+        try:
+            await asyncio.wait_for(entry[0].wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The job may finish in another worker process, so the last waiter cleans up
+            entry[1] -= 1
+            if entry[1] == 0 and self.events.get(file_id) is entry:
+                del self.events[file_id]
+
+
+extraction_pool = ExtractionPool(
+    workers=int(os.getenv('EXTRACTION_WORKERS', 2)),
+    timeout=float(os.getenv('EXTRACTION_TIMEOUT', 120)),
+    retries=int(os.getenv('EXTRACTION_RETRIES', 1)),
+)
+extraction_queue = BackgroundQueue(
+    workers=int(os.getenv('EXTRACTION_WORKERS', 2)),
+    max_size=int(os.getenv('EXTRACTION_QUEUE_SIZE', 500)),
+)
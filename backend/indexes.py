@@ -0,0 +1,165 @@
+"""MongoDB index declarations and query-plan check.
+
+INDEXES lists every index the server relies on; ensure_indexes builds them at
+startup (create_indexes is idempotent, so restarts are cheap). QUERY_SHAPES
+mirrors the queries issued by server.py and is used by the command-line check,
+which prints the winning plan of each shape and fails on any COLLSCAN:
+
+    python indexes.py            # ensure indexes, then check plans
+    python indexes.py --check    # only check plans
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+    "conversations": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_active", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)],
+            name="user_active_updated_id"
+        ),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("conversation_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="conversation_created_id"
+        ),
+    ],
+    "files": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("conversation_id", ASCENDING)], name="conversation"),
+        IndexModel([("content_hash", ASCENDING), ("status", ASCENDING)], name="content_hash_status"),
+        IndexModel(
+            [("status", ASCENDING)],
+            partialFilterExpression={"status": "processing"},
+            name="status_processing"
+        ),
+    ],
+    "answer_cache": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+        IndexModel(
+            [("created_at", ASCENDING)],
+            expireAfterSeconds=int(os.getenv('ANSWER_CACHE_TTL', 86400)),
+            name="created_ttl"
+        ),
+    ],
+    "leaderboard_scores": [
+        IndexModel([("board", ASCENDING), ("user_id", ASCENDING)], unique=True, name="board_user_unique"),
+        IndexModel([("board", ASCENDING), ("xp", DESCENDING), ("user_id", ASCENDING)], name="board_xp_user"),
+        IndexModel([("week", ASCENDING), ("updated_at", ASCENDING)], name="week_updated"),
+    ],
+    "user_stats": [
+        # Also the "on" field backfill_user_stats merges by, which must be unique
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+}
+
+CURSOR_TIME = datetime(2025, 1, 1)
+
+# (description, collection, filter, sort) for every query shape in server.py
+QUERY_SHAPES: List[Tuple[str, str, Dict[str, Any], List[Tuple[str, int]]]] = [
+    ("user by email", "users", {"email": "x@example.com"}, []),
+    ("user by username", "users", {"username": "x"}, []),
+    ("user by id", "users", {"id": "x"}, []),
+    ("leaderboard page users", "users", {"id": {"$in": ["x", "y"]}}, []),
+    ("conversation by id", "conversations", {"id": "x"}, []),
+    ("conversation by id and owner", "conversations", {"id": "x", "user_id": "x"}, []),
+    ("active conversations by recency", "conversations",
+     {"user_id": "x", "is_active": True}, [("updated_at", DESCENDING), ("id", DESCENDING)]),
+    ("conversation page before cursor", "conversations",
+     {"user_id": "x", "is_active": True,
+      "$or": [{"updated_at": {"$lt": CURSOR_TIME}}, {"updated_at": CURSOR_TIME, "id": {"$lt": "x"}}]},
+     [("updated_at", DESCENDING), ("id", DESCENDING)]),
+    ("latest messages of a conversation", "messages",
+     {"conversation_id": "x"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("chat history after summary", "messages",
+     {"conversation_id": "x", "created_at": {"$gt": CURSOR_TIME}}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("messages to summarize", "messages",
+     {"conversation_id": "x", "created_at": {"$gt": CURSOR_TIME}}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("message page before cursor", "messages",
+     {"conversation_id": "x",
+      "$or": [{"created_at": {"$lt": CURSOR_TIME}}, {"created_at": CURSOR_TIME, "id": {"$lt": "x"}}]},
+     [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("file by id and owner", "files", {"id": "x", "user_id": "x"}, []),
+    ("files still processing", "files", {"status": "processing"}, []),
+    ("uploads waiting for an extraction", "files", {"content_hash": "x", "status": "processing"}, []),
+    ("extracted upload with same content", "files", {"content_hash": "x", "status": "done"}, []),
+    ("blob references", "files", {"content_hash": {"$in": ["x", "y"]}}, []),
+    ("cached answer by key", "answer_cache", {"key": "x"}, []),
+    ("leaderboard board by score", "leaderboard_scores",
+     {"board": "x"}, [("xp", DESCENDING), ("user_id", ASCENDING)]),
+    ("leaderboard scores updated since", "leaderboard_scores",
+     {"week": "2025-W01", "updated_at": {"$gte": CURSOR_TIME}}, []),
+    ("achievement stats of a user", "user_stats", {"user_id": "x"}, []),
+]
+
+
+async def ensure_indexes(db):
+    """Create any missing index; failures are logged and do not stop startup."""
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except PyMongoError as e:
+            logging.error(f"Index creation failed on {collection}: {str(e)}")
+
+
+def plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+
+def check_query_plans(db) -> bool:
+    """Print the winning plan of every query shape; False if any is a COLLSCAN."""
+    ok = True
+    for description, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = plan_stages(winning_plan)
+        scan = "COLLSCAN" in stages
+        ok = ok and not scan
+        print(f"{'FAIL' if scan else 'ok  '} {collection:<14} {description:<36} {' <- '.join(s for s in stages if s)}")
+    return ok
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Ensure ProfAI indexes and check query plans")
+    parser.add_argument("--check", action="store_true", help="only check plans, do not create indexes")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = MongoClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    if not args.check:
+        for collection, indexes in INDEXES.items():
+            db[collection].create_indexes(indexes)
+    ok = check_query_plans(db)
+    client.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
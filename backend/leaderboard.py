@@ -0,0 +1,364 @@
+"""Weekly XP leaderboards per school, class (school + grade) and grade.
+
+Each board keeps its ranking in memory in an indexable skip list ordered by
+(-xp, user_id), so updating a score, looking up a user's rank and reading a
+top-K page are O(log n) (plus K) instead of a sort over `users`. Boards are
+fed by the XP earned in chat turns and only cover the current ISO week.
+
+Increments are buffered and flushed to the `leaderboard_scores` collection
+every LEADERBOARD_FLUSH_INTERVAL seconds with one bulk_write, which also
+stamps updated_at. The collection is what every worker process agrees on:
+
+* a board is loaded the first time it is read, already ordered by the
+  (board, xp desc, user_id) index, so the skip list is built by appending
+  in O(n) instead of n inserts, on a thread; boards nobody reads are never
+  loaded;
+* after each flush, the scores updated since the previous sync (by any
+  worker) are re-read and set on the loaded boards, so workers converge
+  within one interval.
+
+Leaderboards are derived data (users.xp stays the source of truth), so a
+crash loses at most one interval of leaderboard increments.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+
+SCOPES = ("school", "class", "grade")
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        self.width: List[int] = [1] * level
+
+
+class RankedSkipList:
+    """Sorted keys with O(log n) insert, remove, rank and index access."""
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def from_sorted(cls, keys: Iterable) -> "RankedSkipList":
+        """Build from keys already in ascending order in O(n)."""
+        ranking = cls()
+        tails = [ranking.head] * cls.MAX_LEVEL
+        positions = [0] * cls.MAX_LEVEL
+        position = 0
+        for key in keys:
+            position += 1
+            level = ranking._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                tails[i].next[i] = node
+                tails[i].width[i] = position - positions[i]
+                tails[i], positions[i] = node, position
+            ranking.level = max(ranking.level, level)
+        for i in range(ranking.level):
+            tails[i].width[i] = position + 1 - positions[i]
+        ranking.size = position
+        return ranking
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [self.head] * self.MAX_LEVEL
+        position = [0] * self.MAX_LEVEL
+        node, index = self.head, 0
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                index += node.width[i]
+                node = node.next[i]
+            update[i], position[i] = node, index
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                update[i], position[i] = self.head, 0
+                self.head.width[i] = self.size + 1
+            self.level = level
+
+        new = _Node(key, level)
+        for i in range(level):
+            previous = update[i]
+            new.next[i] = previous.next[i]
+            previous.next[i] = new
+            # previous.width[i] spanned position[i] .. position[i] + width
+            new.width[i] = previous.width[i] - (index - position[i])
+            previous.width[i] = index - position[i] + 1
+        for i in range(level, self.level):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key) -> bool:
+        update = [self.head] * self.MAX_LEVEL
+        node = self.head
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for i in range(self.level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self.level > 1 and self.head.next[self.level - 1] is None:
+            self.level -= 1
+        self.size -= 1
+        return True
+
+    def rank(self, key) -> Optional[int]:
+        """0-based position of key, or None if absent."""
+        node, index = self.head, 0
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                index += node.width[i]
+                node = node.next[i]
+        node = node.next[0]
+        return index if node is not None and node.key == key else None
+
+    def slice(self, start: int, count: int) -> list:
+        """Up to count keys from 0-based position start."""
+        if start >= self.size or count <= 0:
+            return []
+        node, index = self.head, -1
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and index + node.width[i] <= start:
+                index += node.width[i]
+                node = node.next[i]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Board:
+    def __init__(self, scores: Optional[Dict[str, int]] = None):
+        self.scores: Dict[str, int] = dict(scores or {})
+        # Near-sorted input (as loaded from the index) sorts in linear time
+        keys = sorted((-score, user_id) for user_id, score in self.scores.items())
+        self.ranking = RankedSkipList.from_sorted(keys)
+
+    def set(self, user_id: str, score: int):
+        previous = self.scores.get(user_id)
+        if previous == score:
+            return
+        if previous is not None:
+            self.ranking.remove((-previous, user_id))
+        self.scores[user_id] = score
+        self.ranking.insert((-score, user_id))
+
+    def add(self, user_id: str, amount: int) -> int:
+        score = self.scores.get(user_id, 0) + amount
+        self.set(user_id, score)
+        return score
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """1-based rank of a user, or None if they have no XP on this board."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.ranking.rank((-score, user_id)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> List[Tuple[int, str, int]]:
+        """(rank, user_id, xp) for a page of the ranking."""
+        return [
+            (offset + position + 1, user_id, -negative_score)
+            for position, (negative_score, user_id) in enumerate(self.ranking.slice(offset, limit))
+        ]
+
+
+def current_week(now: Optional[datetime] = None) -> str:
+    year, week, _ = (now or datetime.utcnow()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def board_key(scope: str, school: str, grade: str, week: str) -> Optional[str]:
+    if scope == "school":
+        return f"school:{school}:{week}" if school else None
+    if scope == "class":
+        return f"class:{school}:{grade}:{week}" if school else None
+    if scope == "grade":
+        return f"grade:{grade}:{week}"
+    raise ValueError(f"Unknown leaderboard scope: {scope}")
+
+
+class Leaderboards:
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        # Updates flushed this long before a sync started are still re-read by it
+        self.overlap = timedelta(seconds=max(10.0, 2 * flush_interval))
+        self.boards: Dict[str, Board] = {}
+        self.week = current_week()
+        self.pending: Dict[Tuple[str, str], int] = {}
+        self.collection = None
+        self.lock = asyncio.Lock()
+        self.synced_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.loads = 0
+        self.synced = 0
+
+    async def start(self, collection):
+        """Start flushing and syncing; boards are loaded when first read."""
+        self.collection = collection
+        self._roll_week()
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    def _roll_week(self):
+        week = current_week()
+        if week != self.week:
+            self.week = week
+            self.boards = {}
+            self.synced_at = None
+
+    def record_xp(self, user_id: str, school: str, grade: str, amount: int):
+        """Add XP earned now to the user's boards for the current week."""
+        if amount <= 0:
+            return
+        self._roll_week()
+        for scope in SCOPES:
+            key = board_key(scope, school, grade, self.week)
+            if key is None:
+                continue
+            board = self.boards.get(key)
+            if board is not None:
+                board.add(user_id, amount)
+            self.pending[(key, user_id)] = self.pending.get((key, user_id), 0) + amount
+
+    async def board(self, scope: str, school: str, grade: str) -> Tuple[Optional[str], Optional[Board]]:
+        self._roll_week()
+        key = board_key(scope, school, grade, self.week)
+        if key is None:
+            return None, None
+        board = self.boards.get(key)
+        if board is None and self.collection is not None:
+            board = await self._load(key)
+        return key, board
+
+    async def _load(self, key: str) -> Optional[Board]:
+        async with self.lock:
+            if key in self.boards:
+                return self.boards[key]
+            started = datetime.utcnow()
+            try:
+                docs = await self.collection.find(
+                    {"board": key}, {"_id": 0, "user_id": 1, "xp": 1}
+                ).sort([("xp", DESCENDING), ("user_id", ASCENDING)]).to_list(None)
+            except PyMongoError as e:
+                logging.error(f"Leaderboard load failed: {str(e)}")
+                return None
+            scores = {doc["user_id"]: doc["xp"] for doc in docs}
+            unflushed = {user_id: amount for (board, user_id), amount in self.pending.items() if board == key}
+            for user_id, amount in unflushed.items():
+                scores[user_id] = scores.get(user_id, 0) + amount
+            # Building a large board takes seconds; keep it off the event loop
+            board = await asyncio.to_thread(Board, scores)
+            # The lock keeps flush away, so pending only grew during the build
+            for (board_name, user_id), amount in list(self.pending.items()):
+                if board_name == key and amount != unflushed.get(user_id, 0):
+                    board.add(user_id, amount - unflushed.get(user_id, 0))
+            self.boards[key] = board
+            if self.synced_at is None:
+                self.synced_at = started - self.overlap
+            self.loads += 1
+            return self.boards[key]
+
+    async def flush(self):
+        if not self.pending or self.collection is None:
+            return
+        async with self.lock:
+            pending, self.pending = self.pending, {}
+            now = datetime.utcnow()
+            operations = [
+                UpdateOne(
+                    {"board": key, "user_id": user_id},
+                    {"$inc": {"xp": amount}, "$set": {"updated_at": now},
+                     "$setOnInsert": {"week": key.rsplit(":", 1)[1]}},
+                    upsert=True
+                )
+                for (key, user_id), amount in pending.items()
+            ]
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                self.flushed += len(operations)
+            except PyMongoError as e:
+                logging.error(f"Leaderboard flush failed: {str(e)}")
+
+    async def sync(self):
+        """Set the scores flushed by any worker since the last sync on the loaded boards."""
+        if not self.boards or self.synced_at is None or self.collection is None:
+            return
+        async with self.lock:
+            started = datetime.utcnow()
+            try:
+                async for doc in self.collection.find(
+                    {"week": self.week, "updated_at": {"$gte": self.synced_at}},
+                    {"_id": 0, "board": 1, "user_id": 1, "xp": 1}
+                ):
+                    board = self.boards.get(doc["board"])
+                    if board is None:
+                        continue
+                    # Mongo has every flushed increment; add the ones not flushed yet
+                    unflushed = self.pending.get((doc["board"], doc["user_id"]), 0)
+                    board.set(doc["user_id"], doc["xp"] + unflushed)
+                    self.synced += 1
+            except PyMongoError as e:
+                logging.error(f"Leaderboard sync failed: {str(e)}")
+                return
+            self.synced_at = started - self.overlap
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            await self.sync()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "week": self.week,
+            "boards": len(self.boards),
+            "entries": sum(len(board.scores) for board in self.boards.values()),
+            "pending": len(self.pending),
+            "flushed": self.flushed,
+            "loads": self.loads,
+            "synced": self.synced,
+        }
+
+
+leaderboards = Leaderboards(flush_interval=float(os.getenv('LEADERBOARD_FLUSH_INTERVAL', 5)))
@@ -0,0 +1,157 @@
+"""Shared async OpenAI client used by the AI endpoints.
+
+A single AsyncOpenAI client (and its httpx connection pool) is created at
+startup and closed on shutdown, so LLM calls never block the event loop and
+sockets are reused across requests. A per-process semaphore caps how many
+completions are in flight at once; extra callers wait their turn. Every call
+is timed, and token usage counted, in the metrics registry.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import openai
+
+from metrics import llm_duration, llm_in_flight, llm_tokens
+
+
+class LLMPool:
+    def __init__(self):
+        self.client: Optional[openai.AsyncOpenAI] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        if self.client is not None:
+            return
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', 100)),
+                max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE', 20)),
+            ),
+            timeout=httpx.Timeout(float(os.getenv('LLM_TIMEOUT', 60)), connect=10.0),
+        )
+        self.client = openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=os.getenv('OPENAI_BASE_URL') or None,
+            http_client=http_client,
+            max_retries=int(os.getenv('LLM_MAX_RETRIES', 2)),
+        )
+        self.semaphore = asyncio.Semaphore(int(os.getenv('LLM_MAX_CONCURRENCY', 32)))
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    @asynccontextmanager
+    async def slot(self, operation: str):
+        """Hold a concurrency slot for one call and record its duration."""
+        if self.client is None:
+            await self.start()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self.semaphore:
+                llm_in_flight.inc(operation)
+                try:
+                    yield
+                    outcome = "ok"
+                finally:
+                    llm_in_flight.dec(operation)
+        finally:
+            llm_duration.observe(time.perf_counter() - started, operation, outcome)
+
+    @staticmethod
+    def count_tokens(model: str, usage):
+        if usage is None:
+            return
+        llm_tokens.inc(model, "prompt", amount=usage.prompt_tokens or 0)
+        llm_tokens.inc(model, "completion", amount=getattr(usage, "completion_tokens", 0) or 0)
+
+    async def chat_completion(self, **kwargs):
+        """Run chat.completions.create under the concurrency limit."""
+        async with self.slot("chat"):
+            response = await self.client.chat.completions.create(**kwargs)
+        self.count_tokens(kwargs.get("model", ""), getattr(response, "usage", None))
+        return response
+
+    async def embedding(self, text: str) -> List[float]:
+        model = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+        async with self.slot("embedding"):
+            response = await self.client.embeddings.create(model=model, input=text)
+        self.count_tokens(model, getattr(response, "usage", None))
+        return response.data[0].embedding
+
+    async def stream_chat_completion(self, **kwargs):
+        """Yield content deltas of a streamed completion.
+
+        The concurrency slot is held until the stream is fully consumed.
+        """
+        async with self.slot("chat_stream"):
+            stream = await self.client.chat.completions.create(stream=True, **kwargs)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def transcription(self, **kwargs):
+        """Run audio.transcriptions.create under the concurrency limit."""
+        async with self.slot("transcription"):
+            return await self.client.audio.transcriptions.create(**kwargs)
+
+    async def stream_speech(self, chunk_size: int = 16384, **kwargs):
+        """Yield audio bytes of audio.speech as they arrive from upstream."""
+        async with self.slot("speech"):
+            async with self.client.audio.speech.with_streaming_response.create(**kwargs) as response:
+                async for chunk in response.iter_bytes(chunk_size):
+                    yield chunk
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one upstream call.
+
+    The first caller starts the work as its own task; callers arriving while it
+    is in flight await the same task. Each caller is shielded, so one client
+    disconnecting does not cancel the call for the others.
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Future] = {}
+        self.upstream_calls = 0
+        self.shared_calls = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.upstream_calls += 1
+        else:
+            self.shared_calls += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self.calls),
+            "upstream_calls": self.upstream_calls,
+            "shared_calls": self.shared_calls,
+        }
+
+
+def prompt_key(**request) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+llm_pool = LLMPool()
+inflight = SingleFlight()
@@ -0,0 +1,196 @@
+"""Event-loop lag measurement and blocking-callback reports.
+
+A task on the event loop sleeps LOOP_WATCHDOG_INTERVAL_MS at a time and
+records how late it wakes up (profai_event_loop_lag_seconds); every wake-up
+is also a heartbeat. A watchdog thread checks the heartbeat, and when it is
+more than LOOP_WATCHDOG_THRESHOLD_MS overdue the loop is stuck in a
+synchronous call: the thread captures the loop thread's stack while it is
+still blocked, counts it in profai_event_loop_blocked_total and logs one JSON
+report naming the route whose request was running (detected_after_ms is how
+long it had been blocked then). When the heartbeat resumes, a second log
+line gives the episode's final blocked_ms.
+
+LoopWatchdogMiddleware puts each request's ASGI scope in the request_scope
+ContextVar. Tasks copy the context they are created in, so the tasks a
+request spawns (StreamingResponse bodies run in anyio child tasks) carry its
+scope too; a task factory records that scope per task, since the watchdog
+thread cannot read another task's context. Blocks outside a request
+(background jobs, startup) are reported as "background" with the task name.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from metrics import loop_blocked, loop_lag
+
+request_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_scope", default=None)
+
+
+class LoopWatchdog:
+    def __init__(self, enabled: bool = True, interval: float = 0.05, threshold: float = 0.1, stack_depth: int = 15):
+        self.enabled = enabled
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.requests: "weakref.WeakKeyDictionary[asyncio.Task, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task_factory = None
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.max_lag = 0.0
+        self.blocks = 0
+        self.last_block: Optional[Dict[str, Any]] = None
+
+    async def start(self):
+        if not self.enabled or self.task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.task_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._create_task)
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._measure())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def close(self):
+        self.stopping.set()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            self.loop.set_task_factory(self.task_factory)
+        if self.thread is not None:
+            await asyncio.to_thread(self.thread.join, 1.0)
+            self.thread = None
+
+    def _create_task(self, loop, coro, **kwargs):
+        """Task factory: remember the request scope a new task inherits."""
+        if self.task_factory is not None:
+            task = self.task_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        scope = context.get(request_scope) if context is not None else request_scope.get()
+        if scope is not None:
+            self.requests[task] = scope
+        return task
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self.heartbeat = now
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag.observe(lag)
+
+    def _watch(self):
+        reported = None
+        episode = None
+        while not self.stopping.wait(self.threshold / 4):
+            heartbeat = self.heartbeat
+            if episode is not None and heartbeat != reported:
+                # The loop ran again: the gap between heartbeats is the whole block
+                self._resumed(episode, heartbeat - reported - self.interval)
+                episode = None
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked >= self.threshold and heartbeat != reported:
+                reported = heartbeat
+                try:
+                    episode = self._report(blocked)
+                except Exception as e:
+                    logging.error(f"Event loop watchdog report failed: {str(e)}")
+
+    def _report(self, blocked: float) -> Dict[str, Any]:
+        """Runs on the watchdog thread while the loop thread is still blocked."""
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = [
+            f"{entry.filename}:{entry.lineno} in {entry.name}: {entry.line}"
+            for entry in traceback.extract_stack(frame, limit=self.stack_depth)
+        ] if frame is not None else []
+        task = asyncio.current_task(self.loop)
+        scope = self.requests.get(task) if task is not None else None
+        if scope is not None:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            request = f"{scope.get('method')} {scope.get('path')}"
+        else:
+            route = "background"
+            request = task.get_name() if task is not None else None
+
+        self.blocks += 1
+        loop_blocked.inc(route)
+        self.last_block = {
+            "route": route, "detected_after_ms": round(blocked * 1000, 1), "blocked_ms": None, "at": time.time()
+        }
+        report = {
+            "event": "event_loop_blocked",
+            "route": route,
+            "request": request,
+            "detected_after_ms": round(blocked * 1000, 1),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "stack": stack,
+        }
+        logging.warning(f"Event loop blocked: {json.dumps(report, ensure_ascii=False)}")
+        return report
+
+    def _resumed(self, episode: Dict[str, Any], blocked: float):
+        blocked_ms = round(max(blocked, 0.0) * 1000, 1)
+        if self.last_block is not None:
+            self.last_block["blocked_ms"] = blocked_ms
+        report = {
+            "event": "event_loop_unblocked",
+            "route": episode["route"],
+            "request": episode["request"],
+            "blocked_ms": blocked_ms,
+        }
+        logging.warning(f"Event loop unblocked: {json.dumps(report, ensure_ascii=False)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "blocks": self.blocks,
+            "last_block": self.last_block,
+        }
+
+
+class LoopWatchdogMiddleware:
+    """ASGI middleware that lets the watchdog tell which request a task serves."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # The request's own task predates the ContextVar value; its children inherit it
+        task = asyncio.current_task()
+        loop_watchdog.requests[task] = scope
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_scope.reset(token)
+            loop_watchdog.requests.pop(task, None)
+
+
+loop_watchdog = LoopWatchdog(
+    enabled=os.getenv('LOOP_WATCHDOG_ENABLED', 'true').lower() == 'true',
+    interval=float(os.getenv('LOOP_WATCHDOG_INTERVAL_MS', 50)) / 1000,
+    threshold=float(os.getenv('LOOP_WATCHDOG_THRESHOLD_MS', 100)) / 1000,
+)
@@ -0,0 +1,339 @@
+"""Prometheus metrics, exposed as text at GET /metrics.
+
+A small in-process registry (counters, gauges and histograms with fixed
+labels) rendered in the Prometheus text exposition format. Recording a value
+is a dict lookup and a few integer additions under a lock, so it stays on in
+production; the work of cumulating buckets and formatting happens only when
+/metrics is scraped.
+
+Series:
+
+* profai_http_requests_in_flight, profai_http_request_duration_seconds by
+  method, route template and status (MetricsMiddleware);
+* profai_mongo_command_duration_seconds by collection, command and outcome
+  (MongoCommandMetrics, a pymongo command listener);
+* profai_llm_request_duration_seconds, profai_llm_requests_in_flight and
+  profai_llm_tokens_total from llm.py, profai_llm_parse_total from
+  response_parser.py;
+* profai_processing_duration_seconds for OCR, PDF, STT and TTS work;
+* profai_event_loop_lag_seconds and profai_event_loop_blocked_total by
+  route, from loop_watchdog.py.
+
+Label values must come from a bounded set (route templates, not raw paths).
+METRICS_ENABLED=false removes the middleware, the Mongo listener and the
+endpoint.
+
+The registry lives in one process. With several workers (gunicorn -w 4)
+set METRICS_MULTIPROC_DIR to a directory shared by the workers of one host:
+every METRICS_SYNC_INTERVAL seconds each worker writes its series to
+<pid>.json there, and the worker that answers a scrape writes its own file,
+then sums all of them. Counters and histograms of workers that exited keep
+counting (totals never go backwards); their gauges are dropped. Empty the
+directory before starting the server, as with prometheus_client.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, ...], object] = {}
+
+    def snapshot(self) -> Dict[Tuple[str, ...], object]:
+        with self.lock:
+            return {labels: list(value) if isinstance(value, list) else value
+                    for labels, value in self.series.items()}
+
+    def combine(self, total, value):
+        """Add one process's value of a series to the total of the others."""
+        return value if total is None else total + value
+
+    def render(self, series: Optional[Dict[Tuple[str, ...], object]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        if series is None:
+            series = self.snapshot()
+        for values, value in sorted(series.items()):
+            lines.extend(self._render_series(values, value))
+        return lines
+
+    def _render_series(self, values, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self.lock:
+            self.series[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        # Per-bucket (not cumulative) counts, then [sum, count]
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def combine(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def _render_series(self, values, series) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series):
+            cumulative += count
+            labels = _format_labels(self.labels, values, f'le="{_format_value(float(bound))}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+        lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self, directory: str = "", interval: float = 5.0):
+        self.metrics: List[Metric] = []
+        self.directory = directory
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        merged = self.merged() if self.directory else {}
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(merged.get(metric.name)))
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, live: bool = True):
+        """Write this process's series to <directory>/<pid>.json; without gauges once it stops."""
+        data = {
+            metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+            for metric in self.metrics if live or not isinstance(metric, Gauge)
+        }
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as handle:
+            json.dump(data, handle)
+        os.replace(f"{path}.tmp", path)
+
+    def merged(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        """Series of every process that wrote to the directory, summed."""
+        self.write_snapshot()
+        metrics = {metric.name: metric for metric in self.metrics}
+        merged: Dict[str, Dict[Tuple[str, ...], object]] = {name: {} for name in metrics}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                pid = int(os.path.basename(path)[:-len(".json")])
+                with open(path) as handle:
+                    data = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            live = _process_alive(pid)
+            for name, series in data.items():
+                metric = metrics.get(name)
+                if metric is None or (isinstance(metric, Gauge) and not live):
+                    continue
+                for labels, value in series:
+                    labels = tuple(labels)
+                    merged[name][labels] = metric.combine(merged[name].get(labels), value)
+        return merged
+
+    async def start(self):
+        if not self.directory or self.task is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.directory:
+            self.write_snapshot(live=False)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.write_snapshot)
+            except OSError as e:
+                logging.error(f"Metrics snapshot failed: {str(e)}")
+
+
+registry = Registry(
+    directory=METRICS_MULTIPROC_DIR,
+    interval=float(os.getenv('METRICS_SYNC_INTERVAL', 5)),
+)
+
+http_in_flight = registry.register(Gauge(
+    "profai_http_requests_in_flight", "HTTP requests currently being served."
+))
+http_duration = registry.register(Histogram(
+    "profai_http_request_duration_seconds", "HTTP request latency, including streamed bodies.",
+    ("method", "route", "status")
+))
+mongo_duration = registry.register(Histogram(
+    "profai_mongo_command_duration_seconds", "MongoDB command duration.",
+    ("collection", "command", "outcome"), DB_BUCKETS
+))
+llm_duration = registry.register(Histogram(
+    "profai_llm_request_duration_seconds", "LLM API call duration, including the wait for a concurrency slot.",
+    ("operation", "outcome"), SLOW_BUCKETS
+))
+llm_in_flight = registry.register(Gauge(
+    "profai_llm_requests_in_flight", "LLM API calls holding a concurrency slot.", ("operation",)
+))
+llm_tokens = registry.register(Counter(
+    "profai_llm_tokens_total", "Tokens reported by the LLM API.", ("model", "kind")
+))
+llm_parse = registry.register(Counter(
+    "profai_llm_parse_total", "Structured answer parse outcomes; failed ones get the fallback answer.",
+    ("outcome",)
+))
+processing_duration = registry.register(Histogram(
+    "profai_processing_duration_seconds", "Duration of OCR, PDF extraction, STT and TTS work.",
+    ("kind",), SLOW_BUCKETS
+))
+loop_lag = registry.register(Histogram(
+    "profai_event_loop_lag_seconds", "Delay of the event loop in running a timer that was due.", (), LAG_BUCKETS
+))
+loop_blocked = registry.register(Counter(
+    "profai_event_loop_blocked_total", "Times a callback blocked the event loop past the threshold.", ("route",)
+))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec()
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_duration.observe(time.perf_counter() - started, scope["method"], route, str(status))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding profai_mongo_command_duration_seconds."""
+
+    def __init__(self):
+        self.collections: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        command = event.command
+        name = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        self.collections[(event.connection_id, event.request_id)] = name if isinstance(name, str) else ""
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome: str):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        mongo_duration.observe(event.duration_micros / 1e6, collection, event.command_name, outcome)
+
+
+mongo_metrics = MongoCommandMetrics()
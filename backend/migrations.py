@@ -0,0 +1,36 @@
+"""One-time data migrations run from the startup hooks.
+
+Each migration is recorded in the `migrations` collection under its name.
+The marker is inserted before the migration runs, so with several workers
+starting at once only the one whose insert succeeds runs it; every later
+boot skips it without touching the migrated collection. A failed run
+removes its marker so the next boot retries. A marker left in "running" by a
+crashed process has to be deleted by hand (or the module's CLI re-run).
+"""
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+
+async def run_once(db, name: str, migrate: Callable[..., Awaitable]) -> bool:
+    """Run migrate(db) unless `name` already ran; True if it ran here."""
+    try:
+        await db.migrations.insert_one({"_id": name, "state": "running", "started_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        return False
+    except PyMongoError as e:
+        logging.error(f"Migration {name} not started: {str(e)}")
+        return False
+    try:
+        await migrate(db)
+    except Exception as e:
+        logging.error(f"Migration {name} failed: {str(e)}")
+        await db.migrations.delete_one({"_id": name})
+        return False
+    await db.migrations.update_one(
+        {"_id": name}, {"$set": {"state": "done", "finished_at": datetime.utcnow()}}
+    )
+    logging.info(f"Migration {name} done")
+    return True
@@ -0,0 +1,69 @@
+"""Keyset (cursor) pagination over (timestamp field, id), newest first.
+
+Cursors are the urlsafe-base64 JSON of [timestamp, id] of a page's edge
+document. Paging with them stays index-backed at any depth, unlike skip().
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, Response
+
+
+def encode_cursor(doc: Dict[str, Any], field: str) -> str:
+    raw = json.dumps([doc[field].isoformat(), doc["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), str(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def fetch_keyset_page(collection, query: Dict[str, Any], field: str, before: Optional[str],
+                            after: Optional[str], limit: int, projection: Dict[str, int]):
+    """Fetch one page ordered newest first on (field, id).
+
+    `before` pages towards older documents and `after` towards newer ones.
+    Returns (documents, before_cursor, after_cursor); a cursor is None when
+    there is nothing more in that direction.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    
+    if after:
+        timestamp, item_id = decode_cursor(after)
+        query = {**query, "$or": [{field: {"$gt": timestamp}}, {field: timestamp, "id": {"$gt": item_id}}]}
+        sort = [(field, 1), ("id", 1)]
+    else:
+        if before:
+            timestamp, item_id = decode_cursor(before)
+            query = {**query, "$or": [{field: {"$lt": timestamp}}, {field: timestamp, "id": {"$lt": item_id}}]}
+        sort = [(field, -1), ("id", -1)]
+    
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(None)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if after:
+        docs.reverse()
+    
+    if not docs:
+        return docs, None, None
+    older = True if after else has_more
+    newer = has_more if after else True
+    return (
+        docs,
+        encode_cursor(docs[-1], field) if older else None,
+        encode_cursor(docs[0], field) if newer else None
+    )
+
+
+def set_cursor_headers(response: Response, before_cursor: Optional[str], after_cursor: Optional[str]):
+    if before_cursor:
+        response.headers["X-Before-Cursor"] = before_cursor
+    if after_cursor:
+        response.headers["X-After-Cursor"] = after_cursor
@@ -0,0 +1,59 @@
+"""Password hashing off the event loop.
+
+bcrypt burns 100-300 ms of CPU per call, so hashing and verification run in a
+dedicated, size-limited thread pool (bcrypt releases the GIL while it works).
+At most PASSWORD_WORKERS calls run at once and PASSWORD_MAX_QUEUE more may
+wait; beyond that PasswordPoolBusy is raised so the route can answer 503
+instead of letting a login burst pile up behind the pool.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordPool:
+    def __init__(self, rounds: int = 12, workers: int = 4, max_queue: int = 64):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self.pending = 0
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordPoolBusy()
+        self.start()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(self.context.verify, password, hashed)
+
+
+password_pool = PasswordPool(
+    rounds=int(os.getenv('BCRYPT_ROUNDS', 12)),
+    workers=int(os.getenv('PASSWORD_WORKERS', min(4, os.cpu_count() or 1))),
+    max_queue=int(os.getenv('PASSWORD_MAX_QUEUE', 64)),
+)
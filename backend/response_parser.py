@@ -0,0 +1,263 @@
+"""Parsing of the tutor's structured (JSON) answers.
+
+parse_ai_response validates model output against AIPayload in tiers:
+
+* fast: the whole text is the JSON object (pydantic-core parses and
+  validates it in one pass);
+* extracted: the first balanced JSON object is cut out of surrounding prose
+  or code fences;
+* repaired: the output was truncated (e.g. by max_tokens), so the open
+  strings, arrays and objects are closed first.
+
+Fields the model left out get defaults and list items are coerced to text,
+so small drifts don't end in the generic fallback answer. type, xp and coins
+always follow the request type. Each outcome is counted in parse_stats.
+
+PartialJSONParser is also what the streaming endpoint uses to emit fields
+while the model is still writing them.
+"""
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+from metrics import llm_parse
+
+# XP and coins granted per request type, as stated in the system prompt
+REWARDS = {
+    "help": {"xp": 10, "coins": 2},
+    "hint": {"xp": 5, "coins": 1},
+    "answer": {"xp": 2, "coins": 1},
+}
+
+# "json_object" (JSON mode), "json_schema" (structured outputs) or "none"
+LLM_RESPONSE_FORMAT = os.getenv('LLM_RESPONSE_FORMAT', 'json_object').lower()
+
+
+class AIPayload(BaseModel):
+    type: str = ""
+    intro: str = ""
+    steps: List[str] = []
+    explanation: str = ""
+    final_answer: str = ""
+    examples: List[str] = []
+    follow_up_questions: List[str] = []
+    xp: int = 0
+    coins: int = 0
+
+    @field_validator("steps", "examples", "follow_up_questions", mode="before")
+    @classmethod
+    def text_list(cls, value):
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False)
+                for item in value if item is not None]
+
+    @field_validator("type", "intro", "explanation", "final_answer", mode="before")
+    @classmethod
+    def text(cls, value):
+        if value is None:
+            return ""
+        return value if isinstance(value, str) else str(value)
+
+    @field_validator("xp", "coins", mode="before")
+    @classmethod
+    def whole_number(cls, value):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
+
+
+def rewards(request_type: str) -> Dict[str, int]:
+    return REWARDS.get(request_type, REWARDS["answer"])
+
+
+def response_format() -> Optional[Dict[str, Any]]:
+    """The response_format argument for chat completions, or None."""
+    if LLM_RESPONSE_FORMAT == "json_object":
+        return {"type": "json_object"}
+    if LLM_RESPONSE_FORMAT == "json_schema":
+        # Strict structured outputs need every property required and no defaults
+        schema = AIPayload.model_json_schema()
+        for prop in schema["properties"].values():
+            prop.pop("default", None)
+        schema["required"] = list(schema["properties"])
+        schema["additionalProperties"] = False
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "profai_response", "schema": schema, "strict": True},
+        }
+    return None
+
+
+class ParseStats:
+    def __init__(self):
+        self.outcomes = {"fast": 0, "extracted": 0, "repaired": 0, "failed": 0}
+
+    def record(self, outcome: str):
+        self.outcomes[outcome] += 1
+        llm_parse.inc(outcome)
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.outcomes.values())
+        return {
+            **self.outcomes,
+            "failure_rate": round(self.outcomes["failed"] / total, 4) if total else 0.0,
+        }
+
+
+parse_stats = ParseStats()
+
+
+class PartialJSONParser:
+    """Incrementally scans streamed model output and returns the best-effort
+    object seen so far, closing any open strings, arrays and objects."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.start = -1
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.cuts = []  # (end index, closers) of safe truncation points
+        self.end = -1
+
+    def feed(self, text: str):
+        offset = len(self.buffer)
+        self.buffer += text
+        if self.end >= 0:
+            return
+        for i, ch in enumerate(text, offset):
+            if self.start < 0:
+                if ch == '{':
+                    self.start = i
+                    self.stack.append('}')
+                    self.cuts.append((i + 1, '}'))
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.stack.append('}' if ch == '{' else ']')
+                self.cuts.append((i + 1, ''.join(reversed(self.stack))))
+            elif ch in '}]':
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    self.end = i + 1
+                    return
+            elif ch == ',':
+                self.cuts.append((i, ''.join(reversed(self.stack))))
+
+    @property
+    def complete(self) -> bool:
+        return self.end >= 0
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        if self.start < 0:
+            return None
+        if self.end >= 0:
+            candidates = [self.buffer[self.start:self.end]]
+        else:
+            head = self.buffer[self.start:]
+            if self.in_string:
+                if self.escape:
+                    head = head[:-1]
+                head = re.sub(r'\\u[0-9a-fA-F]{0,3}$', '', head) + '"'
+            candidates = [head + ''.join(reversed(self.stack))]
+            candidates += [self.buffer[self.start:end] + closers for end, closers in reversed(self.cuts[-4:])]
+        for candidate in candidates:
+            try:
+                parsed = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(parsed, dict):
+                return parsed
+        return None
+
+
+def _usable(payload: Optional[AIPayload]) -> bool:
+    return payload is not None and bool(payload.intro or payload.explanation or payload.steps or payload.final_answer)
+
+
+def _finish(payload: AIPayload, request_type: str) -> Dict[str, Any]:
+    return {**payload.model_dump(), "type": request_type, **rewards(request_type)}
+
+
+def parse_ai_response(ai_text: str, request_type: str) -> Optional[Dict[str, Any]]:
+    """Parse the model output; None if no usable answer can be recovered."""
+    try:
+        payload = AIPayload.model_validate_json(ai_text)
+        if _usable(payload):
+            parse_stats.record("fast")
+            return _finish(payload, request_type)
+    except ValidationError:
+        pass
+
+    parser = PartialJSONParser()
+    parser.feed(ai_text)
+    candidate = parser.snapshot()
+    if candidate is not None:
+        try:
+            payload = AIPayload.model_validate(candidate)
+        except ValidationError:
+            payload = None
+        if _usable(payload):
+            parse_stats.record("extracted" if parser.complete else "repaired")
+            return _finish(payload, request_type)
+
+    parse_stats.record("failed")
+    return None
+
+
+def fallback_ai_response(ai_text: str, request_type: str) -> Dict[str, Any]:
+    return {
+        "type": request_type,
+        "intro": "Vou te ajudar com essa questão!",
+        "steps": ["Analisando sua pergunta", "Preparando explicação"],
+        "explanation": ai_text,
+        "final_answer": ai_text if request_type == "answer" else "",
+        "examples": ["Consulte materiais complementares"],
+        "follow_up_questions": ["Ficou alguma dúvida?"],
+        **rewards(request_type),
+    }
+
+
+STREAM_FIELDS = ("intro", "steps", "explanation")
+
+
+def partial_ai_events(partial: Dict[str, Any], sent: Dict[str, Any]):
+    """Diff a partial AI payload against what was already sent and return
+    (event, data) pairs for the new text in intro, steps and explanation."""
+    events = []
+    for field in STREAM_FIELDS:
+        value = partial.get(field)
+        if field == "steps":
+            if not isinstance(value, list):
+                continue
+            for index, step in enumerate(value):
+                if not isinstance(step, str):
+                    continue
+                while len(sent["steps"]) <= index:
+                    sent["steps"].append("")
+                previous = sent["steps"][index]
+                if len(step) > len(previous) and step.startswith(previous):
+                    events.append(("step", {"index": index, "delta": step[len(previous):]}))
+                    sent["steps"][index] = step
+        elif isinstance(value, str):
+            previous = sent[field]
+            if len(value) > len(previous) and value.startswith(previous):
+                events.append((field, {"delta": value[len(previous):]}))
+                sent[field] = value
+    return events
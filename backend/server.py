@@ -1,6 +1,6 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -13,30 +13,51 @@ from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timedelta
 import jwt
-from passlib.context import CryptContext
 import openai
-import re
-from io import BytesIO
-import base64
-from PIL import Image
 import asyncio
+import time
 import tempfile
-import shutil
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Local modules read their settings from the environment, so import them after .env
+from metrics import METRICS_ENABLED, MetricsMiddleware, mongo_metrics, registry as metrics_registry
+from loop_watchdog import LoopWatchdogMiddleware, loop_watchdog
+from llm import llm_pool, inflight, prompt_key
+from user_cache import user_cache, dashboard_cache
+from passwords import password_pool, PasswordPoolBusy
+from indexes import ensure_indexes
+from tasks import background_queue
+from migrations import run_once
+from writes import write_behind
+from leaderboard import leaderboards
+from pagination import fetch_keyset_page, set_cursor_headers
+from achievements import DEFAULT_ACHIEVEMENTS, achievement_engine, backfill_user_stats
+from answer_cache import answer_cache
+from uploads import UploadSizeLimitMiddleware, inspect_upload, upload_stats
+from storage import save_upload, cleanup_unreferenced_blobs
+from response_parser import (
+    PartialJSONParser, parse_ai_response, fallback_ai_response, partial_ai_events, response_format, parse_stats
+)
+from tts import tts_service
+from stt import stt_service
+from avatars import (
+    AVATAR_MEDIA_TYPES, AVATAR_FORMAT, AVATAR_HASH, avatar_path, avatar_url, closest_size,
+    save_avatar, migrate_base64_avatars
+)
+from extraction import extraction_pool, extraction_queue, placeholder_text
+
 # Initialize OpenAI
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_metrics] if METRICS_ENABLED else [])
 db = client[os.environ['DB_NAME']]
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Create the main app
 app = FastAPI(title="ProfAI - Educational AI Assistant")
@@ -49,11 +70,11 @@ class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     email: EmailStr
     username: str
-    password_hash: str
+    password_hash: str = ""  # Not loaded for authenticated requests
     full_name: str
     grade: str  # "1º EF" to "9º EF"
     school: str = ""
-    avatar: str = ""  # Base64 encoded image
+    avatar_hash: str = ""  # Served from /api/avatars/{avatar_hash}
     ai_style: str = "paciente"  # Teaching style preference
     xp: int = 0
     coins: int = 0
@@ -81,7 +102,7 @@ class UserProfile(BaseModel):
     full_name: str
     grade: str
     school: str
-    avatar: str
+    avatar_url: str
     ai_style: str
     xp: int
     coins: int
@@ -93,6 +114,8 @@ class Conversation(BaseModel):
     title: str
     subject: str
     summary: str = ""
+    summarized_until: Optional[datetime] = None  # created_at of the last message folded into summary
+    message_count: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
@@ -124,15 +147,23 @@ class Achievement(BaseModel):
     description: str
     icon: str
     xp_required: int
-    condition_type: str  # "xp_total", "conversations_count", "streak_days"
+    condition_type: str  # "xp_total", "conversations_count", "questions_count", "messages_count", "subjects_count", "streak_days"
     condition_value: int
 
+achievement_engine.configure([Achievement(**rule) for rule in DEFAULT_ACHIEVEMENTS], db.user_stats)
+
 # Authentication functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_pool.verify(plain_password, hashed_password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_pool.hash(password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -152,109 +183,130 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    user = await db.users.find_one({"id": user_id})
+    user = user_cache.get(user_id)
     if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
+        user = await db.users.find_one({"id": user_id}, user_cache.projection)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_cache.set(user_id, user)
     return User(**user)
 
 # AI Service
-async def generate_ai_response(message: str, request_type: str, subject: str, user_style: str, conversation_history: List[Dict] = None):
-    try:
-        # Prepare the system message based on user's AI style and grade
-        style_prompts = {
-            "paciente": "Seja muito paciente e detalhado. Explique passo a passo com calma.",
-            "direto": "Seja direto e objetivo nas explicações, sem rodeios.",
-            "poético": "Use uma linguagem mais poética e criativa nas explicações.",
-            "motivacional": "Seja encorajador e motivacional em suas respostas."
+def build_ai_messages(message: str, request_type: str, subject: str, user_style: str, conversation_history: List[Dict] = None, summary: str = ""):
+    # Prepare the system message based on user's AI style and grade
+    style_prompts = {
+        "paciente": "Seja muito paciente e detalhado. Explique passo a passo com calma.",
+        "direto": "Seja direto e objetivo nas explicações, sem rodeios.",
+        "poético": "Use uma linguagem mais poética e criativa nas explicações.",
+        "motivacional": "Seja encorajador e motivacional em suas respostas."
+    }
+    
+    system_prompt = f"""
+    Você é o ProfAI, um assistente educacional especializado em {subject}. 
+    Estilo de ensino: {style_prompts.get(user_style, 'Seja paciente e detalhado')}.
+    
+    Sua resposta DEVE SEMPRE ser um JSON válido no seguinte formato:
+    {{
+        "type": "{request_type}",
+        "intro": "mensagem motivacional curta",
+        "steps": ["passo 1", "passo 2", "passo 3"],
+        "explanation": "explicação detalhada do conceito",
+        "final_answer": "resposta final completa (apenas quando type=answer)",
+        "examples": ["exemplo 1", "exemplo 2"],
+        "follow_up_questions": ["pergunta 1", "pergunta 2"],
+        "xp": {{"10" if request_type == "help" else "5" if request_type == "hint" else "2"}},
+        "coins": {{"2" if request_type == "help" else "1" if request_type == "hint" else "1"}}
+    }}
+    
+    Regras importantes:
+    - type deve ser exatamente: "{request_type}"
+    - Para type="help": dê orientações e dicas sem dar a resposta final
+    - Para type="hint": dê uma dica específica sem revelar a resposta completa  
+    - Para type="answer": forneça a resposta completa no campo "final_answer"
+    - Sempre inclua XP e coins conforme as regras: help=10 XP/2 coins, hint=5 XP/1 coin, answer=2 XP/1 coin
+    """
+    
+    # Build conversation context
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    if summary:
+        messages.append({"role": "system", "content": f"Resumo da conversa até aqui: {summary}"})
+    
+    if conversation_history:
+        # History is already bounded by load_chat_history
+        for msg in conversation_history:
+            messages.append({
+                "role": msg.get("role", "user"),
+                "content": msg.get("content", "")
+            })
+    
+    messages.append({"role": "user", "content": message})
+    return messages
+
+class AIRequest:
+    """A tutor answer request: the chat completion to send and its answer-cache entry.
+
+    Shared by /chat and /chat/stream so both send the same completion request
+    and parse and cache answers the same way.
+    """
+
+    def __init__(self, message: str, request_type: str, subject: str, user_style: str,
+                 conversation_history: List[Dict] = None, summary: str = "", grade: str = ""):
+        self.request_type = request_type
+        # Context-free questions can be answered from the answer cache
+        self.cacheable = answer_cache.cacheable(conversation_history, summary)
+        self.cache_key = (message, subject, request_type, user_style, grade)
+        self.embedding: Optional[List[float]] = None
+        self.completion = {
+            "model": os.getenv('MODEL_NAME', 'gpt-4o-mini'),
+            "messages": build_ai_messages(message, request_type, subject, user_style, conversation_history, summary),
+            "max_tokens": 1500,
+            "temperature": 0.7
         }
+        if response_format():
+            self.completion["response_format"] = response_format()
+
+    async def cached(self) -> Optional[Dict[str, Any]]:
+        if not self.cacheable:
+            return None
+        # A miss keeps the question's embedding for finish() to store with the answer
+        ai_response, self.embedding = await answer_cache.get(*self.cache_key)
+        return ai_response
+
+    async def finish(self, ai_text: str, started: float) -> Dict[str, Any]:
+        """Parse the model output, caching usable answers; falls back to the raw text."""
+        ai_response = parse_ai_response(ai_text, self.request_type)
+        if ai_response is None:
+            return fallback_ai_response(ai_text, self.request_type)
+        if self.cacheable:
+            await answer_cache.set(*self.cache_key, ai_response, time.perf_counter() - started,
+                                   embedding=self.embedding)
+        return ai_response
+
+async def generate_ai_response(message: str, request_type: str, subject: str, user_style: str, conversation_history: List[Dict] = None, summary: str = "", grade: str = ""):
+    try:
+        ai_request = AIRequest(message, request_type, subject, user_style, conversation_history, summary, grade)
+        cached = await ai_request.cached()
+        if cached:
+            return cached
         
-        system_prompt = f"""
-        Você é o ProfAI, um assistente educacional especializado em {subject}. 
-        Estilo de ensino: {style_prompts.get(user_style, 'Seja paciente e detalhado')}.
-        
-        Sua resposta DEVE SEMPRE ser um JSON válido no seguinte formato:
-        {{
-            "type": "{request_type}",
-            "intro": "mensagem motivacional curta",
-            "steps": ["passo 1", "passo 2", "passo 3"],
-            "explanation": "explicação detalhada do conceito",
-            "final_answer": "resposta final completa (apenas quando type=answer)",
-            "examples": ["exemplo 1", "exemplo 2"],
-            "follow_up_questions": ["pergunta 1", "pergunta 2"],
-            "xp": {{"10" if request_type == "help" else "5" if request_type == "hint" else "2"}},
-            "coins": {{"2" if request_type == "help" else "1" if request_type == "hint" else "1"}}
-        }}
-        
-        Regras importantes:
-        - type deve ser exatamente: "{request_type}"
-        - Para type="help": dê orientações e dicas sem dar a resposta final
-        - Para type="hint": dê uma dica específica sem revelar a resposta completa  
-        - Para type="answer": forneça a resposta completa no campo "final_answer"
-        - Sempre inclua XP e coins conforme as regras: help=10 XP/2 coins, hint=5 XP/1 coin, answer=2 XP/1 coin
-        """
-        
-        # Build conversation context
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        if conversation_history:
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                messages.append({
-                    "role": msg.get("role", "user"),
-                    "content": msg.get("content", "")
-                })
-        
-        messages.append({"role": "user", "content": message})
-        
-        # Call OpenAI
-        client_openai = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        response = client_openai.chat.completions.create(
-            model=os.getenv('MODEL_NAME', 'gpt-4o-mini'),
-            messages=messages,
-            max_tokens=1500,
-            temperature=0.7
-        )
-        
-        ai_text = response.choices[0].message.content
+        async def call_llm():
+            # Call OpenAI through the shared async client
+            started = time.perf_counter()
+            response = await llm_pool.chat_completion(**ai_request.completion)
+            return await ai_request.finish(response.choices[0].message.content, started)
         
-        # Try to parse as JSON
-        try:
-            ai_response = json.loads(ai_text)
-            
-            # Validate required fields
-            required_fields = ["type", "intro", "steps", "explanation", "examples", "follow_up_questions", "xp", "coins"]
-            for field in required_fields:
-                if field not in ai_response:
-                    raise ValueError(f"Missing required field: {field}")
-            
-            return ai_response
-            
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract with regex
-            try:
-                json_match = re.search(r'\{.*\}', ai_text, re.DOTALL)
-                if json_match:
-                    ai_response = json.loads(json_match.group())
-                    return ai_response
-            except:
-                pass
-            
-            # Fallback response
-            return {
-                "type": request_type,
-                "intro": "Vou te ajudar com essa questão!",
-                "steps": ["Analisando sua pergunta", "Preparando explicação"],
-                "explanation": ai_text,
-                "final_answer": ai_text if request_type == "answer" else "",
-                "examples": ["Consulte materiais complementares"],
-                "follow_up_questions": ["Ficou alguma dúvida?"],
-                "xp": 10 if request_type == "help" else 5 if request_type == "hint" else 2,
-                "coins": 2 if request_type == "help" else 1
-            }
+        # Identical prompts in flight at the same time share one upstream call
+        ai_response = await inflight.do(prompt_key(**ai_request.completion), call_llm)
+        return dict(ai_response)
             
     except Exception as e:
         logging.error(f"AI generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AI generation failed: {str(e)}")
 
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 # Routes
 @api_router.post("/auth/register", response_model=Dict[str, str])
 async def register(user_data: UserCreate):
@@ -271,7 +323,7 @@ async def register(user_data: UserCreate):
     user = User(
         email=user_data.email,
         username=user_data.username,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=await get_password_hash(user_data.password),
         full_name=user_data.full_name,
         grade=user_data.grade,
         school=user_data.school,
@@ -292,7 +344,7 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=Dict[str, str])
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    if not user or not await verify_password(user_data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token = create_access_token(data={"sub": user["id"]})
@@ -312,7 +364,7 @@ async def get_current_user_profile(current_user: User = Depends(get_current_user
         full_name=current_user.full_name,
         grade=current_user.grade,
         school=current_user.school,
-        avatar=current_user.avatar,
+        avatar_url=avatar_url(current_user.avatar_hash),
         ai_style=current_user.ai_style,
         xp=current_user.xp,
         coins=current_user.coins,
@@ -340,20 +392,35 @@ async def update_profile(
         update_data["ai_style"] = ai_style
     
     if avatar:
-        # Convert image to base64
-        contents = await avatar.read()
-        image = Image.open(BytesIO(contents))
-        image.thumbnail((200, 200))  # Resize for efficiency
-        buffer = BytesIO()
-        image.save(buffer, format='PNG')
-        avatar_base64 = base64.b64encode(buffer.getvalue()).decode()
-        update_data["avatar"] = avatar_base64
+        # Store the resized sizes once; the user document keeps only the hash
+        avatar_info = await inspect_upload(avatar, ("image",))
+        try:
+            update_data["avatar_hash"] = await save_avatar(await avatar.read(), avatar_info.content_hash)
+        except Exception as e:
+            logging.error(f"Avatar processing error: {str(e)}")
+            raise HTTPException(status_code=400, detail="Invalid image")
     
     if update_data:
         await db.users.update_one({"id": current_user.id}, {"$set": update_data})
+        user_cache.invalidate(current_user.id)
     
     return {"message": "Profile updated successfully"}
 
+@api_router.get("/avatars/{avatar_hash}")
+async def get_avatar(avatar_hash: str, request: Request, size: Optional[int] = Query(None, ge=1, le=1024)):
+    """Avatar image; URLs are content-addressed, so responses are cached forever."""
+    if not AVATAR_HASH.match(avatar_hash):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    rendered = closest_size(size)
+    etag = f'"{avatar_hash}-{rendered}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    path = avatar_path(avatar_hash, rendered)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    return FileResponse(path, media_type=AVATAR_MEDIA_TYPES.get(AVATAR_FORMAT), headers=headers)
+
 @api_router.post("/conversations", response_model=Conversation)
 async def create_conversation(
     conversation_data: ConversationCreate,
@@ -365,32 +432,212 @@ async def create_conversation(
         subject=conversation_data.subject
     )
     
-    await db.conversations.insert_one(conversation.dict())
+    await asyncio.gather(
+        db.conversations.insert_one(conversation.dict()),
+        achievement_engine.conversation_created(current_user.id, conversation.subject)
+    )
+    dashboard_cache.invalidate(current_user.id)
     return conversation
 
 @api_router.get("/conversations", response_model=List[Conversation])
-async def get_conversations(current_user: User = Depends(get_current_user)):
-    conversations = await db.conversations.find(
-        {"user_id": current_user.id, "is_active": True}
-    ).sort("updated_at", -1).to_list(100)
+async def get_conversations(
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user)
+):
+    """List active conversations, most recently updated first.
+
+    Pass the X-Before-Cursor / X-After-Cursor response headers back as
+    `before` / `after` to load older or newer pages.
+    """
+    conversations, before_cursor, after_cursor = await fetch_keyset_page(
+        db.conversations,
+        {"user_id": current_user.id, "is_active": True},
+        "updated_at", before, after, limit, {"_id": 0}
+    )
+    set_cursor_headers(response, before_cursor, after_cursor)
     
     return [Conversation(**conv) for conv in conversations]
 
 @api_router.get("/conversations/{conversation_id}/messages", response_model=List[Message])
 async def get_messages(
     conversation_id: str,
+    response: Response,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    include_ai_response: bool = False,
     current_user: User = Depends(get_current_user)
 ):
+    """Return one page of messages in chronological order (latest page by default).
+
+    The structured `ai_response` payload is only included when requested.
+    """
     # Verify conversation belongs to user
-    conversation = await db.conversations.find_one({"id": conversation_id, "user_id": current_user.id})
+    conversation = await db.conversations.find_one(
+        {"id": conversation_id, "user_id": current_user.id}, {"_id": 0, "id": 1}
+    )
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = await db.messages.find(
-        {"conversation_id": conversation_id}
-    ).sort("created_at", 1).to_list(1000)
+    projection = {"_id": 0} if include_ai_response else {"_id": 0, "ai_response": 0}
+    messages, before_cursor, after_cursor = await fetch_keyset_page(
+        db.messages,
+        {"conversation_id": conversation_id},
+        "created_at", before, after, limit, projection
+    )
+    set_cursor_headers(response, before_cursor, after_cursor)
+    
+    return [Message(**msg) for msg in reversed(messages)]
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token plus per-message overhead; avoids a tokenizer dependency
+    return len(text) // 4 + 4
+
+async def load_chat_history(conversation_id: str, summarized_until: Optional[datetime] = None):
+    """Newest messages of a conversation that fit the context budget, oldest first.
+
+    Messages already folded into the conversation summary are skipped.
+    """
+    max_messages = int(os.getenv('MAX_HISTORY_MESSAGES', 30))
+    token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+    
+    query = {"conversation_id": conversation_id}
+    if summarized_until:
+        query["created_at"] = {"$gt": summarized_until}
+    recent_messages = await db.messages.find(
+        query,
+        {"_id": 0, "role": 1, "content": 1}
+    ).sort([("created_at", -1), ("id", -1)]).limit(max_messages).to_list(None)
+    
+    history = []
+    used_tokens = 0
+    for msg in recent_messages:
+        content = msg.get("content", "")
+        cost = estimate_tokens(content)
+        if used_tokens + cost > token_budget:
+            if not history:
+                # Always keep the latest turn, trimmed to the budget
+                history.append({"role": msg["role"], "content": content[-token_budget * 4:]})
+            break
+        history.append({"role": msg["role"], "content": content})
+        used_tokens += cost
+    
+    history.reverse()
+    return history
+
+def new_user_message(chat_request: ChatRequest) -> Message:
+    # Built before the LLM call so its created_at precedes the answer's
+    return Message(
+        conversation_id=chat_request.conversation_id,
+        content=chat_request.message,
+        role="user",
+        message_type=chat_request.request_type
+    )
+
+async def save_chat_turn(chat_request: ChatRequest, user: User, user_message: Message,
+                         ai_response: Dict[str, Any], message_count: int = 0):
+    """Persist a chat turn: both messages, the XP/coins reward and the conversation's
+    updated_at/message_count, in concurrent writes (or one transaction), plus the
+    user's achievement counters."""
+    user_id = user.id
+    # Update user XP and coins (ensure numeric values)
+    xp_earned = int(ai_response.get("xp", 0))
+    coins_earned = int(ai_response.get("coins", 0))
+    
+    # Create assistant message
+    assistant_message = Message(
+        conversation_id=chat_request.conversation_id,
+        content=ai_response.get("explanation", ""),
+        role="assistant",
+        message_type=chat_request.request_type,
+        ai_response=ai_response,
+        xp_earned=xp_earned,
+        coins_earned=coins_earned
+    )
     
-    return [Message(**msg) for msg in messages]
+    messages = [user_message.dict(), assistant_message.dict()]
+    reward = {"$inc": {"xp": xp_earned, "coins": coins_earned}}
+    touched = {"updated_at": assistant_message.created_at}
+    
+    if os.getenv('CHAT_WRITE_TRANSACTION', 'false').lower() == 'true':
+        # Needs a replica set; all four writes commit or none do
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                await db.messages.insert_many(messages, session=session)
+                await db.users.update_one({"id": user_id}, reward, session=session)
+                await db.conversations.update_one(
+                    {"id": chat_request.conversation_id},
+                    {"$set": touched, "$inc": {"message_count": 2}},
+                    session=session
+                )
+        await achievement_engine.chat_turn_saved(user_id, user.xp + xp_earned)
+    else:
+        # Messages and XP are always written before responding; the conversation
+        # timestamp/count may be deferred to the write-behind buffer
+        await asyncio.gather(
+            db.messages.insert_many(messages),
+            db.users.update_one({"id": user_id}, reward),
+            write_behind.update("conversations", chat_request.conversation_id, touched, {"message_count": 2}),
+            achievement_engine.chat_turn_saved(user_id, user.xp + xp_earned)
+        )
+    user_cache.increment(user_id, {"xp": xp_earned, "coins": coins_earned})
+    dashboard_cache.invalidate(user_id)
+    leaderboards.record_xp(user_id, user.school, user.grade, xp_earned)
+    
+    # Refresh the rolling summary every SUMMARIZE_EVERY_MESSAGES messages
+    every = int(os.getenv('SUMMARIZE_EVERY_MESSAGES', 10))
+    count = message_count + 2
+    if every > 0 and count // every > (count - 2) // every:
+        background_queue.submit(
+            f"summary:{chat_request.conversation_id}", summarize_conversation, chat_request.conversation_id
+        )
+    
+    return assistant_message
+
+async def summarize_conversation(conversation_id: str):
+    """Fold messages older than the recent window into Conversation.summary."""
+    keep_recent = int(os.getenv('SUMMARY_KEEP_RECENT', 6))
+    conversation = await db.conversations.find_one(
+        {"id": conversation_id}, {"_id": 0, "summary": 1, "summarized_until": 1}
+    )
+    if not conversation:
+        return
+    
+    query = {"conversation_id": conversation_id}
+    if conversation.get("summarized_until"):
+        query["created_at"] = {"$gt": conversation["summarized_until"]}
+    pending = await db.messages.find(
+        query, {"_id": 0, "role": 1, "content": 1, "created_at": 1}
+    ).sort([("created_at", 1), ("id", 1)]).to_list(None)
+    to_fold = pending[:-keep_recent] if keep_recent else pending
+    if not to_fold:
+        return
+    
+    transcript = "\n".join(
+        f"{'Aluno' if msg['role'] == 'user' else 'ProfAI'}: {msg['content'][:1000]}" for msg in to_fold
+    )
+    response = await llm_pool.chat_completion(
+        model=os.getenv('SUMMARY_MODEL_NAME', os.getenv('MODEL_NAME', 'gpt-4o-mini')),
+        messages=[
+            {"role": "system", "content": (
+                "Você resume conversas de estudo entre um aluno e o ProfAI. "
+                "Atualize o resumo existente com os novos trechos, mantendo os conceitos estudados, "
+                "dúvidas do aluno e o que já foi explicado. Responda apenas com o resumo, em até 150 palavras."
+            )},
+            {"role": "user", "content": f"Resumo atual: {conversation.get('summary') or '(vazio)'}\n\nNovos trechos:\n{transcript}"}
+        ],
+        max_tokens=300,
+        temperature=0.3
+    )
+    summary = (response.choices[0].message.content or "").strip()
+    if summary:
+        await db.conversations.update_one(
+            {"id": conversation_id},
+            {"$set": {"summary": summary, "summarized_until": to_fold[-1]["created_at"]}}
+        )
 
 @api_router.post("/chat", response_model=Message)
 async def chat(
@@ -398,28 +645,18 @@ async def chat(
     current_user: User = Depends(get_current_user)
 ):
     # Verify conversation belongs to user
-    conversation = await db.conversations.find_one({
-        "id": chat_request.conversation_id, 
-        "user_id": current_user.id
-    })
+    conversation = await db.conversations.find_one(
+        {"id": chat_request.conversation_id, "user_id": current_user.id},
+        {"_id": 0, "subject": 1, "summary": 1, "summarized_until": 1, "message_count": 1}
+    )
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     # Get conversation history
-    history_messages = await db.messages.find(
-        {"conversation_id": chat_request.conversation_id}
-    ).sort("created_at", 1).limit(int(os.getenv('MAX_HISTORY_MESSAGES', 30))).to_list(None)
-    
-    history = [{"role": msg["role"], "content": msg["content"]} for msg in history_messages]
+    history = await load_chat_history(chat_request.conversation_id, conversation.get("summarized_until"))
     
-    # Save user message
-    user_message = Message(
-        conversation_id=chat_request.conversation_id,
-        content=chat_request.message,
-        role="user",
-        message_type=chat_request.request_type
-    )
-    await db.messages.insert_one(user_message.dict())
+    # The user message is saved together with the answer
+    user_message = new_user_message(chat_request)
     
     try:
         # Generate AI response
@@ -428,59 +665,121 @@ async def chat(
             chat_request.request_type,
             chat_request.subject or conversation["subject"],
             current_user.ai_style,
-            history
-        )
-        
-        # Create assistant message
-        assistant_message = Message(
-            conversation_id=chat_request.conversation_id,
-            content=ai_response.get("explanation", ""),
-            role="assistant",
-            message_type=chat_request.request_type,
-            ai_response=ai_response,
-            xp_earned=int(ai_response.get("xp", 0)),
-            coins_earned=int(ai_response.get("coins", 0))
+            history,
+            conversation.get("summary", ""),
+            current_user.grade
         )
         
-        await db.messages.insert_one(assistant_message.dict())
-        
-        # Update user XP and coins (ensure numeric values)
-        xp_earned = int(ai_response.get("xp", 0))
-        coins_earned = int(ai_response.get("coins", 0))
-        
-        await db.users.update_one(
-            {"id": current_user.id},
-            {
-                "$inc": {
-                    "xp": xp_earned,
-                    "coins": coins_earned
-                }
-            }
+        return await save_chat_turn(
+            chat_request, current_user, user_message, ai_response, conversation.get("message_count", 0)
         )
         
-        # Update conversation timestamp
-        await db.conversations.update_one(
-            {"id": chat_request.conversation_id},
-            {"$set": {"updated_at": datetime.utcnow()}}
-        )
-        
-        return assistant_message
-        
     except Exception as e:
         logging.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail="Chat generation failed")
 
+@api_router.post("/chat/stream")
+async def chat_stream(
+    chat_request: ChatRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the AI answer as server-sent events.
+
+    Emits `intro`, `step` and `explanation` events carrying text deltas as the
+    model produces them, then a `done` event with the saved assistant Message
+    (or an `error` event if generation fails).
+    """
+    conversation = await db.conversations.find_one(
+        {"id": chat_request.conversation_id, "user_id": current_user.id},
+        {"_id": 0, "subject": 1, "summary": 1, "summarized_until": 1, "message_count": 1}
+    )
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    history = await load_chat_history(chat_request.conversation_id, conversation.get("summarized_until"))
+    user_message = new_user_message(chat_request)
+    
+    ai_request = AIRequest(
+        chat_request.message,
+        chat_request.request_type,
+        chat_request.subject or conversation["subject"],
+        current_user.ai_style,
+        history,
+        conversation.get("summary", ""),
+        current_user.grade
+    )
+    
+    async def event_stream():
+        parser = PartialJSONParser()
+        sent = {"intro": "", "steps": [], "explanation": ""}
+        # Open the stream right away so proxies and clients see the first byte
+        yield ": stream open\n\n"
+        try:
+            ai_response = await ai_request.cached()
+            if ai_response:
+                for event, data in partial_ai_events(ai_response, sent):
+                    yield sse_event(event, data)
+            else:
+                started = time.perf_counter()
+                async for delta in llm_pool.stream_chat_completion(**ai_request.completion):
+                    parser.feed(delta)
+                    partial = parser.snapshot()
+                    if partial:
+                        for event, data in partial_ai_events(partial, sent):
+                            yield sse_event(event, data)
+                ai_response = await ai_request.finish(parser.buffer, started)
+            
+            assistant_message = await save_chat_turn(
+                chat_request, current_user, user_message, ai_response, conversation.get("message_count", 0)
+            )
+            yield sse_event("done", assistant_message.dict())
+            
+        except Exception as e:
+            logging.error(f"Chat stream error: {str(e)}")
+            yield sse_event("error", {"detail": "Chat generation failed"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def load_dashboard_stats(user: User) -> Dict[str, Any]:
+    """Counters and achievements from the user's stats document, plus recent conversations."""
+    stats = dashboard_cache.get(user.id)
+    if stats is not None:
+        return stats
+    
+    # The recent conversations are served by the user_active_updated_id index
+    user_stats, recent = await asyncio.gather(
+        achievement_engine.load(user.id, user.xp),
+        db.conversations.find(
+            {"user_id": user.id, "is_active": True},
+            {"_id": 0, "id": 1, "title": 1, "subject": 1, "updated_at": 1}
+        ).sort([("updated_at", -1), ("id", -1)]).limit(5).to_list(5)
+    )
+    
+    stats = {
+        "total_conversations": user_stats.get("conversations", 0),
+        "total_messages": user_stats.get("messages", 0),
+        "subjects_studied": len(user_stats.get("subjects", [])),
+        "streak_days": user_stats.get("streak_days", 0),
+        "achievements": achievement_engine.summary(user_stats),
+        "recent_conversations": [
+            {
+                "id": conv["id"],
+                "title": conv["title"],
+                "subject": conv["subject"],
+                "updated_at": conv["updated_at"].isoformat()
+            } for conv in recent
+        ]
+    }
+    dashboard_cache.set(user.id, stats)
+    return stats
+
 @api_router.get("/dashboard")
 async def get_dashboard(current_user: User = Depends(get_current_user)):
-    # Get recent conversations
-    recent_conversations = await db.conversations.find(
-        {"user_id": current_user.id, "is_active": True}
-    ).sort("updated_at", -1).limit(5).to_list(None)
-    
-    # Get total conversations count
-    total_conversations = await db.conversations.count_documents(
-        {"user_id": current_user.id, "is_active": True}
-    )
+    stats = await load_dashboard_stats(current_user)
     
     # Calculate level (every 100 XP = 1 level)
     level = max(1, current_user.xp // 100 + 1)
@@ -494,26 +793,55 @@ async def get_dashboard(current_user: User = Depends(get_current_user)):
             "coins": current_user.coins,
             "level": level,
             "next_level_xp": next_level_xp,
-            "avatar": current_user.avatar
+            "avatar_url": avatar_url(current_user.avatar_hash)
         },
         "stats": {
-            "total_conversations": total_conversations,
-            "total_messages": await db.messages.count_documents({"conversation_id": {"$in": [conv["id"] for conv in recent_conversations]}}),
-            "subjects_studied": len(set([conv["subject"] for conv in recent_conversations]))
+            "total_conversations": stats["total_conversations"],
+            "total_messages": stats["total_messages"],
+            "subjects_studied": stats["subjects_studied"],
+            "streak_days": stats["streak_days"]
         },
-        "recent_conversations": [
+        "recent_conversations": stats["recent_conversations"],
+        "achievements": stats["achievements"]
+    }
+
+@api_router.get("/leaderboard")
+async def get_leaderboard(
+    scope: str = Query("class", pattern="^(school|class|grade)$"),
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """This week's XP ranking of the user's school, class (school + grade) or grade."""
+    key, board = await leaderboards.board(scope, current_user.school, current_user.grade)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Set your school to see this leaderboard")
+    
+    page = board.top(limit, offset) if board else []
+    users = await db.users.find(
+        {"id": {"$in": [user_id for _, user_id, _ in page]}},
+        {"_id": 0, "id": 1, "username": 1, "full_name": 1, "avatar_hash": 1}
+    ).to_list(None)
+    by_id = {user["id"]: user for user in users}
+    
+    return {
+        "scope": scope,
+        "week": leaderboards.week,
+        "total": len(board.scores) if board else 0,
+        "entries": [
             {
-                "id": conv["id"],
-                "title": conv["title"],
-                "subject": conv["subject"],
-                "updated_at": conv["updated_at"].isoformat()
-            } for conv in recent_conversations
+                "rank": rank,
+                "user_id": user_id,
+                "full_name": by_id.get(user_id, {}).get("full_name", ""),
+                "username": by_id.get(user_id, {}).get("username", ""),
+                "avatar_url": avatar_url(by_id.get(user_id, {}).get("avatar_hash", "")),
+                "xp": xp
+            } for rank, user_id, xp in page
         ],
-        "achievements": [
-            {"name": "Primeiro Chat", "description": "Completou sua primeira conversa", "unlocked": total_conversations > 0},
-            {"name": "Estudante Dedicado", "description": "Alcançou 100 XP", "unlocked": current_user.xp >= 100},
-            {"name": "Explorador", "description": "Estudou 3 matérias diferentes", "unlocked": len(set([conv["subject"] for conv in recent_conversations])) >= 3}
-        ]
+        "me": {
+            "rank": board.rank(current_user.id) if board else None,
+            "xp": board.scores.get(current_user.id, 0) if board else 0
+        }
     }
 
 # Grade options endpoint
@@ -550,58 +878,79 @@ async def get_ai_styles():
     }
 
 # File processing endpoints
+def file_status_response(file_doc: Dict[str, Any]):
+    extracted_text = file_doc.get("extracted_text", "")
+    status = file_doc.get("status", "done")
+    return {
+        "file_id": file_doc["id"],
+        "filename": file_doc["filename"],
+        "status": status,
+        "extracted_text": extracted_text,
+        "message": f"Arquivo processado: {file_doc['filename']}\n\nTexto extraído:\n{extracted_text}"
+        if status != "processing" else ""
+    }
+
+async def process_uploaded_content(content_hash: str):
+    """Extraction job for one blob: fills in every pending upload of that content."""
+    file_doc = await db.files.find_one(
+        {"content_hash": content_hash, "status": "processing"},
+        {"_id": 0, "file_path": 1, "file_type": 1, "filename": 1}
+    )
+    if not file_doc:
+        return
+    try:
+        extracted_text = await extraction_pool.extract(file_doc["file_path"], file_doc["file_type"])
+        update = {"status": "done", "extracted_text": extracted_text}
+    except Exception as e:
+        logging.error(f"File extraction error: {str(e) or type(e).__name__}")
+        update = {
+            "status": "failed",
+            "extracted_text": placeholder_text(file_doc["filename"], file_doc["file_type"], str(e) or type(e).__name__)
+        }
+    pending = await db.files.find(
+        {"content_hash": content_hash, "status": "processing"}, {"_id": 0, "id": 1}
+    ).to_list(None)
+    await db.files.update_many(
+        {"content_hash": content_hash, "status": "processing"},
+        {"$set": {**update, "processed_at": datetime.utcnow()}}
+    )
+    for pending_doc in pending:
+        extraction_pool.notify(pending_doc["id"])
+
 @api_router.post("/files/upload")
 async def upload_file(
     file: UploadFile = File(...),
     conversation_id: str = Form(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload and process files (PDF, images) with OCR"""
+    """Upload a file (PDF, image); text extraction runs in the background.
+
+    Returns right away with status "processing"; poll GET /api/files/{file_id}
+    for the extracted text. Content already uploaded before is neither stored
+    nor extracted again.
+    """
     try:
         # Verify conversation belongs to user
-        conversation = await db.conversations.find_one({
-            "id": conversation_id,
-            "user_id": current_user.id
-        })
+        conversation = await db.conversations.find_one(
+            {"id": conversation_id, "user_id": current_user.id}, {"_id": 0, "id": 1}
+        )
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
-        # Create storage directory
-        storage_dir = Path(os.getenv('LOCAL_STORAGE_PATH', './storage'))
-        storage_dir.mkdir(exist_ok=True)
-        
-        # Save uploaded file
+        # Check type and size, then save uploaded file under its content hash
         file_id = str(uuid.uuid4())
-        file_ext = file.filename.split('.')[-1].lower()
-        file_path = storage_dir / f"{file_id}.{file_ext}"
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
+        upload_info, file_path = await save_upload(file, ("image", "pdf"))
+        file_ext = upload_info.file_ext
+        content_hash = upload_info.content_hash
+        status = "processing"
         extracted_text = ""
         
-        # Process different file types
-        if file_ext.lower() in ['png', 'jpg', 'jpeg', 'gif', 'bmp']:
-            # Image OCR using PIL and pytesseract (simplified)
-            try:
-                from PIL import Image
-                import pytesseract
-                
-                image = Image.open(file_path)
-                extracted_text = pytesseract.image_to_string(image, lang='por')
-            except Exception as e:
-                extracted_text = f"Imagem enviada: {file.filename} (OCR não disponível: {str(e)})"
-                
-        elif file_ext.lower() == 'pdf':
-            # PDF processing (simplified)
-            try:
-                from unstructured.partition.pdf import partition_pdf
-                elements = partition_pdf(str(file_path))
-                extracted_text = "\n".join([str(element) for element in elements])
-            except Exception as e:
-                extracted_text = f"PDF enviado: {file.filename} (Processamento não disponível: {str(e)})"
-        else:
-            extracted_text = f"Arquivo enviado: {file.filename} (Tipo não suportado para extração de texto)"
+        # Reuse the text extracted from an earlier upload of the same content
+        previous = await db.files.find_one(
+            {"content_hash": content_hash, "status": "done"}, {"_id": 0, "extracted_text": 1}
+        )
+        if previous:
+            status, extracted_text = "done", previous["extracted_text"]
         
         # Save file info to database
         file_doc = {
@@ -611,59 +960,66 @@ async def upload_file(
             "filename": file.filename,
             "file_type": file_ext,
             "file_path": str(file_path),
+            "content_hash": content_hash,
+            "size": upload_info.size,
+            "status": status,
             "extracted_text": extracted_text,
             "created_at": datetime.utcnow()
         }
         await db.files.insert_one(file_doc)
         
-        return {
-            "file_id": file_id,
-            "filename": file.filename,
-            "extracted_text": extracted_text,
-            "message": f"Arquivo processado: {file.filename}\n\nTexto extraído:\n{extracted_text}"
-        }
+        # One job per content hash; duplicates uploaded meanwhile share it
+        if status == "processing" and not extraction_queue.submit(
+            f"extract:{content_hash}", process_uploaded_content, content_hash
+        ):
+            await db.files.delete_one({"id": file_id})
+            raise HTTPException(status_code=503, detail="Too many files being processed, please try again")
         
+        return file_status_response(file_doc)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"File upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+@api_router.get("/files/{file_id}")
+async def get_file_status(
+    file_id: str,
+    wait: float = Query(0, ge=0, le=30),
+    current_user: User = Depends(get_current_user)
+):
+    """Extraction status of an upload; `wait` long-polls up to that many seconds."""
+    projection = {"_id": 0, "id": 1, "filename": 1, "status": 1, "extracted_text": 1}
+    deadline = time.monotonic() + wait
+    while True:
+        file_doc = await db.files.find_one({"id": file_id, "user_id": current_user.id}, projection)
+        if not file_doc:
+            raise HTTPException(status_code=404, detail="File not found")
+        remaining = deadline - time.monotonic()
+        if file_doc.get("status") != "processing" or remaining <= 0:
+            return file_status_response(file_doc)
+        # Woken early when the job finishes in this process; re-check periodically otherwise
+        await extraction_pool.wait_for(file_id, min(remaining, 2.0))
+
 # Audio processing endpoints
 @api_router.post("/audio/stt")
 async def speech_to_text(
     audio: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Convert speech to text using OpenAI Whisper"""
+    """Convert speech to text using OpenAI Whisper, without touching the disk"""
     try:
-        # Save audio file temporarily
-        storage_dir = Path(os.getenv('LOCAL_STORAGE_PATH', './storage'))
-        storage_dir.mkdir(exist_ok=True)
-        
-        audio_id = str(uuid.uuid4())
-        audio_ext = audio.filename.split('.')[-1].lower()
-        audio_path = storage_dir / f"{audio_id}.{audio_ext}"
-        
-        with open(audio_path, "wb") as buffer:
-            shutil.copyfileobj(audio.file, buffer)
-        
-        # Use OpenAI Whisper for transcription
-        client_openai = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        
-        with open(audio_path, "rb") as audio_file:
-            transcript = client_openai.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="pt"
-            )
-        
-        # Clean up temporary file
-        os.unlink(audio_path)
+        audio_info = await inspect_upload(audio, ("audio",))
+        text = await stt_service.transcribe(await audio.read(), audio_info.file_ext)
         
         return {
-            "text": transcript.text,
-            "message": f"Áudio transcrito: {transcript.text}"
+            "text": text,
+            "message": f"Áudio transcrito: {text}"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"STT error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
@@ -673,62 +1029,91 @@ async def text_to_speech(
     text: str = Form(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Convert text to speech using OpenAI TTS"""
+    """Convert text to speech using OpenAI TTS, streamed as audio/mpeg.
+
+    Audio already generated for the same text is served from the TTS cache.
+    """
     try:
         if len(text) > 4096:
             raise HTTPException(status_code=400, detail="Text too long (max 4096 characters)")
+        if not text.strip():
+            raise HTTPException(status_code=400, detail="Text is empty")
         
-        # Use OpenAI TTS
-        client_openai = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        
-        response = client_openai.audio.speech.create(
-            model="tts-1",
-            voice="nova",  # Portuguese-friendly voice
-            input=text,
-            response_format="mp3"
-        )
-        
-        # Save audio file
-        storage_dir = Path(os.getenv('LOCAL_STORAGE_PATH', './storage'))
-        storage_dir.mkdir(exist_ok=True)
-        
-        audio_id = str(uuid.uuid4())
-        audio_path = storage_dir / f"{audio_id}.mp3"
-        
-        response.stream_to_file(str(audio_path))
-        
-        # Convert to base64 for frontend
-        with open(audio_path, "rb") as audio_file:
-            audio_b64 = base64.b64encode(audio_file.read()).decode()
-        
-        # Clean up file
-        os.unlink(audio_path)
-        
-        return {
-            "audio_base64": audio_b64,
-            "message": "Áudio gerado com sucesso"
-        }
+        cache_status = "hit" if tts_service.cached(text) else "miss"
+        audio_stream = tts_service.synthesize(text)
+        # Wait for the first bytes so upstream failures still get a proper error response
+        first_chunk = await audio_stream.__anext__()
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"TTS error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating audio: {str(e)}")
+    
+    async def audio_body():
+        yield first_chunk
+        try:
+            async for chunk in audio_stream:
+                yield chunk
+        except Exception as e:
+            logging.error(f"TTS stream error: {str(e)}")
+    
+    return StreamingResponse(
+        audio_body(),
+        media_type="audio/mpeg",
+        headers={"X-TTS-Cache": cache_status, "Cache-Control": "no-store"}
+    )
 
 # Health check
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "user_cache": user_cache.stats(),
+        "dashboard_cache": dashboard_cache.stats(),
+        "write_behind": write_behind.stats(),
+        "leaderboards": leaderboards.stats(),
+        "achievements": achievement_engine.stats(),
+        "answer_cache": answer_cache.stats(),
+        "llm_coalescing": inflight.stats(),
+        "uploads": upload_stats.stats(),
+        "extraction": extraction_pool.stats(),
+        "tts": tts_service.stats(),
+        "stt": stt_service.stats(),
+        "response_parser": parse_stats.stats(),
+        "event_loop": loop_watchdog.stats()
+    }
+
+# Prometheus scrape target, outside /api like the usual /metrics path
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        # With METRICS_MULTIPROC_DIR this reads every worker's file
+        body = await asyncio.to_thread(metrics_registry.render)
+        return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(UploadSizeLimitMiddleware)
+
+if loop_watchdog.enabled:
+    app.add_middleware(LoopWatchdogMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Before-Cursor", "X-After-Cursor", "X-TTS-Cache"],
 )
 
+if METRICS_ENABLED:
+    # Added last so it wraps the other middleware and times the whole request
+    app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -736,6 +1121,93 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_loop_watchdog():
+    await loop_watchdog.start()
+
+@app.on_event("startup")
+async def startup_metrics():
+    if METRICS_ENABLED:
+        await metrics_registry.start()
+
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes(db)
+
+@app.on_event("startup")
+async def startup_llm_client():
+    await llm_pool.start()
+    answer_cache.attach(
+        db.answer_cache if os.getenv('ANSWER_CACHE_MONGO', 'false').lower() == 'true' else None,
+        llm_pool.embedding
+    )
+
+@app.on_event("startup")
+async def startup_password_pool():
+    password_pool.start()
+
+@app.on_event("startup")
+async def startup_background_queue():
+    await background_queue.start()
+
+@app.on_event("startup")
+async def startup_write_behind():
+    await write_behind.start(db)
+
+@app.on_event("startup")
+async def startup_leaderboards():
+    await leaderboards.start(db.leaderboard_scores)
+
+@app.on_event("startup")
+async def startup_extraction_queue():
+    extraction_pool.start()
+    await extraction_queue.start()
+    # Re-queue uploads whose extraction was interrupted by a restart
+    pending = await db.files.distinct("content_hash", {"status": "processing"})
+    for content_hash in pending:
+        extraction_queue.submit(f"extract:{content_hash}", process_uploaded_content, content_hash)
+    # Drop blobs left behind by deleted documents or interrupted uploads
+    background_queue.submit("blob-cleanup", cleanup_unreferenced_blobs, db)
+    # Move base64 avatars saved by older versions into avatar files (once per database)
+    background_queue.submit("avatar-migration", run_once, db, "base64-avatars", migrate_base64_avatars)
+    # Build achievement counters for users that predate the user_stats collection (once per database)
+    background_queue.submit("user-stats-backfill", run_once, db, "user-stats-backfill", backfill_user_stats)
+
+@app.on_event("shutdown")
+async def shutdown_write_behind():
+    # Registered before shutdown_db_client so the last flush still has a connection
+    await write_behind.close()
+
+@app.on_event("shutdown")
+async def shutdown_leaderboards():
+    await leaderboards.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_llm_client():
+    await llm_pool.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_pool():
+    password_pool.close()
+
+@app.on_event("shutdown")
+async def shutdown_background_queue():
+    await background_queue.close()
+
+@app.on_event("shutdown")
+async def shutdown_loop_watchdog():
+    await loop_watchdog.close()
+
+@app.on_event("shutdown")
+async def shutdown_metrics():
+    if METRICS_ENABLED:
+        await metrics_registry.close()
+
+@app.on_event("shutdown")
+async def shutdown_extraction_queue():
+    await extraction_queue.close()
+    extraction_pool.close()
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""Content-addressed storage for uploaded files.
+
+Uploads are hashed (SHA-256) while they are inspected and stored once under
+LOCAL_STORAGE_PATH/blobs/<hash>.<ext>; a second upload of the same bytes reuses
+the existing blob without writing to disk. A blob is referenced by every
+`files` document carrying its content_hash, and cleanup_unreferenced_blobs
+deletes the blobs no document references any more:
+
+    python storage.py --cleanup
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from uploads import UploadInfo, copy_upload, inspect_upload
+
+
+def storage_dir() -> Path:
+    path = Path(os.getenv('LOCAL_STORAGE_PATH', './storage'))
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def blob_dir() -> Path:
+    path = storage_dir() / "blobs"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def blob_path(content_hash: str, file_ext: str) -> Path:
+    return blob_dir() / f"{content_hash}.{file_ext}"
+
+
+async def save_upload(upload, allowed_kinds: Iterable[str]) -> Tuple[UploadInfo, Path]:
+    """Validate and hash an UploadFile, then store it as a blob unless it already exists."""
+    info = await inspect_upload(upload, allowed_kinds)
+    path = blob_path(info.content_hash, info.file_ext)
+    if not path.exists():
+        await copy_upload(upload, path)
+    return info, path
+
+
+async def cleanup_unreferenced_blobs(db, grace_seconds: float = 3600) -> List[str]:
+    """Delete blobs with no referencing `files` document.
+
+    Blobs younger than grace_seconds are kept, since their document may not be
+    inserted yet.
+    """
+    cutoff = time.time() - grace_seconds
+    candidates = {}
+    for path in blob_dir().iterdir():
+        if path.is_file() and path.stat().st_mtime < cutoff:
+            candidates.setdefault(path.name.split('.')[0], []).append(path)
+
+    removed = []
+    hashes = list(candidates)
+    for start in range(0, len(hashes), 500):
+        batch = hashes[start:start + 500]
+        referenced = set(await db.files.distinct("content_hash", {"content_hash": {"$in": batch}}))
+        for content_hash in batch:
+            if content_hash in referenced:
+                continue
+            for path in candidates[content_hash]:
+                try:
+                    path.unlink()
+                    removed.append(path.name)
+                except OSError as e:
+                    logging.warning(f"Could not remove blob {path}: {str(e)}")
+    if removed:
+        logging.info(f"Removed {len(removed)} unreferenced blobs")
+    return removed
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Maintain ProfAI content-addressed storage")
+    parser.add_argument("--cleanup", action="store_true", help="delete blobs no file document references")
+    parser.add_argument("--grace", type=float, default=3600, help="keep blobs younger than this (seconds)")
+    args = parser.parse_args()
+    if not args.cleanup:
+        parser.print_help()
+        return
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    removed = asyncio.run(cleanup_unreferenced_blobs(client[os.environ['DB_NAME']], args.grace))
+    print(f"Removed {len(removed)} blobs")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
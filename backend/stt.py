@@ -0,0 +1,149 @@
+"""Speech-to-text without temporary files.
+
+Recordings are read from the upload into memory (uploads.py caps their size)
+and forwarded to the transcription API through the shared async client.
+
+With STT_NORMALIZE, ffmpeg transcodes the clip through pipes to mono 16 kHz
+Opus before it is sent, which shrinks browser recordings and long WAVs and
+also yields the exact duration. Otherwise the duration of WAV comes from its
+header and that of other formats (the WebM/Ogg the browser records) from
+ffmpeg copying the audio packets to a null output, which reads the
+timestamps without decoding. Clips longer than STT_MAX_SECONDS are rejected
+with 413; without ffmpeg on the PATH only WAV durations are known.
+
+The transcription API takes one file per request and a combined transcript
+cannot be split back reliably, so clips are not merged across users.
+Identical clips in flight at the same time (double submits, retries) share
+one upstream call instead.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import time
+import wave
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from llm import inflight, llm_pool
+from metrics import processing_duration
+
+FFMPEG_TIME = re.compile(rb"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+MEDIA_TYPES = {
+    "wav": "audio/wav", "webm": "audio/webm", "ogg": "audio/ogg",
+    "flac": "audio/flac", "mp3": "audio/mpeg", "m4a": "audio/mp4",
+}
+
+
+def wav_duration(data: bytes) -> Optional[float]:
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return None
+
+
+class STTService:
+    def __init__(self, model: str = "whisper-1", language: str = "pt", max_seconds: float = 120.0,
+                 normalize: bool = False):
+        self.model = model
+        self.language = language
+        self.max_seconds = max_seconds
+        self.normalize = normalize
+        self.ffmpeg = shutil.which("ffmpeg") is not None
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.seconds = 0.0
+
+    async def ffmpeg_run(self, data: bytes, *arguments: str) -> Tuple[bytes, Optional[float]]:
+        """Feed data to ffmpeg through pipes; returns (stdout, last reported time)."""
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-nostdin", "-i", "pipe:0", *arguments,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        output, errors = await process.communicate(data)
+        if process.returncode != 0:
+            raise ValueError(f"ffmpeg failed: {errors.decode(errors='ignore')[-200:]}")
+        times = FFMPEG_TIME.findall(errors)
+        duration = None
+        if times:
+            hours, minutes, seconds = times[-1]
+            duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return output, duration
+
+    async def transcode(self, data: bytes) -> Tuple[bytes, Optional[float]]:
+        """Mono 16 kHz Opus through ffmpeg pipes; returns (audio, duration)."""
+        return await self.ffmpeg_run(
+            data, "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"
+        )
+
+    async def probe_duration(self, data: bytes) -> Optional[float]:
+        """Duration from the audio packet timestamps, without decoding.
+
+        Browser recordings (MediaRecorder WebM) carry no duration in their
+        header, so the packets are read to the end instead of asking ffprobe.
+        """
+        _, duration = await self.ffmpeg_run(data, "-map", "0:a:0", "-c", "copy", "-f", "null", "-")
+        return duration
+
+    async def prepare(self, data: bytes, file_ext: str) -> Tuple[bytes, str]:
+        """Normalize (when enabled) and enforce the duration limit."""
+        duration = wav_duration(data) if file_ext == "wav" else None
+        if self.normalize:
+            try:
+                data, duration = await self.transcode(data)
+                file_ext = "ogg"
+            except (OSError, ValueError) as e:
+                # No ffmpeg or an unreadable clip: send it as recorded
+                logging.warning(f"Audio normalization skipped: {str(e)}")
+        if duration is None and self.ffmpeg:
+            try:
+                duration = await self.probe_duration(data)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Audio duration probe failed: {str(e)}")
+        if duration is not None and duration > self.max_seconds:
+            raise HTTPException(status_code=413, detail=f"Audio too long (max {self.max_seconds:.0f} s)")
+        return data, file_ext
+
+    async def transcribe(self, data: bytes, file_ext: str) -> str:
+        started = time.perf_counter()
+        self.requests += 1
+        self.bytes_received += len(data)
+        audio, audio_ext = await self.prepare(data, file_ext)
+
+        async def call_api():
+            self.bytes_sent += len(audio)
+            transcript = await llm_pool.transcription(
+                model=self.model,
+                language=self.language,
+                file=(f"audio.{audio_ext}", audio, MEDIA_TYPES.get(audio_ext, "application/octet-stream")),
+            )
+            return transcript.text
+
+        key = f"stt:{self.model}:{self.language}:{hashlib.sha256(audio).hexdigest()}"
+        text = await inflight.do(key, call_api)
+        elapsed = time.perf_counter() - started
+        self.seconds += elapsed
+        processing_duration.observe(elapsed, "stt")
+        return text
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+            "avg_ms": round(self.seconds / self.requests * 1000, 1) if self.requests else 0.0,
+        }
+
+
+stt_service = STTService(
+    model=os.getenv('STT_MODEL', 'whisper-1'),
+    language=os.getenv('STT_LANGUAGE', 'pt'),
+    max_seconds=float(os.getenv('STT_MAX_SECONDS', 120)),
+    normalize=os.getenv('STT_NORMALIZE', 'false').lower() == 'true',
+)
@@ -0,0 +1,68 @@
+"""In-process background task queue.
+
+Work that must not delay the response (e.g. conversation summarization) is
+submitted here and run by a few asyncio worker tasks. Jobs are deduplicated
+by key while pending, the queue is bounded, and failures are only logged.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Optional, Set
+
+
+class BackgroundQueue:
+    def __init__(self, workers: int = 2, max_size: int = 1000):
+        self.workers = workers
+        self.max_size = max_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.pending: Set[str] = set()
+        self.tasks = []
+
+    async def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+        self.pending.clear()
+
+    def submit(self, key: str, job: Callable[..., Awaitable], *args) -> bool:
+        """Queue job(*args) unless a job with the same key is already pending.
+
+        Returns False only when the job could not be queued (queue full or
+        not started).
+        """
+        if key in self.pending:
+            return True
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait((key, job, args))
+        except asyncio.QueueFull:
+            logging.warning(f"Background queue full, dropping job {key}")
+            return False
+        self.pending.add(key)
+        return True
+
+    async def _worker(self):
+        while True:
+            key, job, args = await self.queue.get()
+            self.pending.discard(key)
+            try:
+                await job(*args)
+            except Exception as e:
+                logging.error(f"Background job {key} failed: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+
+background_queue = BackgroundQueue(
+    workers=int(os.getenv('BACKGROUND_WORKERS', 2)),
+    max_size=int(os.getenv('BACKGROUND_QUEUE_SIZE', 1000)),
+)
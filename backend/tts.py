@@ -0,0 +1,175 @@
+"""Streaming text-to-speech with a content-hash audio cache.
+
+synthesize() yields MP3 bytes as soon as the upstream speech API produces
+them. With TTS_CHUNKING, long texts are split at sentence boundaries into
+pieces of at most TTS_CHUNK_CHARS characters: the first piece is streamed
+straight through while the next one is already being synthesized, so playback
+starts early and later sentences are ready when the client reaches them. MP3
+frames are self-contained, so the pieces concatenate into one playable file.
+
+Finished audio is kept under LOCAL_STORAGE_PATH/tts/<hash>.mp3, keyed on
+model, voice and text, so replaying a message costs no upstream call. The
+directory is pruned oldest-first beyond TTS_CACHE_MAX_MB.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+from llm import llm_pool
+from metrics import processing_duration
+from storage import storage_dir
+
+CHUNK_SIZE = 16384
+SENTENCE_END = re.compile(r"(?<=[.!?…:;])\s+")
+
+
+def split_sentences(text: str, max_chars: int) -> List[str]:
+    """Group sentences into pieces of at most max_chars (longer sentences stay whole)."""
+    pieces: List[str] = []
+    current = ""
+    for sentence in SENTENCE_END.split(text.strip()):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class TTSService:
+    def __init__(self, model: str = "tts-1", voice: str = "nova", chunking: bool = True,
+                 chunk_chars: int = 400, cache_enabled: bool = True, cache_max_bytes: int = 200 * 1024 * 1024):
+        self.model = model
+        self.voice = voice
+        self.chunking = chunking
+        self.chunk_chars = chunk_chars
+        self.cache_enabled = cache_enabled
+        self.cache_max_bytes = cache_max_bytes
+        self.requests = 0
+        self.cache_hits = 0
+        self.upstream_calls = 0
+        self.bytes_sent = 0
+        self.first_byte_seconds = 0.0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}|{self.voice}|{text.strip()}".encode()).hexdigest()
+
+    def cache_path(self, key: str) -> Path:
+        path = storage_dir() / "tts"
+        path.mkdir(exist_ok=True)
+        return path / f"{key}.mp3"
+
+    def cached(self, text: str) -> Optional[Path]:
+        if not self.cache_enabled:
+            return None
+        path = self.cache_path(self.key(text))
+        return path if path.exists() else None
+
+    async def synthesize(self, text: str) -> AsyncIterator[bytes]:
+        """Yield MP3 bytes for text, from the cache or streamed from upstream."""
+        self.requests += 1
+        started = time.perf_counter()
+        first = True
+        cached = self.cached(text)
+        source = self._read_cached(cached) if cached else self._synthesize_upstream(text)
+        if cached:
+            self.cache_hits += 1
+        async for chunk in source:
+            if first:
+                first_byte = time.perf_counter() - started
+                self.first_byte_seconds += first_byte
+                processing_duration.observe(first_byte, "tts_first_byte")
+                first = False
+            self.bytes_sent += len(chunk)
+            yield chunk
+        processing_duration.observe(time.perf_counter() - started, "tts_cached" if cached else "tts")
+
+    async def _read_cached(self, path: Path) -> AsyncIterator[bytes]:
+        with open(path, "rb") as audio_file:
+            while True:
+                chunk = await asyncio.to_thread(audio_file.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def _synthesize_upstream(self, text: str) -> AsyncIterator[bytes]:
+        pieces = split_sentences(text, self.chunk_chars) if self.chunking else [text]
+        prefetched: Dict[int, asyncio.Task] = {}
+        audio: List[bytes] = []
+
+        def prefetch(index: int):
+            if index < len(pieces) and index not in prefetched:
+                prefetched[index] = asyncio.create_task(self._fetch(pieces[index]))
+
+        try:
+            prefetch(1)
+            async for chunk in self._stream(pieces[0]):
+                audio.append(chunk)
+                yield chunk
+            for index in range(1, len(pieces)):
+                prefetch(index + 1)
+                data = await prefetched.pop(index)
+                audio.append(data)
+                yield data
+        finally:
+            for task in prefetched.values():
+                task.cancel()
+
+        if self.cache_enabled and len(audio) > 0:
+            try:
+                await asyncio.to_thread(self._store, self.key(text), b"".join(audio))
+            except OSError as e:
+                logging.warning(f"TTS cache write failed: {str(e)}")
+
+    def _stream(self, piece: str) -> AsyncIterator[bytes]:
+        self.upstream_calls += 1
+        return llm_pool.stream_speech(
+            chunk_size=CHUNK_SIZE, model=self.model, voice=self.voice, input=piece, response_format="mp3"
+        )
+
+    async def _fetch(self, piece: str) -> bytes:
+        return b"".join([chunk async for chunk in self._stream(piece)])
+
+    def _store(self, key: str, data: bytes):
+        path = self.cache_path(key)
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self._prune(path.parent)
+
+    def _prune(self, directory: Path):
+        files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry)
+                       for entry in directory.glob("*.mp3"))
+        total = sum(size for _, size, _ in files)
+        for _, size, entry in files:
+            if total <= self.cache_max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "upstream_calls": self.upstream_calls,
+            "bytes_sent": self.bytes_sent,
+            "avg_first_byte_ms": round(self.first_byte_seconds / self.requests * 1000, 1) if self.requests else 0.0,
+        }
+
+
+tts_service = TTSService(
+    model=os.getenv('TTS_MODEL', 'tts-1'),
+    voice=os.getenv('TTS_VOICE', 'nova'),
+    chunking=os.getenv('TTS_CHUNKING', 'true').lower() == 'true',
+    chunk_chars=int(os.getenv('TTS_CHUNK_CHARS', 400)),
+    cache_enabled=os.getenv('TTS_CACHE_ENABLED', 'true').lower() == 'true',
+    cache_max_bytes=int(float(os.getenv('TTS_CACHE_MAX_MB', 200)) * 1024 * 1024),
+)
@@ -0,0 +1,222 @@
+"""Size-bounded, type-checked upload handling.
+
+Three layers keep uploads cheap and safe:
+
+* UploadSizeLimitMiddleware counts request-body bytes on upload routes as they
+  arrive and answers 413 as soon as the largest per-type cap is exceeded, so
+  an oversized body never fills the multipart spool on disk.
+* inspect_upload makes one chunked pass over the spooled upload without
+  writing anything: it sniffs the real type from magic bytes (415 if it is
+  not allowed), enforces the per-type cap (413) and computes the SHA-256.
+* copy_upload streams the spool to its destination in a worker thread, in
+  fixed-size chunks, so memory per upload stays constant and disk writes
+  never run on the event loop.
+"""
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+
+CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+UPLOAD_LIMITS = {
+    "image": int(float(os.getenv('UPLOAD_MAX_IMAGE_MB', 10)) * MB),
+    "pdf": int(float(os.getenv('UPLOAD_MAX_PDF_MB', 25)) * MB),
+    "audio": int(float(os.getenv('UPLOAD_MAX_AUDIO_MB', 25)) * MB),
+}
+# Request paths whose bodies are capped by UploadSizeLimitMiddleware
+LIMITED_PATHS = {
+    "/api/files/upload": ("image", "pdf"),
+    "/api/audio/stt": ("audio",),
+    "/api/auth/profile": ("image",),
+}
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def sniff_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """(kind, extension) from the first bytes of a file, or None if unknown."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image", "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image", "jpeg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image", "gif"
+    if head.startswith(b"BM"):
+        return "image", "bmp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image", "webp"
+    if head.startswith(b"%PDF-"):
+        return "pdf", "pdf"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio", "wav"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "audio", "webm"
+    if head.startswith(b"OggS"):
+        return "audio", "ogg"
+    if head.startswith(b"fLaC"):
+        return "audio", "flac"
+    if head.startswith(b"ID3") or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio", "mp3"
+    if head[4:8] == b"ftyp":
+        return "audio", "m4a"
+    return None
+
+
+@dataclass
+class UploadInfo:
+    kind: str
+    file_ext: str
+    size: int
+    content_hash: str
+
+
+class UploadStats:
+    def __init__(self):
+        self.uploads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.rejected_size = 0
+        self.rejected_type = 0
+
+    def record(self, size: int, seconds: float):
+        self.uploads += 1
+        self.bytes += size
+        self.seconds += seconds
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "uploads": self.uploads,
+            "bytes": self.bytes,
+            "bytes_per_s": round(self.bytes / self.seconds) if self.seconds else 0,
+            "rejected_size": self.rejected_size,
+            "rejected_type": self.rejected_type,
+        }
+
+
+upload_stats = UploadStats()
+
+
+async def inspect_upload(upload, allowed_kinds: Iterable[str]) -> UploadInfo:
+    """Sniff, size-check and hash a spooled upload without writing it anywhere."""
+    started = time.perf_counter()
+    head = await upload.read(CHUNK_SIZE)
+    sniffed = sniff_type(head)
+    if sniffed is None or sniffed[0] not in allowed_kinds:
+        upload_stats.rejected_type += 1
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+    kind, file_ext = sniffed
+    limit = UPLOAD_LIMITS[kind]
+
+    hasher = hashlib.sha256()
+    size = 0
+    chunk = head
+    while chunk:
+        size += len(chunk)
+        if size > limit:
+            upload_stats.rejected_size += 1
+            raise HTTPException(status_code=413, detail=f"File too large (max {limit // MB} MB)")
+        hasher.update(chunk)
+        chunk = await upload.read(CHUNK_SIZE)
+
+    await upload.seek(0)
+    upload_stats.record(size, time.perf_counter() - started)
+    return UploadInfo(kind=kind, file_ext=file_ext, size=size, content_hash=hasher.hexdigest())
+
+
+async def copy_upload(upload, path: Path):
+    """Stream the spooled upload to path (atomically) in a worker thread."""
+    started = time.perf_counter()
+    await upload.seek(0)
+    size = await asyncio.to_thread(_copy_atomically, upload.file, path)
+    upload_stats.seconds += time.perf_counter() - started
+    return size
+
+
+def _copy_atomically(source, path: Path) -> int:
+    tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return size
+
+
+class BodyTooLarge(HTTPException):
+    # An HTTPException so FastAPI's body parsing re-raises it as a 413
+    def __init__(self):
+        super().__init__(status_code=413, detail="Request body too large")
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware rejecting oversized upload bodies while they stream in."""
+
+    def __init__(self, app):
+        self.app = app
+        self.limits = {
+            path: max(UPLOAD_LIMITS[kind] for kind in kinds) + MULTIPART_OVERHEAD
+            for path, kinds in LIMITED_PATHS.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            upload_stats.rejected_size += 1
+            await self._reject(send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    upload_stats.rejected_size += 1
+                    raise BodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge:
+            if not response_started:
+                await self._reject(send)
+
+    @staticmethod
+    async def _reject(send):
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,98 @@
+"""In-process TTL/LRU cache of authenticated user documents.
+
+get_current_user runs on every protected route, so the user document it loads
+is cached here by user id. Entries expire after USER_CACHE_TTL seconds and the
+least recently used ones are evicted beyond USER_CACHE_MAX_SIZE. The cache is
+per process: writes made through this process update or drop the entry, and
+the TTL bounds how stale other workers can be.
+
+dashboard_cache reuses the same structure for the per-user conversation
+aggregates shown on the dashboard.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Fields never kept in the cache; password checks always read from Mongo and
+# "avatar" is a legacy base64 image that avatars.py migrates out of users
+EXCLUDED_FIELDS = {"_id": 0, "password_hash": 0, "avatar": 0}
+
+
+class UserCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def projection(self) -> Dict[str, int]:
+        return EXCLUDED_FIELDS
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[user_id]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user_id: str, user_doc: Dict[str, Any]):
+        if not self.enabled:
+            return
+        doc = {key: value for key, value in user_doc.items() if key not in self.projection}
+        self.entries[user_id] = (time.monotonic() + self.ttl, doc)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def increment(self, user_id: str, amounts: Dict[str, int]):
+        """Mirror a Mongo $inc on the cached entry, if present."""
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return
+        doc = dict(entry[1])
+        for field, amount in amounts.items():
+            doc[field] = doc.get(field, 0) + amount
+        self.entries[user_id] = (entry[0], doc)
+
+    def invalidate(self, user_id: str):
+        self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(
+    max_size=int(os.getenv('USER_CACHE_MAX_SIZE', 10000)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60)),
+    enabled=os.getenv('USER_CACHE_ENABLED', 'true').lower() == 'true',
+)
+# Dashboard aggregates per user; chat and conversation writes invalidate them
+dashboard_cache = UserCache(
+    max_size=int(os.getenv('DASHBOARD_CACHE_MAX_SIZE', 10000)),
+    ttl=float(os.getenv('DASHBOARD_CACHE_TTL', 30)),
+    enabled=os.getenv('DASHBOARD_CACHE_ENABLED', 'true').lower() == 'true',
+)
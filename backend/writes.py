@@ -0,0 +1,100 @@
+"""Write-behind buffer for non-critical Mongo updates.
+
+Updates that only keep derived fields fresh (e.g. a conversation's
+updated_at and message_count) can be deferred here instead of being awaited
+on the request path. Updates to the same document are merged while buffered
+($set keeps the latest value, $inc amounts are summed) and flushed every
+WRITE_BEHIND_INTERVAL seconds with one unordered bulk_write per collection,
+or as soon as WRITE_BEHIND_MAX_PENDING documents are waiting. Pending
+updates are flushed on shutdown; a crash loses at most one interval of them,
+so anything that must not be lost (XP, coins, messages) is written directly.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+
+class WriteBehindBuffer:
+    def __init__(self, enabled: bool = False, interval: float = 1.0, max_pending: int = 1000):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_pending = max_pending
+        self.db = None
+        self.pending: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.buffered = 0
+        self.flushed = 0
+        self.flushes = 0
+
+    async def start(self, db):
+        self.db = db
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    async def update(self, collection: str, doc_id: str, set_fields: Dict[str, Any] = None,
+                     inc_fields: Dict[str, int] = None):
+        """Apply an update by `id`, deferred when the buffer is enabled."""
+        if not self.enabled or self.task is None:
+            update = {}
+            if set_fields:
+                update["$set"] = set_fields
+            if inc_fields:
+                update["$inc"] = inc_fields
+            await self.db[collection].update_one({"id": doc_id}, update)
+            return
+
+        entry = self.pending.setdefault((collection, doc_id), {"$set": {}, "$inc": {}})
+        entry["$set"].update(set_fields or {})
+        for field, amount in (inc_fields or {}).items():
+            entry["$inc"][field] = entry["$inc"].get(field, 0) + amount
+        self.buffered += 1
+        if len(self.pending) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending or self.db is None:
+            return
+        pending, self.pending = self.pending, {}
+        by_collection: Dict[str, list] = {}
+        for (collection, doc_id), entry in pending.items():
+            update = {operator: fields for operator, fields in entry.items() if fields}
+            by_collection.setdefault(collection, []).append(UpdateOne({"id": doc_id}, update))
+        for collection, operations in by_collection.items():
+            try:
+                await self.db[collection].bulk_write(operations, ordered=False)
+                self.flushed += len(operations)
+            except PyMongoError as e:
+                logging.error(f"Write-behind flush to {collection} failed: {str(e)}")
+        self.flushes += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self.pending),
+            "buffered_updates": self.buffered,
+            "flushed_documents": self.flushed,
+            "flushes": self.flushes,
+        }
+
+
+write_behind = WriteBehindBuffer(
+    enabled=os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true',
+    interval=float(os.getenv('WRITE_BEHIND_INTERVAL', 1.0)),
+    max_pending=int(os.getenv('WRITE_BEHIND_MAX_PENDING', 1000)),
+)
@@ -0,0 +1,914 @@
+#!/usr/bin/env python3
+"""
+Performance Benchmarks for ProfAI Educational AI Assistant
+Runs load scenarios against a live backend. LLM-dependent scenarios use a local
+fake OpenAI-compatible server, so start the backend with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 uvicorn server:app --port 8001
+
+Scenarios in LOCAL_SCENARIOS run the backend modules in-process and need no
+server.
+
+Usage: python backend_benchmark.py [scenario ...]
+"""
+
+import asyncio
+import io
+import json
+import math
+import random
+import re
+import wave
+import os
+import sys
+import time
+import uuid
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import requests
+
+from backend_test import BASE_URL, API_URL
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+STORAGE_DIR = BACKEND_DIR / "storage"
+SAMPLE_PDFS = sorted(STORAGE_DIR.glob("*.pdf"))
+SAMPLE_IMAGES = sorted(STORAGE_DIR.glob("*.jpeg"))
+
+FAKE_LLM_PORT = 8765
+FAKE_LLM_DELAY = 2.0  # seconds each fake completion takes
+FAKE_STT_DELAY = 0.5  # seconds each fake transcription takes
+
+FAKE_AI_PAYLOAD = {
+    "type": "help",
+    "intro": "Vamos resolver juntos!",
+    "steps": ["Leia o enunciado", "Identifique os dados", "Monte a conta"],
+    "explanation": "Uma fração representa partes de um todo.",
+    "final_answer": "",
+    "examples": ["1/2 de uma pizza", "3/4 de um bolo"],
+    "follow_up_questions": ["Quer tentar outro exemplo?"],
+    "xp": 10,
+    "coins": 2
+}
+
+# Stand-in for a recorded classroom question log (one JSON object per line)
+SAMPLE_QUESTION_LOG = [
+    {"message": "O que é fração?", "subject": "Matemática", "request_type": "help"},
+    {"message": "o que é fração", "subject": "Matemática", "request_type": "help"},
+    {"message": "O que e fracao??", "subject": "Matemática", "request_type": "help"},
+    {"message": "Como somar frações?", "subject": "Matemática", "request_type": "hint"},
+    {"message": "como somar frações", "subject": "Matemática", "request_type": "hint"},
+    {"message": "O que é fotossíntese?", "subject": "Ciências", "request_type": "help"},
+    {"message": "o que é fotossintese", "subject": "Ciências", "request_type": "help"},
+    {"message": "Quem descobriu o Brasil?", "subject": "História", "request_type": "answer"},
+    {"message": "Quem descobriu o Brasil", "subject": "História", "request_type": "answer"},
+    {"message": "O que é um substantivo?", "subject": "Português", "request_type": "help"},
+] * 5
+
+
+def malformed_outputs(count: int, seed: int = 42) -> List[str]:
+    """Model outputs with the drifts seen in practice: fences, prose, truncation, wrong types, garbage"""
+    rng = random.Random(seed)
+    valid = json.dumps(FAKE_AI_PAYLOAD, ensure_ascii=False)
+    drifted = dict(FAKE_AI_PAYLOAD, xp="10", steps="Leia o enunciado", examples=None)
+    del drifted["follow_up_questions"]
+    mutations = [
+        lambda: valid,
+        lambda: f"```json\n{valid}\n```",
+        lambda: f"Claro! Aqui está:\n{valid}\nEspero ter ajudado.",
+        lambda: valid[:rng.randint(1, len(valid) - 1)],
+        lambda: "".join(ch for ch in valid if rng.random() > 0.01),
+        lambda: json.dumps(drifted, ensure_ascii=False),
+        lambda: json.dumps([FAKE_AI_PAYLOAD], ensure_ascii=False),
+        lambda: "".join(chr(rng.randint(32, 0x2FF)) for _ in range(rng.randint(0, 400))),
+        lambda: valid.replace('"', "'"),
+        lambda: "{" * rng.randint(1, 50) + valid,
+    ]
+    return [rng.choice(mutations)() for _ in range(count)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible /v1/chat/completions and /v1/audio/transcriptions endpoints"""
+
+    # Characters of every chat prompt received (summarization calls excluded)
+    chat_prompt_sizes: List[int] = []
+    # Body size of every /v1/audio/transcriptions request
+    transcription_sizes: List[int] = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if self.path.endswith("/audio/transcriptions"):
+            self.rfile.read(length)
+            self.transcription_sizes.append(length)
+            time.sleep(FAKE_STT_DELAY)
+            self.send_json({"text": "Quanto é um meio mais um quarto?"})
+            return
+        request = json.loads(self.rfile.read(length) or b"{}")
+        messages = request.get("messages", [])
+        if messages and "Você é o ProfAI" in messages[0].get("content", ""):
+            self.chat_prompt_sizes.append(sum(len(m.get("content", "")) for m in messages))
+        content = json.dumps(FAKE_AI_PAYLOAD, ensure_ascii=False)
+        if request.get("stream"):
+            self.stream_completion(content)
+            return
+        time.sleep(FAKE_LLM_DELAY)
+        self.send_json({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "fake-model",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 200, "completion_tokens": 150, "total_tokens": 350}
+        })
+
+    def send_json(self, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_completion(self, content: str):
+        """Send the payload as chat.completion.chunk events, ~4 chars per token"""
+        tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        delay = FAKE_LLM_DELAY / len(tokens)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for token in tokens:
+            time.sleep(delay)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "fake-model",
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_fake_llm(handler=FakeLLMHandler, port: int = FAKE_LLM_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> str:
+    return (f"n={len(samples)} p50={percentile(samples, 50) * 1000:.1f}ms "
+            f"p99={percentile(samples, 99) * 1000:.1f}ms max={max(samples, default=0) * 1000:.1f}ms")
+
+
+class ProfAIBenchmark:
+    def __init__(self):
+        self.session = requests.Session()
+        self.auth_token = None
+        self.conversation_id = None
+        self.email = None
+        self.results: Dict[str, Dict[str, str]] = {}
+
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.auth_token}"} if self.auth_token else {}
+
+    def setup_user(self):
+        """Register a throwaway user and create one conversation"""
+        suffix = uuid.uuid4().hex[:8]
+        self.email = f"bench_{suffix}@profai.com"
+        response = self.session.post(f"{API_URL}/auth/register", json={
+            "email": self.email,
+            "username": f"bench_{suffix}",
+            "password": "Bench123!",
+            "full_name": "Benchmark User",
+            "grade": "7º EF"
+        })
+        response.raise_for_status()
+        self.auth_token = response.json()["access_token"]
+        response = self.session.post(f"{API_URL}/conversations", json={
+            "title": "Benchmark", "subject": "Matemática"
+        }, headers=self.headers())
+        response.raise_for_status()
+        self.conversation_id = response.json()["id"]
+
+    def sample_latency(self, path: str, stop: threading.Event, samples: List[float], interval: float = 0.05):
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(f"{API_URL}{path}", headers=self.headers())
+            samples.append(time.perf_counter() - start)
+            time.sleep(interval)
+
+    def measure_idle(self, path: str, count: int = 50) -> List[float]:
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            self.session.get(f"{API_URL}{path}", headers=self.headers())
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def send_chat(self, message: str = "O que é fração?") -> float:
+        start = time.perf_counter()
+        response = requests.post(f"{API_URL}/chat", json={
+            "conversation_id": self.conversation_id,
+            "message": message,
+            "request_type": "help",
+            "subject": "Matemática"
+        }, headers=self.headers(), timeout=300)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    def bench_chat_load(self, concurrent_chats: int = 100):
+        """p99 of /api/health and /api/conversations while chats are in flight"""
+        print(f"\n🔥 Chat load: {concurrent_chats} concurrent /api/chat (fake LLM delay {FAKE_LLM_DELAY}s)")
+        probes = ["/health", "/conversations"]
+        idle = {path: self.measure_idle(path) for path in probes}
+
+        stop = threading.Event()
+        loaded: Dict[str, List[float]] = {path: [] for path in probes}
+        samplers = [threading.Thread(target=self.sample_latency, args=(path, stop, loaded[path]))
+                    for path in probes]
+        for sampler in samplers:
+            sampler.start()
+
+        # Unique questions, so neither SingleFlight nor the answer cache merges the calls
+        upstream_before = len(FakeLLMHandler.chat_prompt_sizes)
+        with ThreadPoolExecutor(max_workers=concurrent_chats) as pool:
+            chat_times = list(pool.map(
+                lambda i: self.send_chat(f"Carga {uuid.uuid4().hex[:8]}: quanto é {i} vezes 3?"),
+                range(concurrent_chats)
+            ))
+        upstream_calls = len(FakeLLMHandler.chat_prompt_sizes) - upstream_before
+
+        stop.set()
+        for sampler in samplers:
+            sampler.join()
+
+        for path in probes:
+            print(f"   {path:<16} idle:   {summarize(idle[path])}")
+            print(f"   {path:<16} loaded: {summarize(loaded[path])}")
+        print(f"   /chat            {summarize(chat_times)}")
+        print(f"   upstream LLM calls: {upstream_calls}")
+        assert upstream_calls >= concurrent_chats * 0.95, (
+            f"only {upstream_calls} of {concurrent_chats} chats reached the LLM; the load test was coalesced"
+        )
+        self.results["chat_load"] = {
+            path: f"idle p99 {percentile(idle[path], 99) * 1000:.1f}ms, "
+                  f"loaded p99 {percentile(loaded[path], 99) * 1000:.1f}ms"
+            for path in probes
+        }
+
+    def bench_chat_writes(self, students: int = 50):
+        """Time spent in /api/chat beyond the fake LLM delay (history read + turn persistence)"""
+        print(f"\n💾 Chat turn writes: {students} concurrent chats with unique questions")
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            latencies = list(pool.map(lambda i: self.send_chat(f"Exercício {uuid.uuid4().hex[:6]}: quanto é {i} + {i}?"),
+                                      range(students)))
+        overhead = [max(0.0, latency - FAKE_LLM_DELAY) for latency in latencies]
+        write_behind = self.session.get(f"{API_URL}/health").json().get("write_behind", {})
+        print(f"   /chat latency:       {summarize(latencies)}")
+        print(f"   beyond the LLM call: {summarize(overhead)}")
+        print(f"   write-behind: {write_behind}")
+        self.results["chat_writes"] = {
+            "overhead_p50": f"{percentile(overhead, 50) * 1000:.1f}ms",
+            "overhead_p99": f"{percentile(overhead, 99) * 1000:.1f}ms"
+        }
+
+    def stream_chat(self, message: str = "O que é fração?") -> Dict[str, float]:
+        """Time to first byte, first intro event and final done event"""
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        with requests.post(f"{API_URL}/chat/stream", json={
+            "conversation_id": self.conversation_id,
+            "message": message,
+            "request_type": "help",
+            "subject": "Matemática"
+        }, headers=self.headers(), stream=True, timeout=300) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                timings.setdefault("first_byte", time.perf_counter() - start)
+                if line == b"event: intro":
+                    timings.setdefault("first_intro", time.perf_counter() - start)
+                elif line == b"event: done":
+                    timings["done"] = time.perf_counter() - start
+        return timings
+
+    def bench_chat_stream(self, runs: int = 10):
+        """Time-to-first-byte of /api/chat/stream versus /api/chat"""
+        print(f"\n⚡ Chat streaming TTFB: {runs} runs (fake LLM delay {FAKE_LLM_DELAY}s)")
+        blocking = [self.send_chat() for _ in range(runs)]
+        streamed = [self.stream_chat() for _ in range(runs)]
+        first_byte = [t["first_byte"] for t in streamed]
+        first_intro = [t["first_intro"] for t in streamed if "first_intro" in t]
+        done = [t["done"] for t in streamed if "done" in t]
+        print(f"   /chat        full response: {summarize(blocking)}")
+        print(f"   /chat/stream first byte:    {summarize(first_byte)}")
+        print(f"   /chat/stream first intro:   {summarize(first_intro)}")
+        print(f"   /chat/stream done:          {summarize(done)}")
+        self.results["chat_stream"] = {
+            "chat_p50": f"{percentile(blocking, 50) * 1000:.1f}ms",
+            "stream_first_byte_p50": f"{percentile(first_byte, 50) * 1000:.1f}ms",
+            "stream_first_intro_p50": f"{percentile(first_intro, 50) * 1000:.1f}ms",
+            "stream_done_p50": f"{percentile(done, 50) * 1000:.1f}ms"
+        }
+
+    def measure_throughput(self, path: str, duration: float, concurrency: int) -> float:
+        """Requests per second sustained by `concurrency` clients for `duration` seconds"""
+        deadline = time.perf_counter() + duration
+
+        def worker(_):
+            session = requests.Session()
+            count = 0
+            while time.perf_counter() < deadline:
+                session.get(f"{API_URL}{path}", headers=self.headers()).raise_for_status()
+                count += 1
+            return count
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            total = sum(pool.map(worker, range(concurrency)))
+        return total / duration
+
+    def bench_auth_me(self, duration: float = 10.0, concurrency: int = 20):
+        """req/s on /api/auth/me; run once with USER_CACHE_ENABLED=false to compare"""
+        print(f"\n👤 /api/auth/me throughput: {concurrency} clients for {duration:.0f}s")
+        rps = self.measure_throughput("/auth/me", duration, concurrency)
+        cache = self.session.get(f"{API_URL}/health").json().get("user_cache", {})
+        print(f"   {rps:.1f} req/s (user cache enabled={cache.get('enabled')}, "
+              f"hit_ratio={cache.get('hit_ratio')})")
+        self.results["auth_me"] = {
+            "req_per_s": f"{rps:.1f}",
+            "user_cache_enabled": str(cache.get("enabled")),
+            "hit_ratio": str(cache.get("hit_ratio"))
+        }
+
+    def bench_login_burst(self, logins: int = 200):
+        """Throughput of simultaneous logins and /api/health latency during the burst"""
+        print(f"\n🔐 Login burst: {logins} simultaneous /api/auth/login")
+        idle = self.measure_idle("/health")
+        stop = threading.Event()
+        loaded: List[float] = []
+        sampler = threading.Thread(target=self.sample_latency, args=("/health", stop, loaded))
+        sampler.start()
+
+        def login(_):
+            response = requests.post(f"{API_URL}/auth/login", json={
+                "email": self.email, "password": "Bench123!"
+            }, timeout=300)
+            return response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=logins) as pool:
+            statuses = list(pool.map(login, range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+
+        ok = statuses.count(200)
+        busy = statuses.count(503)
+        print(f"   logins: {ok} ok, {busy} rejected (503) in {elapsed:.2f}s -> {ok / elapsed:.1f} logins/s")
+        print(f"   /health idle:   {summarize(idle)}")
+        print(f"   /health loaded: {summarize(loaded)}")
+        self.results["login_burst"] = {
+            "logins_per_s": f"{ok / elapsed:.1f}",
+            "rejected": str(busy),
+            "health_p99_added": f"{(percentile(loaded, 99) - percentile(idle, 99)) * 1000:.1f}ms"
+        }
+
+    def bench_prompt_size(self, turns: int = 60):
+        """Prompt size per turn over a long study session (summary + recent turns)"""
+        print(f"\n📝 Prompt size over a {turns}-turn session")
+        response = self.session.post(f"{API_URL}/conversations", json={
+            "title": "Sessão longa", "subject": "Matemática"
+        }, headers=self.headers())
+        response.raise_for_status()
+        self.conversation_id = response.json()["id"]
+        FakeLLMHandler.chat_prompt_sizes.clear()
+        latencies = []
+        for turn in range(turns):
+            latencies.append(self.send_chat(f"Pergunta {turn}: como somar frações com denominadores diferentes?"))
+        sizes = FakeLLMHandler.chat_prompt_sizes[-turns:]
+        checkpoints = sorted({1, 10, 20, 40, turns} & set(range(1, len(sizes) + 1)))
+        for turn in checkpoints:
+            print(f"   turn {turn:>3}: prompt {sizes[turn - 1]:>6} chars (~{sizes[turn - 1] // 4} tokens)")
+        print(f"   /chat latency: {summarize(latencies)}")
+        self.results["prompt_size"] = {f"turn_{turn}": f"{sizes[turn - 1]} chars" for turn in checkpoints}
+
+    def bench_answer_cache(self, log_path: str = None):
+        """Replay a question log (first turn of a new conversation each) against the answer cache"""
+        if log_path:
+            with open(log_path) as f:
+                questions = [json.loads(line) for line in f if line.strip()]
+        else:
+            questions = SAMPLE_QUESTION_LOG
+        print(f"\n🗂️  Answer cache replay: {len(questions)} questions")
+        before = self.session.get(f"{API_URL}/health").json().get("answer_cache", {})
+        latencies = []
+        for question in questions:
+            response = self.session.post(f"{API_URL}/conversations", json={
+                "title": "Replay", "subject": question["subject"]
+            }, headers=self.headers())
+            response.raise_for_status()
+            start = time.perf_counter()
+            requests.post(f"{API_URL}/chat", json={
+                "conversation_id": response.json()["id"],
+                "message": question["message"],
+                "request_type": question.get("request_type", "help"),
+                "subject": question["subject"]
+            }, headers=self.headers(), timeout=300).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        after = self.session.get(f"{API_URL}/health").json().get("answer_cache", {})
+        hits = sum(after.get("hits", {}).values()) - sum(before.get("hits", {}).values())
+        misses = after.get("misses", 0) - before.get("misses", 0)
+        saved = after.get("saved_seconds", 0) - before.get("saved_seconds", 0)
+        ratio = hits / (hits + misses) if hits + misses else 0.0
+        print(f"   hit ratio: {ratio:.1%} ({hits} hits, {misses} misses), LLM time saved: {saved:.1f}s")
+        print(f"   /chat latency: {summarize(latencies)}")
+        self.results["answer_cache"] = {
+            "hit_ratio": f"{ratio:.1%}",
+            "saved_seconds": f"{saved:.1f}",
+            "chat_p50": f"{percentile(latencies, 50) * 1000:.1f}ms"
+        }
+
+    def bench_classroom_spike(self, students: int = 50):
+        """Same exercise sent by many students at once: upstream calls versus requests"""
+        print(f"\n🏫 Classroom spike: {students} identical prompts at once")
+        exercise = f"Exercício {uuid.uuid4().hex[:6]}: quanto é 3/4 + 1/8?"
+        conversations = []
+        for _ in range(students):
+            response = self.session.post(f"{API_URL}/conversations", json={
+                "title": "Exercício da lousa", "subject": "Matemática"
+            }, headers=self.headers())
+            response.raise_for_status()
+            conversations.append(response.json()["id"])
+        upstream_before = len(FakeLLMHandler.chat_prompt_sizes)
+
+        def ask(conversation_id):
+            start = time.perf_counter()
+            requests.post(f"{API_URL}/chat", json={
+                "conversation_id": conversation_id,
+                "message": exercise,
+                "request_type": "help",
+                "subject": "Matemática"
+            }, headers=self.headers(), timeout=300).raise_for_status()
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            latencies = list(pool.map(ask, conversations))
+        upstream = len(FakeLLMHandler.chat_prompt_sizes) - upstream_before
+        print(f"   {students} requests -> {upstream} upstream LLM calls")
+        print(f"   /chat latency: {summarize(latencies)}")
+        self.results["classroom_spike"] = {
+            "requests": str(students),
+            "upstream_calls": str(upstream),
+            "chat_p99": f"{percentile(latencies, 99) * 1000:.1f}ms"
+        }
+
+    def upload_and_wait(self, path: Path) -> Dict[str, float]:
+        """Upload one file and long-poll until its extraction finishes"""
+        session = requests.Session()
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            response = session.post(f"{API_URL}/files/upload", files={"file": (path.name, f)},
+                                    data={"conversation_id": self.conversation_id},
+                                    headers=self.headers(), timeout=300)
+        response.raise_for_status()
+        accepted = time.perf_counter() - start
+        status = response.json()
+        while status["status"] == "processing":
+            status = session.get(f"{API_URL}/files/{status['file_id']}", params={"wait": 25},
+                                 headers=self.headers(), timeout=60).json()
+        return {"accepted": accepted, "done": time.perf_counter() - start}
+
+    def bench_pdf_uploads(self, uploads: int = 20):
+        """Concurrent PDF uploads: acceptance latency, extraction throughput, /api/health p99"""
+        print(f"\n📄 PDF uploads: {uploads} concurrent uploads of {[p.name for p in SAMPLE_PDFS]}")
+        idle = self.measure_idle("/health")
+        stop = threading.Event()
+        loaded: List[float] = []
+        sampler = threading.Thread(target=self.sample_latency, args=("/health", stop, loaded))
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=uploads) as pool:
+            timings = list(pool.map(self.upload_and_wait, [SAMPLE_PDFS[i % len(SAMPLE_PDFS)] for i in range(uploads)]))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+        print(f"   upload accepted: {summarize([t['accepted'] for t in timings])}")
+        print(f"   text ready:      {summarize([t['done'] for t in timings])}")
+        print(f"   throughput: {uploads / elapsed:.2f} files/s")
+        print(f"   /health idle:   {summarize(idle)}")
+        print(f"   /health loaded: {summarize(loaded)}")
+        self.results["pdf_uploads"] = {
+            "files_per_s": f"{uploads / elapsed:.2f}",
+            "accepted_p99": f"{percentile([t['accepted'] for t in timings], 99) * 1000:.1f}ms",
+            "health_p99_loaded": f"{percentile(loaded, 99) * 1000:.1f}ms"
+        }
+
+    def bench_large_uploads(self, uploads: int = 10, size_mb: int = 20):
+        """Concurrent large PDF uploads: MB/s, /api/health p99, 413 for oversized bodies"""
+        print(f"\n📦 Large uploads: {uploads} concurrent uploads of {size_mb} MB")
+        payloads = [b"%PDF-1.4\n" + os.urandom(size_mb * 1024 * 1024) for _ in range(uploads)]
+        idle = self.measure_idle("/health")
+        stop = threading.Event()
+        loaded: List[float] = []
+        sampler = threading.Thread(target=self.sample_latency, args=("/health", stop, loaded))
+        sampler.start()
+
+        def upload(payload):
+            start = time.perf_counter()
+            requests.post(f"{API_URL}/files/upload", files={"file": ("big.pdf", payload, "application/pdf")},
+                          data={"conversation_id": self.conversation_id},
+                          headers=self.headers(), timeout=300).raise_for_status()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=uploads) as pool:
+            latencies = list(pool.map(upload, payloads))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+
+        oversized = requests.post(f"{API_URL}/files/upload",
+                                  files={"file": ("huge.pdf", b"%PDF-1.4\n" + bytes(100 * 1024 * 1024))},
+                                  data={"conversation_id": self.conversation_id},
+                                  headers=self.headers(), timeout=300)
+        throughput = uploads * size_mb / elapsed
+        print(f"   upload latency: {summarize(latencies)}")
+        print(f"   throughput: {throughput:.1f} MB/s")
+        print(f"   /health idle:   {summarize(idle)}")
+        print(f"   /health loaded: {summarize(loaded)}")
+        print(f"   100 MB upload -> {oversized.status_code}")
+        self.results["large_uploads"] = {
+            "mb_per_s": f"{throughput:.1f}",
+            "health_p99_loaded": f"{percentile(loaded, 99) * 1000:.1f}ms",
+            "oversized_status": str(oversized.status_code)
+        }
+
+    def bench_pdf_tiers(self, rounds: int = 3):
+        """Pages/s of each PDF extraction tier on the bundled PDFs, plus the whole-document baseline"""
+        print(f"\n📑 PDF extraction tiers: {[p.name for p in SAMPLE_PDFS]} x {rounds}")
+        sys.path.insert(0, str(BACKEND_DIR))
+        from extraction import ExtractionPool, extract_text, pdf_page_count
+
+        async def measure(ocr: str):
+            pool = ExtractionPool(workers=os.cpu_count() or 2)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for path in SAMPLE_PDFS:
+                    await pool.extract_pdf(str(path), ocr=ocr)
+            elapsed = time.perf_counter() - start
+            pool.close()
+            return sum(pool.pages.values()) / elapsed
+
+        pages = sum(pdf_page_count(str(path)) for path in SAMPLE_PDFS) * rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for path in SAMPLE_PDFS:
+                extract_text(str(path), "pdf")
+        baseline = pages / (time.perf_counter() - start)
+        text_tier = asyncio.run(measure("never"))
+        ocr_tier = asyncio.run(measure("always"))
+        auto = asyncio.run(measure("auto"))
+        print(f"   partition_pdf (whole document): {baseline:.2f} pages/s")
+        print(f"   text layer:                     {text_tier:.2f} pages/s")
+        print(f"   OCR:                            {ocr_tier:.2f} pages/s")
+        print(f"   auto (text layer, OCR fallback): {auto:.2f} pages/s")
+        self.results["pdf_tiers"] = {
+            "partition_pdf_pages_per_s": f"{baseline:.2f}",
+            "text_pages_per_s": f"{text_tier:.2f}",
+            "ocr_pages_per_s": f"{ocr_tier:.2f}",
+            "auto_pages_per_s": f"{auto:.2f}"
+        }
+
+    def bench_image_ocr(self, rounds: int = 5):
+        """OCR latency on the bundled JPEGs with and without preprocessing, with per-step timings"""
+        print(f"\n🖼️  Image OCR: {[p.name for p in SAMPLE_IMAGES]} x {rounds}")
+        sys.path.insert(0, str(BACKEND_DIR))
+        from extraction import ocr_image
+
+        results = {}
+        for preprocess in (False, True):
+            latencies: List[float] = []
+            steps: Dict[str, float] = {}
+            for _ in range(rounds):
+                for path in SAMPLE_IMAGES:
+                    start = time.perf_counter()
+                    _, timings = ocr_image(str(path), preprocess=preprocess)
+                    latencies.append(time.perf_counter() - start)
+                    for name, seconds in timings.items():
+                        steps[name] = steps.get(name, 0.0) + seconds
+            label = "preprocessed" if preprocess else "raw"
+            print(f"   {label:<12} {summarize(latencies)}")
+            print("   " + " ".join(f"{name}={seconds / len(latencies) * 1000:.1f}ms" for name, seconds in steps.items()))
+            results[f"{label}_p50"] = f"{percentile(latencies, 50) * 1000:.1f}ms"
+        self.results["image_ocr"] = results
+
+    def bench_stt(self, clips: int = 20, seconds: int = 8):
+        """Speech-to-text latency and bytes sent upstream per request for 48 kHz stereo WAV clips"""
+        print(f"\n🎙️  STT: {clips} concurrent {seconds}s WAV clips")
+        recordings = []
+        for clip in range(clips):
+            frequency = 220 + clip * 10  # distinct clips, so none are coalesced
+            frames = b"".join(
+                int(8000 * math.sin(2 * math.pi * frequency * n / 48000)).to_bytes(2, "little", signed=True) * 2
+                for n in range(48000 * seconds)
+            )
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as wav:
+                wav.setnchannels(2)
+                wav.setsampwidth(2)
+                wav.setframerate(48000)
+                wav.writeframes(frames)
+            recordings.append(buffer.getvalue())
+
+        def transcribe(recording):
+            start = time.perf_counter()
+            requests.post(f"{API_URL}/audio/stt", files={"audio": ("clip.wav", recording, "audio/wav")},
+                          headers=self.headers(), timeout=120).raise_for_status()
+            return time.perf_counter() - start
+
+        sent_before = len(FakeLLMHandler.transcription_sizes)
+        with ThreadPoolExecutor(max_workers=clips) as pool:
+            latencies = list(pool.map(transcribe, recordings))
+        sent = FakeLLMHandler.transcription_sizes[sent_before:]
+        uploaded = sum(len(recording) for recording in recordings) / clips
+        upstream = sum(sent) / len(sent) if sent else 0
+        print(f"   /audio/stt latency: {summarize(latencies)}")
+        print(f"   bytes per request: uploaded {uploaded / 1024:.0f} KB, sent upstream {upstream / 1024:.0f} KB")
+        self.results["stt"] = {
+            "stt_p99": f"{percentile(latencies, 99) * 1000:.1f}ms",
+            "uploaded_kb": f"{uploaded / 1024:.0f}",
+            "upstream_kb": f"{upstream / 1024:.0f}"
+        }
+
+    def bench_dashboard(self, levels=(10, 100, 1000), samples: int = 50):
+        """/api/dashboard p50/p99 as the user's conversation count grows, cached and uncached"""
+        print(f"\n📊 Dashboard: conversations per user {list(levels)}")
+        subjects = ["Matemática", "Português", "Ciências", "História", "Geografia"]
+        session = requests.Session()
+
+        def create(index):
+            requests.post(f"{API_URL}/conversations", json={
+                "title": f"Conversa {index}", "subject": subjects[index % len(subjects)]
+            }, headers=self.headers(), timeout=30).raise_for_status()
+
+        created = 1  # setup_user's conversation
+        results = {}
+        for level in levels:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                list(pool.map(create, range(created, level)))
+            created = max(created, level)
+
+            cold: List[float] = []
+            for _ in range(samples):
+                # Any conversation write invalidates the user's dashboard cache
+                session.post(f"{API_URL}/conversations", json={"title": "x", "subject": "Artes"},
+                             headers=self.headers()).raise_for_status()
+                created += 1
+                start = time.perf_counter()
+                session.get(f"{API_URL}/dashboard", headers=self.headers()).raise_for_status()
+                cold.append(time.perf_counter() - start)
+            warm = self.measure_idle("/dashboard", samples)
+            print(f"   {created:>5} conversations  uncached: {summarize(cold)}")
+            print(f"   {'':>5}                cached:   {summarize(warm)}")
+            results[str(level)] = (f"uncached p50={percentile(cold, 50) * 1000:.1f}ms "
+                                   f"p99={percentile(cold, 99) * 1000:.1f}ms, "
+                                   f"cached p99={percentile(warm, 99) * 1000:.1f}ms")
+        self.results["dashboard"] = results
+
+    def bench_leaderboard(self, users: int = 1_000_000, operations: int = 100_000):
+        """Leaderboard board at 1M users: load, XP increments, rank lookups and top-K pages"""
+        print(f"\n🏆 Leaderboard: {users:,} users, {operations:,} operations per phase")
+        sys.path.insert(0, str(BACKEND_DIR))
+        from leaderboard import Board
+
+        rng = random.Random(7)
+        user_ids = [f"user-{i}" for i in range(users)]
+        scores = {user_id: rng.randint(1, 5000) for user_id in user_ids}
+        start = time.perf_counter()
+        board = Board(scores)  # how a board is loaded from leaderboard_scores
+        build = users / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(operations):
+            board.add(rng.choice(user_ids), rng.choice((2, 5, 10)))
+        increments = operations / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(operations):
+            board.rank(rng.choice(user_ids))
+        ranks = operations / (time.perf_counter() - start)
+
+        pages = []
+        for offset in (0, users // 2, users - 10):
+            start = time.perf_counter()
+            board.top(10, offset)
+            pages.append(time.perf_counter() - start)
+
+        print(f"   load:         {build:,.0f} users/s")
+        print(f"   XP increment: {increments:,.0f} ops/s")
+        print(f"   rank lookup:  {ranks:,.0f} ops/s")
+        print(f"   top-10 page at offset 0 / middle / end: "
+              + " / ".join(f"{page * 1e6:.0f}µs" for page in pages))
+        self.results["leaderboard"] = {
+            "increments_per_s": f"{increments:.0f}",
+            "rank_lookups_per_s": f"{ranks:.0f}",
+            "top10_page_us": f"{pages[0] * 1e6:.0f}"
+        }
+
+    def bench_response_parser(self, outputs: int = 20000):
+        """Fuzz the AI response parser with malformed outputs and measure its throughput"""
+        print(f"\n🧩 Response parser: {outputs} fuzzed model outputs")
+        sys.path.insert(0, str(BACKEND_DIR))
+        from response_parser import parse_ai_response, parse_stats
+
+        def legacy_parse(text):
+            # json.loads, then the greedy regex the parser replaced
+            try:
+                return json.loads(text)
+            except json.JSONDecodeError:
+                match = re.search(r'\{.*\}', text, re.DOTALL)
+                try:
+                    return json.loads(match.group()) if match else None
+                except json.JSONDecodeError:
+                    return None
+
+        corpus = malformed_outputs(outputs)
+        start = time.perf_counter()
+        legacy_failures = sum(1 for text in corpus if not isinstance(legacy_parse(text), dict))
+        legacy_rate = outputs / (time.perf_counter() - start)
+
+        before = dict(parse_stats.outcomes)
+        crashes = 0
+        start = time.perf_counter()
+        for text in corpus:
+            try:
+                parse_ai_response(text, "help")
+            except Exception:
+                crashes += 1
+        rate = outputs / (time.perf_counter() - start)
+        outcomes = {outcome: count - before[outcome] for outcome, count in parse_stats.outcomes.items()}
+        failure_rate = outcomes["failed"] / outputs
+        print(f"   outcomes: {outcomes}")
+        print(f"   exceptions raised: {crashes}")
+        print(f"   legacy (json.loads + regex): {legacy_rate:,.0f} parses/s, {legacy_failures / outputs:.1%} unusable")
+        print(f"   response_parser:             {rate:,.0f} parses/s, {failure_rate:.1%} unusable")
+        self.results["response_parser"] = {
+            "parses_per_s": f"{rate:.0f}",
+            "legacy_parses_per_s": f"{legacy_rate:.0f}",
+            "failure_rate": f"{failure_rate:.4f}",
+            "exceptions": str(crashes)
+        }
+
+    def bench_metrics(self, requests_count: int = 200_000, observations: int = 1_000_000):
+        """Metrics overhead: recording cost, per-request middleware cost and /metrics render time"""
+        print(f"\n📈 Metrics: {requests_count:,} requests, {observations:,} observations")
+        sys.path.insert(0, str(BACKEND_DIR))
+        from types import SimpleNamespace
+        from metrics import MetricsMiddleware, Histogram, Counter, Registry
+
+        histogram = Histogram("bench_seconds", "bench", ("route", "status"))
+        counter = Counter("bench_total", "bench", ("outcome",))
+        start = time.perf_counter()
+        for i in range(observations):
+            histogram.observe(0.042, "/api/chat", "200")
+        observe_ns = (time.perf_counter() - start) / observations * 1e9
+        start = time.perf_counter()
+        for i in range(observations):
+            counter.inc("fast")
+        inc_ns = (time.perf_counter() - start) / observations * 1e9
+
+        route = SimpleNamespace(path="/api/chat")
+
+        async def app(scope, receive, send):
+            scope["route"] = route
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            pass
+
+        async def serve(handler):
+            start = time.perf_counter()
+            for _ in range(requests_count):
+                await handler({"type": "http", "method": "POST", "path": "/api/chat"}, receive, send)
+            return time.perf_counter() - start
+
+        bare = asyncio.run(serve(app))
+        wrapped = asyncio.run(serve(MetricsMiddleware(app)))
+        overhead_us = (wrapped - bare) / requests_count * 1e6
+
+        registry = Registry()
+        scrape = registry.register(Histogram("bench_request_seconds", "bench", ("method", "route", "status")))
+        for index in range(60):
+            for status in ("200", "400", "404", "500"):
+                scrape.observe(0.1, "GET", f"/api/route{index}", status)
+        start = time.perf_counter()
+        body = registry.render()
+        render_ms = (time.perf_counter() - start) * 1000
+
+        print(f"   histogram observe: {observe_ns:.0f}ns, counter inc: {inc_ns:.0f}ns")
+        print(f"   middleware overhead: {overhead_us:.2f}µs per request")
+        print(f"   render of 240 histogram series: {render_ms:.1f}ms ({len(body) // 1024} KiB)")
+        self.results["metrics"] = {
+            "observe_ns": f"{observe_ns:.0f}",
+            "middleware_overhead_us": f"{overhead_us:.2f}",
+            "render_240_series_ms": f"{render_ms:.1f}"
+        }
+
+    def bench_loop_watchdog(self, blocks=(0.05, 0.15, 0.4), requests_count: int = 100_000):
+        """Event-loop watchdog: which injected blocking calls get reported, and its per-request cost"""
+        print(f"\n🐢 Event-loop watchdog: blocking calls of {[f'{b * 1000:.0f}ms' for b in blocks]}")
+        sys.path.insert(0, str(BACKEND_DIR))
+        from types import SimpleNamespace
+        from loop_watchdog import LoopWatchdogMiddleware, loop_watchdog
+
+        def blocking_app(seconds):
+            async def app(scope, receive, send):
+                scope["route"] = SimpleNamespace(path="/api/auth/login")
+                time.sleep(seconds)  # stands in for bcrypt, PIL or a sync client call
+            return app
+
+        async def noop(scope, receive, send):
+            pass
+
+        async def main():
+            await loop_watchdog.start()
+            detected = []
+            for seconds in blocks:
+                before = loop_watchdog.blocks
+                await asyncio.sleep(loop_watchdog.interval * 2)
+                await LoopWatchdogMiddleware(blocking_app(seconds))(
+                    {"type": "http", "method": "POST", "path": "/api/auth/login"}, None, None
+                )
+                await asyncio.sleep(loop_watchdog.interval * 2)
+                detected.append(loop_watchdog.blocks > before)
+            scope = {"type": "http", "method": "GET", "path": "/api/health"}
+            start = time.perf_counter()
+            for _ in range(requests_count):
+                await noop(scope, None, None)
+            bare = time.perf_counter() - start
+            tracked = LoopWatchdogMiddleware(noop)
+            start = time.perf_counter()
+            for _ in range(requests_count):
+                await tracked(scope, None, None)
+            overhead = (time.perf_counter() - start - bare) / requests_count
+            await loop_watchdog.close()
+            return detected, overhead
+
+        detected, overhead = asyncio.run(main())
+        for seconds, found in zip(blocks, detected):
+            print(f"   {seconds * 1000:>4.0f}ms block: {'reported' if found else 'not reported'}"
+                  f" (threshold {loop_watchdog.threshold * 1000:.0f}ms)")
+        print(f"   max lag: {loop_watchdog.stats()['max_lag_ms']}ms, tracking overhead: {overhead * 1e6:.2f}µs per request")
+        self.results["loop_watchdog"] = {
+            "reported": ",".join(f"{seconds * 1000:.0f}ms={found}" for seconds, found in zip(blocks, detected)),
+            "tracking_overhead_us": f"{overhead * 1e6:.2f}"
+        }
+
+    def run(self, scenarios: List[str]):
+        print("🚀 Starting ProfAI Backend Benchmarks")
+        if any(name not in LOCAL_SCENARIOS for name in scenarios):
+            print(f"🔗 Backend URL: {BASE_URL}")
+            start_fake_llm()
+            self.setup_user()
+        for name in scenarios:
+            getattr(self, f"bench_{name}")()
+        print("\n" + "=" * 60)
+        print("📊 BENCHMARK SUMMARY")
+        print("=" * 60)
+        print(json.dumps(self.results, indent=2, ensure_ascii=False))
+
+
+SCENARIOS = ["chat_load", "chat_stream", "auth_me", "login_burst", "prompt_size", "answer_cache",
+             "classroom_spike", "pdf_uploads", "large_uploads", "pdf_tiers", "image_ocr", "stt",
+             "response_parser", "dashboard", "chat_writes", "leaderboard", "metrics",
+             "loop_watchdog"]
+LOCAL_SCENARIOS = {"pdf_tiers", "image_ocr", "response_parser", "leaderboard", "metrics", "loop_watchdog"}
+
+if __name__ == "__main__":
+    ProfAIBenchmark().run(sys.argv[1:] or SCENARIOS)
@@ -334,9 +334,9 @@ function Sidebar({ user, setUser, isOpen, onClose }) {
         <div className="p-6 border-b border-gray-200 dark:border-gray-700">
           <h1 className="text-2xl font-bold text-gray-900 dark:text-white">ProfAI</h1>
           <div className="flex items-center mt-4">
-            {user.avatar && (
+            {user.avatar_url && (
               <img 
-                src={`data:image/png;base64,${user.avatar}`}
+                src={`${BACKEND_URL}${user.avatar_url}?size=128`}
                 alt="Avatar"
                 className="w-10 h-10 rounded-full mr-3"
               />
@@ -409,9 +409,9 @@ function Sidebar({ user, setUser, isOpen, onClose }) {
         
         <div className="p-4 border-b border-gray-200 dark:border-gray-700">
           <div className="flex items-center">
-            {user.avatar && (
+            {user.avatar_url && (
               <img 
-                src={`data:image/png;base64,${user.avatar}`}
+                src={`${BACKEND_URL}${user.avatar_url}?size=64`}
                 alt="Avatar"
                 className="w-8 h-8 rounded-full mr-3"
               />
@@ -607,7 +607,7 @@ function Dashboard({ user }) {
             <div className="space-y-3">
               {dashboardData?.achievements.map((achievement, index) => (
                 <div 
-                  key={index}
+                  key={achievement.id || index}
                   className={`flex items-center p-3 rounded-lg ${
                     achievement.unlocked 
                       ? 'bg-yellow-50 dark:bg-yellow-900' 
@@ -681,6 +681,8 @@ function ChatInterface({ user }) {
   const [conversations, setConversations] = useState([]);
   const [currentConversation, setCurrentConversation] = useState(null);
   const [messages, setMessages] = useState([]);
+  const [olderMessagesCursor, setOlderMessagesCursor] = useState(null);
+  const [olderConversationsCursor, setOlderConversationsCursor] = useState(null);
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(false);
   const [showNewChat, setShowNewChat] = useState(false);
@@ -707,6 +709,7 @@ function ChatInterface({ user }) {
         headers: { Authorization: `Bearer ${token}` }
       });
       setConversations(response.data);
+      setOlderConversationsCursor(response.headers['x-before-cursor'] || null);
       
       if (response.data.length > 0 && !currentConversation) {
         selectConversation(response.data[0]);
@@ -716,14 +719,46 @@ function ChatInterface({ user }) {
     }
   };
 
+  const loadOlderConversations = async () => {
+    if (!olderConversationsCursor) return;
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/conversations`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { before: olderConversationsCursor }
+      });
+      setConversations((current) => [...current, ...response.data]);
+      setOlderConversationsCursor(response.headers['x-before-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching conversations:', error);
+    }
+  };
+
   const selectConversation = async (conversation) => {
     setCurrentConversation(conversation);
     try {
       const token = localStorage.getItem('token');
       const response = await axios.get(`${API}/conversations/${conversation.id}/messages`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { include_ai_response: true }
       });
       setMessages(response.data);
+      setOlderMessagesCursor(response.headers['x-before-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching messages:', error);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    if (!olderMessagesCursor || !currentConversation) return;
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/conversations/${currentConversation.id}/messages`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { include_ai_response: true, before: olderMessagesCursor }
+      });
+      setMessages((current) => [...response.data, ...current]);
+      setOlderMessagesCursor(response.headers['x-before-cursor'] || null);
     } catch (error) {
       console.error('Error fetching messages:', error);
     }
@@ -798,8 +833,18 @@ function ChatInterface({ user }) {
         }
       });
 
+      // Extraction runs in the background; long-poll until it finishes
+      let fileStatus = response.data;
+      while (fileStatus.status === 'processing') {
+        const statusResponse = await axios.get(`${API}/files/${fileStatus.file_id}`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { wait: 25 }
+        });
+        fileStatus = statusResponse.data;
+      }
+
       // Send the extracted text as a message
-      await sendMessage('help', response.data.message);
+      await sendMessage('help', fileStatus.message);
     } catch (error) {
       console.error('Error uploading file:', error);
       alert('Erro ao processar arquivo');
@@ -934,6 +979,14 @@ function ChatInterface({ user }) {
               </p>
             </div>
           ))}
+          {olderConversationsCursor && (
+            <button
+              onClick={loadOlderConversations}
+              className="w-full p-3 text-sm text-blue-600 dark:text-blue-400 hover:bg-gray-50 dark:hover:bg-gray-700"
+            >
+              Carregar mais conversas
+            </button>
+          )}
         </div>
       </div>
 
@@ -963,6 +1016,16 @@ function ChatInterface({ user }) {
 
             {/* Messages */}
             <div className="flex-1 overflow-y-auto p-3 lg:p-4 space-y-3 lg:space-y-4">
+              {olderMessagesCursor && (
+                <div className="flex justify-center">
+                  <button
+                    onClick={loadOlderMessages}
+                    className="px-3 py-1 text-xs lg:text-sm text-blue-600 dark:text-blue-400 hover:underline"
+                  >
+                    Carregar mensagens anteriores
+                  </button>
+                </div>
+              )}
               {messages.map((message) => (
                 <MessageBubble key={message.id} message={message} />
               ))}
@@ -1110,16 +1173,32 @@ function MessageBubble({ message }) {
       const formData = new FormData();
       formData.append('text', text);
       
-      const response = await axios.post(`${API}/audio/tts`, formData, {
-        headers: { 
-          Authorization: `Bearer ${token}`,
-          'Content-Type': 'multipart/form-data'
-        }
+      const response = await fetch(`${API}/audio/tts`, {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${token}` },
+        body: formData
       });
+      if (!response.ok) throw new Error(`TTS failed: ${response.status}`);
       
-      // Play audio from base64
-      const audioBlob = new Blob([Uint8Array.from(atob(response.data.audio_base64), c => c.charCodeAt(0))], { type: 'audio/mp3' });
-      const audioUrl = URL.createObjectURL(audioBlob);
+      // Play while the audio is still streaming when the browser supports it
+      let audioUrl;
+      if (window.MediaSource && MediaSource.isTypeSupported('audio/mpeg')) {
+        const mediaSource = new MediaSource();
+        audioUrl = URL.createObjectURL(mediaSource);
+        mediaSource.addEventListener('sourceopen', async () => {
+          const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+          const reader = response.body.getReader();
+          while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            sourceBuffer.appendBuffer(value);
+            await new Promise(resolve => sourceBuffer.addEventListener('updateend', resolve, { once: true }));
+          }
+          mediaSource.endOfStream();
+        }, { once: true });
+      } else {
+        audioUrl = URL.createObjectURL(await response.blob());
+      }
       const audio = new Audio(audioUrl);
       
       audio.onended = () => {
@@ -1419,9 +1498,9 @@ function Profile({ user }) {
 
         <div className="bg-white dark:bg-gray-800 p-6 rounded-xl shadow-sm">
           <div className="flex items-center mb-6">
-            {user.avatar ? (
+            {user.avatar_url ? (
               <img 
-                src={`data:image/png;base64,${user.avatar}`}
+                src={`${BACKEND_URL}${user.avatar_url}?size=256`}
                 alt="Avatar"
                 className="w-20 h-20 rounded-full mr-4"
               />
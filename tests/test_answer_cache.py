@@ -0,0 +1,59 @@
+import asyncio
+
+from answer_cache import AnswerCache
+
+ANSWER = {"type": "help", "intro": "Vamos lá!"}
+
+
+def make_cache():
+    calls = []
+
+    async def embed(text):
+        calls.append(text)
+        # Questions about fractions point the same way, anything else elsewhere
+        return [1.0, 0.1] if "fração" in text else [0.0, 1.0]
+
+    cache = AnswerCache(similarity=0.9)
+    cache.attach(embed=embed)
+    return cache, calls
+
+
+def test_miss_embeds_the_question_once():
+    cache, calls = make_cache()
+
+    async def main():
+        ai_response, embedding = await cache.get("O que é fração?", "Matemática", "help", "", "6")
+        assert ai_response is None and embedding is not None
+        await cache.set("O que é fração?", "Matemática", "help", "", "6", ANSWER, 1.0, embedding=embedding)
+
+    asyncio.run(main())
+    assert len(calls) == 1
+
+
+def test_similar_question_hits_and_exact_hit_skips_embedding():
+    cache, calls = make_cache()
+
+    async def main():
+        _, embedding = await cache.get("O que é fração?", "Matemática", "help", "", "6")
+        await cache.set("O que é fração?", "Matemática", "help", "", "6", ANSWER, 1.0, embedding=embedding)
+        similar, _ = await cache.get("me explica fração", "Matemática", "help", "", "6")
+        exact, exact_embedding = await cache.get("o que é fração", "Matemática", "help", "", "6")
+        other, _ = await cache.get("O que é verbo?", "Português", "help", "", "6")
+        return similar, exact, exact_embedding, other
+
+    similar, exact, exact_embedding, other = asyncio.run(main())
+    assert similar == ANSWER and exact == ANSWER and other is None
+    assert exact_embedding is None
+    assert len(calls) == 3  # first miss, similar hit, other miss; none for set or the exact hit
+
+
+def test_set_embeds_when_not_given_one():
+    cache, calls = make_cache()
+
+    async def main():
+        await cache.set("O que é fração?", "Matemática", "help", "", "6", ANSWER)
+        return await cache.get("fração, o que é?", "Matemática", "help", "", "6")
+
+    ai_response, _ = asyncio.run(main())
+    assert ai_response == ANSWER
+    assert len(calls) == 2
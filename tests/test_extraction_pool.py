@@ -0,0 +1,82 @@
+import asyncio
+import os
+import time
+
+import extraction
+from extraction import ExtractionPool
+
+
+def fake_extract_text(file_path, file_ext):
+    """Hangs the first time it sees a "hang" file, then succeeds; "slow" files take 0.8 s."""
+    if "hang" in file_path:
+        marker = f"{file_path}.seen"
+        if not os.path.exists(marker):
+            open(marker, "w").close()
+            time.sleep(60)
+    if "slow" in file_path:
+        time.sleep(0.8)
+    return f"text of {os.path.basename(file_path)}"
+
+
+def crash(file_path, file_ext):
+    os._exit(1)
+
+
+async def run_jobs(pool, paths):
+    results = await asyncio.gather(
+        *(pool.extract(path, "txt") for path in paths), return_exceptions=True
+    )
+    return [result if isinstance(result, str) else f"FAILED {type(result).__name__}" for result in results]
+
+
+def test_timeout_recycles_once_and_neighbours_retry(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction, "extract_text", fake_extract_text)
+    pool = ExtractionPool(workers=2, timeout=1.0, retries=1)
+
+    async def neighbour():
+        # Still running when the hung job times out and the pool is recycled
+        await asyncio.sleep(0.5)
+        return await pool.extract(str(tmp_path / "slow.txt"), "txt")
+
+    async def main():
+        try:
+            results = await asyncio.gather(
+                pool.extract(str(tmp_path / "hang.txt"), "txt"), neighbour(), return_exceptions=True
+            )
+        finally:
+            pool.close()
+        return [result if isinstance(result, str) else f"FAILED {type(result).__name__}" for result in results]
+
+    started = time.monotonic()
+    results = asyncio.run(main())
+    assert results == ["text of hang.txt", "text of slow.txt"]
+    assert pool.recycles == 1
+    assert time.monotonic() - started < 10  # the hung worker was killed, not waited for
+
+
+def test_stale_failure_does_not_recycle_new_pool(monkeypatch):
+    monkeypatch.setattr(extraction, "extract_text", fake_extract_text)
+    pool = ExtractionPool(workers=1)
+    old = pool.start()
+    pool.recycle(old)
+    current = pool.executor
+    pool.recycle(old)
+    pool.recycle(old, kill=False)
+    assert pool.executor is current
+    assert pool.recycles == 1
+    pool.close()
+
+
+def test_dead_worker_recycles_pool(monkeypatch):
+    monkeypatch.setattr(extraction, "extract_text", crash)
+    pool = ExtractionPool(workers=2, timeout=5.0, retries=1)
+
+    async def main():
+        try:
+            return await run_jobs(pool, ["a.txt", "b.txt"])
+        finally:
+            pool.close()
+
+    assert asyncio.run(main()) == ["FAILED BrokenProcessPool"] * 2
+    # Both jobs share each broken pool, so each attempt recycles once
+    assert pool.recycles == 2
@@ -0,0 +1,29 @@
+from indexes import INDEXES, QUERY_SHAPES
+
+
+def index_keys(collection):
+    return [list(index.document["key"].items()) for index in INDEXES.get(collection, [])]
+
+
+def test_every_query_shape_starts_an_index():
+    """Offline stand-in for `python indexes.py --check`: each filter must use an index prefix."""
+    for description, collection, query, sort in QUERY_SHAPES:
+        fields = {field for field in query if not field.startswith("$")}
+        assert any(keys[0][0] in fields for keys in index_keys(collection)), \
+            f"no index for {description!r} on {collection}"
+
+
+def test_sorted_shapes_follow_an_index_order():
+    for description, collection, query, sort in QUERY_SHAPES:
+        if not sort:
+            continue
+        equality = {field for field, value in query.items() if not field.startswith("$") and not isinstance(value, dict)}
+        reverse = [(field, -direction) for field, direction in sort]
+        served = False
+        for keys in index_keys(collection):
+            prefix = 0
+            while prefix < len(keys) and keys[prefix][0] in equality:
+                prefix += 1
+            if keys[prefix:prefix + len(sort)] in (sort, reverse):
+                served = True
+        assert served, f"sort of {description!r} on {collection} is not served by an index"
@@ -0,0 +1,196 @@
+import asyncio
+import random
+
+import pytest
+
+from leaderboard import Board, Leaderboards, RankedSkipList, board_key
+
+
+def check(ranking, expected):
+    assert len(ranking) == len(expected)
+    assert ranking.slice(0, len(expected) + 1) == expected
+    for position, key in enumerate(expected):
+        assert ranking.rank(key) == position
+    for start in range(0, len(expected) + 2, 7):
+        assert ranking.slice(start, 5) == expected[start:start + 5]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_skip_list_matches_sorted(seed):
+    rng = random.Random(seed)
+    ranking = RankedSkipList()
+    keys = set()
+    for step in range(600):
+        if keys and rng.random() < 0.4:
+            key = rng.choice(sorted(keys))
+            assert ranking.remove(key)
+            keys.remove(key)
+        else:
+            key = (rng.randint(-50, 0), f"user-{rng.randint(0, 300)}")
+            if key in keys:
+                continue
+            ranking.insert(key)
+            keys.add(key)
+        if step % 50 == 0:
+            check(ranking, sorted(keys))
+    check(ranking, sorted(keys))
+    assert not ranking.remove((1, "absent"))
+    assert ranking.rank((1, "absent")) is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_skip_list_from_sorted_then_updates(seed):
+    rng = random.Random(seed)
+    keys = sorted({(rng.randint(-1000, 0), f"user-{i}") for i in range(rng.randint(0, 500))})
+    ranking = RankedSkipList.from_sorted(keys)
+    check(ranking, keys)
+    keys = set(keys)
+    for _ in range(300):
+        if keys and rng.random() < 0.5:
+            key = rng.choice(sorted(keys))
+            ranking.remove(key)
+            keys.remove(key)
+        else:
+            key = (rng.randint(-1000, 0), f"new-{rng.randint(0, 1000)}")
+            if key not in keys:
+                ranking.insert(key)
+                keys.add(key)
+    check(ranking, sorted(keys))
+
+
+def test_board_ranks_ties_by_user_id():
+    rng = random.Random(3)
+    board = Board({f"user-{i}": rng.randint(0, 20) for i in range(50)})
+    for _ in range(500):
+        board.add(f"user-{rng.randint(0, 80)}", rng.choice((2, 5, 10)))
+    expected = sorted(board.scores.items(), key=lambda item: (-item[1], item[0]))
+    assert board.top(len(expected)) == [
+        (position + 1, user_id, xp) for position, (user_id, xp) in enumerate(expected)
+    ]
+    for position, (user_id, _) in enumerate(expected):
+        assert board.rank(user_id) == position + 1
+    assert board.rank("nobody") is None
+
+
+class FakeScores:
+    """In-memory leaderboard_scores: find with sort/to_list/async iteration and bulk_write of UpdateOne."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find(self, query, projection=None):
+        docs = []
+        for doc in self.docs.values():
+            if all(
+                doc.get(field) is not None and doc[field] >= condition["$gte"]
+                if isinstance(condition, dict) else doc.get(field) == condition
+                for field, condition in query.items()
+            ):
+                docs.append(dict(doc))
+        return FakeCursor(docs)
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            key = (operation._filter["board"], operation._filter["user_id"])
+            doc = self.docs.get(key)
+            if doc is None:
+                doc = self.docs[key] = {**operation._filter, "xp": 0, **operation._doc["$setOnInsert"]}
+            doc["xp"] += operation._doc["$inc"]["xp"]
+            doc.update(operation._doc["$set"])
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            await asyncio.sleep(0)
+            yield doc
+
+
+def test_workers_converge_through_the_collection():
+    async def scenario():
+        rng = random.Random(11)
+        collection = FakeScores()
+        workers = [Leaderboards(flush_interval=3600) for _ in range(3)]
+        for worker in workers:
+            await worker.start(collection)
+        expected = {}
+        for round_number in range(5):
+            for _ in range(200):
+                worker = rng.choice(workers)
+                user_id = f"user-{rng.randint(0, 60)}"
+                amount = rng.choice((2, 5, 10))
+                worker.record_xp(user_id, "escola", "6ano", amount)
+                expected[user_id] = expected.get(user_id, 0) + amount
+                if rng.random() < 0.05:
+                    await rng.choice(workers).board("class", "escola", "6ano")
+            for worker in workers:
+                await worker.flush()
+            for worker in workers:
+                await worker.sync()
+            ranking = sorted(expected.items(), key=lambda item: (-item[1], item[0]))
+            for worker in workers:
+                _, board = await worker.board("class", "escola", "6ano")
+                assert board.top(len(ranking)) == [
+                    (position + 1, user_id, xp) for position, (user_id, xp) in enumerate(ranking)
+                ]
+        for worker in workers:
+            await worker.close()
+        assert sum(worker.loads for worker in workers) <= 3 * 3  # at most one load per board and worker
+
+    asyncio.run(scenario())
+
+
+def test_load_includes_unflushed_increments():
+    async def scenario():
+        collection = FakeScores()
+        first, second = Leaderboards(flush_interval=3600), Leaderboards(flush_interval=3600)
+        await first.start(collection)
+        await second.start(collection)
+        first.record_xp("ana", "escola", "6ano", 10)
+        await first.flush()
+        second.record_xp("bia", "escola", "6ano", 5)
+        second.record_xp("ana", "escola", "6ano", 2)
+        key, board = await second.board("school", "escola", "6ano")
+        assert key == board_key("school", "escola", "6ano", second.week)
+        assert board.top(10) == [(1, "ana", 12), (2, "bia", 5)]
+        for worker in (first, second):
+            await worker.close()
+
+    asyncio.run(scenario())
+
+
+def test_increments_during_load_are_kept():
+    async def scenario():
+        collection = FakeScores()
+        writer, reader = Leaderboards(flush_interval=3600), Leaderboards(flush_interval=3600)
+        await writer.start(collection)
+        await reader.start(collection)
+        for i in range(20000):
+            writer.record_xp(f"user-{i}", "escola", "6ano", 5)
+        await writer.flush()
+        reader.record_xp("ana", "escola", "6ano", 2)
+        load = asyncio.create_task(reader.board("grade", "escola", "6ano"))
+        for _ in range(50):
+            reader.record_xp("ana", "escola", "6ano", 1)
+            await asyncio.sleep(0)
+        _, board = await load
+        assert board.scores["ana"] == 52
+        assert board.rank("ana") == 1
+        for worker in (writer, reader):
+            await worker.close()
+
+    asyncio.run(scenario())
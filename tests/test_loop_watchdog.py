@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from starlette.responses import StreamingResponse
+
+from loop_watchdog import LoopWatchdog, LoopWatchdogMiddleware, loop_watchdog, request_scope
+
+BLOCK = 0.3
+
+
+async def receive():
+    await asyncio.sleep(10)
+    return {"type": "http.disconnect"}
+
+
+async def send(message):
+    pass
+
+
+def streaming_app(path):
+    async def body():
+        yield "primeiro"
+        time.sleep(BLOCK)  # a sync call inside the streamed body
+        yield "segundo"
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path=path)
+        await StreamingResponse(body())(scope, receive, send)
+    return app
+
+
+def child_task_app(path):
+    async def blocking():
+        time.sleep(BLOCK)
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path=path)
+        await asyncio.create_task(blocking())
+    return app
+
+
+async def run_request(app, path):
+    await asyncio.sleep(loop_watchdog.interval * 2)
+    await LoopWatchdogMiddleware(app)({"type": "http", "method": "POST", "path": path}, receive, send)
+    # Let the watchdog thread see the heartbeat resume
+    await asyncio.sleep(loop_watchdog.interval * 4)
+    return dict(loop_watchdog.last_block)
+
+
+def test_blocks_in_child_tasks_name_the_request():
+    async def main():
+        settings = loop_watchdog.interval, loop_watchdog.threshold
+        loop_watchdog.interval, loop_watchdog.threshold = 0.02, 0.1
+        await loop_watchdog.start()
+        try:
+            streamed = await run_request(streaming_app("/api/chat/stream"), "/api/chat/stream")
+            spawned = await run_request(child_task_app("/api/files"), "/api/files")
+        finally:
+            await loop_watchdog.close()
+            loop_watchdog.interval, loop_watchdog.threshold = settings
+        return streamed, spawned
+
+    streamed, spawned = asyncio.run(main())
+    for block, route in ((streamed, "/api/chat/stream"), (spawned, "/api/files")):
+        assert block["route"] == route
+        assert block["detected_after_ms"] < block["blocked_ms"]
+        assert BLOCK * 1000 * 0.9 <= block["blocked_ms"] <= BLOCK * 1000 + 150
+
+
+def test_background_block_and_factory_restored():
+    async def main():
+        watchdog = LoopWatchdog(interval=0.02, threshold=0.1)
+        loop = asyncio.get_running_loop()
+        await watchdog.start()
+        try:
+            token = request_scope.set(None)
+            await asyncio.sleep(0.05)
+            time.sleep(BLOCK)
+            await asyncio.sleep(0.1)
+            request_scope.reset(token)
+        finally:
+            await watchdog.close()
+        return watchdog, loop.get_task_factory()
+
+    watchdog, factory = asyncio.run(main())
+    assert factory is None
+    assert watchdog.blocks == 1
+    assert watchdog.last_block["route"] == "background"
+    assert watchdog.last_block["blocked_ms"] >= BLOCK * 1000 * 0.9
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def make_registry(directory):
+    registry = Registry(directory=str(directory))
+    counter = registry.register(Counter("test_total", "test", ("outcome",)))
+    gauge = registry.register(Gauge("test_in_flight", "test"))
+    histogram = registry.register(Histogram("test_seconds", "test", ("route",), (0.1, 1.0)))
+    return registry, counter, gauge, histogram
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_single_process_render():
+    registry, counter, gauge, histogram = make_registry("")
+    counter.inc("ok")
+    counter.inc("ok", amount=2)
+    gauge.inc()
+    histogram.observe(0.5, "/api/chat")
+    body = registry.render()
+    assert 'test_total{outcome="ok"} 3' in body
+    assert "test_in_flight 1" in body
+    assert 'test_seconds_bucket{route="/api/chat",le="0.1"} 0' in body
+    assert 'test_seconds_bucket{route="/api/chat",le="1.0"} 1' in body
+    assert 'test_seconds_count{route="/api/chat"} 1' in body
+
+
+def test_workers_are_summed(tmp_path):
+    registry, counter, gauge, histogram = make_registry(tmp_path)
+    counter.inc("ok")
+    gauge.inc()
+    histogram.observe(0.05, "/api/chat")
+
+    # Another live worker (the parent process stands in for it) and one that exited
+    other = {
+        "test_total": [[["ok"], 4], [["error"], 1]],
+        "test_in_flight": [[[], 2]],
+        "test_seconds": [[["/api/chat"], [0, 2, 0, 3.0, 2]]],
+    }
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(other))
+    exited = {"test_total": [[["ok"], 10]], "test_in_flight": [[[], 5]]}
+    (tmp_path / f"{dead_pid()}.json").write_text(json.dumps(exited))
+    (tmp_path / "garbage.json").write_text("{")
+
+    body = registry.render()
+    assert 'test_total{outcome="ok"} 15' in body
+    assert 'test_total{outcome="error"} 1' in body
+    assert "test_in_flight 3" in body  # the exited worker's gauge is dropped
+    assert 'test_seconds_bucket{route="/api/chat",le="0.1"} 1' in body
+    assert 'test_seconds_bucket{route="/api/chat",le="1.0"} 3' in body
+    assert 'test_seconds_count{route="/api/chat"} 3' in body
+    assert (tmp_path / f"{os.getpid()}.json").exists()
+
+
+def test_stopped_worker_keeps_counters(tmp_path):
+    registry, counter, gauge, _ = make_registry(tmp_path)
+    counter.inc("ok")
+    gauge.inc()
+    registry.write_snapshot(live=False)
+    data = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+    assert data["test_total"] == [[["ok"], 1]]
+    assert "test_in_flight" not in data
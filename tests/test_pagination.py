@@ -0,0 +1,129 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, fetch_keyset_page
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc[key]
+            for operator, operand in condition.items():
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$gt" and not value > operand:
+                    return False
+        elif doc[key] != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length):
+        return self.docs
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection):
+        return FakeCursor([dict(doc) for doc in self.docs if matches(doc, query)])
+
+
+def make_docs(count, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    # Few distinct timestamps so ties are broken by id
+    return [
+        {"id": f"m{i:04d}", "owner": "u1", "created_at": start + timedelta(seconds=rng.randint(0, count // 3))}
+        for i in range(count)
+    ]
+
+
+def newest_first(docs):
+    return sorted(docs, key=lambda doc: (doc["created_at"], doc["id"]), reverse=True)
+
+
+def page(collection, before=None, after=None, limit=7):
+    return asyncio.run(fetch_keyset_page(
+        collection, {"owner": "u1"}, "created_at", before, after, limit, {"_id": 0}
+    ))
+
+
+def test_cursor_round_trip():
+    doc = {"id": "abc", "created_at": datetime(2025, 3, 4, 5, 6, 7, 890)}
+    assert decode_cursor(encode_cursor(doc, "created_at")) == (doc["created_at"], "abc")
+
+
+@pytest.mark.parametrize("limit", [1, 5, 7, 100])
+def test_paging_before_visits_every_document_once(limit):
+    docs = make_docs(60)
+    collection = FakeCollection(docs)
+    seen, before = [], None
+    while True:
+        items, before, _ = page(collection, before=before, limit=limit)
+        seen.extend(items)
+        if before is None:
+            break
+    assert [doc["id"] for doc in seen] == [doc["id"] for doc in newest_first(docs)]
+
+
+def test_paging_after_walks_back_to_newest():
+    docs = make_docs(40, seed=3)
+    expected = [doc["id"] for doc in newest_first(docs)]
+    collection = FakeCollection(docs)
+
+    # Go to the oldest page, then page towards newer documents
+    before, pages = None, []
+    while True:
+        items, before, after = page(collection, before=before)
+        pages.append((items, after))
+        if before is None:
+            break
+    seen = list(pages[-1][0])
+    after = pages[-1][1]
+    while after is not None:
+        items, _, after = page(collection, after=after)
+        # Each page is still newest first
+        assert items == newest_first(items)
+        seen = items + seen
+    assert [doc["id"] for doc in seen] == expected
+
+
+def test_edges_of_the_collection():
+    collection = FakeCollection(make_docs(10))
+    items, before, after = page(collection, limit=10)
+    assert len(items) == 10 and before is None and after is not None
+
+    items, before, after = page(FakeCollection([]))
+    assert (items, before, after) == ([], None, None)
+
+
+def test_rejects_both_directions_and_bad_cursors():
+    from fastapi import HTTPException
+
+    collection = FakeCollection(make_docs(5))
+    cursor = encode_cursor(make_docs(1)[0], "created_at")
+    with pytest.raises(HTTPException):
+        page(collection, before=cursor, after=cursor)
+    with pytest.raises(HTTPException):
+        page(collection, before="not-a-cursor")
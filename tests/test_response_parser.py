@@ -0,0 +1,171 @@
+import json
+import random
+
+import pytest
+
+from response_parser import PartialJSONParser, parse_ai_response, parse_stats, partial_ai_events
+
+PAYLOAD = {
+    "type": "help",
+    "intro": "Vamos resolver juntos!",
+    "steps": ["Leia o enunciado", "Identifique os dados", "Monte a conta"],
+    "explanation": "Uma fração representa partes de um \"todo\".\nPense numa pizza.",
+    "final_answer": "",
+    "examples": ["1/2 de uma pizza", "3/4 de um bolo"],
+    "follow_up_questions": ["Quer tentar outro exemplo?"],
+    "xp": 10,
+    "coins": 2,
+}
+VALID = json.dumps(PAYLOAD, ensure_ascii=False)
+
+
+def outcome_of(text, request_type="help"):
+    before = dict(parse_stats.outcomes)
+    result = parse_ai_response(text, request_type)
+    changed = [outcome for outcome, count in parse_stats.outcomes.items() if count != before[outcome]]
+    assert len(changed) == 1
+    return result, changed[0]
+
+
+@pytest.mark.parametrize("text, outcome", [
+    (VALID, "fast"),
+    (f"```json\n{VALID}\n```", "extracted"),
+    (f"Claro! Aqui está:\n{VALID}\nEspero ter ajudado.", "extracted"),
+    (VALID[:VALID.index("Identifique") + 5], "repaired"),
+    (VALID[:VALID.index("pizza.") + 2], "repaired"),
+])
+def test_recovers_payload(text, outcome):
+    result, recorded = outcome_of(text)
+    assert recorded == outcome
+    assert result["intro"] == PAYLOAD["intro"]
+    assert result["steps"][0] == "Leia o enunciado"
+
+
+def test_truncated_inside_escape():
+    text = VALID[:VALID.index('\\"todo') + 1]
+    result, outcome = outcome_of(text)
+    assert outcome == "repaired"
+    assert result["explanation"].startswith("Uma fração representa partes de um ")
+
+
+def test_truncated_inside_unicode_escape():
+    text = json.dumps(PAYLOAD)  # ASCII escapes: "fração"
+    text = text[:text.index("\\u00e7") + 4]
+    result, outcome = outcome_of(text)
+    assert outcome == "repaired"
+    assert result["explanation"] == "Uma fra"
+
+
+def test_drifted_fields_are_coerced():
+    drifted = dict(PAYLOAD, xp="10", steps="Leia o enunciado", examples=None, intro=42)
+    del drifted["follow_up_questions"]
+    result, outcome = outcome_of(json.dumps(drifted, ensure_ascii=False))
+    assert outcome == "fast"
+    assert result["steps"] == ["Leia o enunciado"]
+    assert result["examples"] == []
+    assert result["follow_up_questions"] == []
+    assert result["intro"] == "42"
+
+
+def test_rewards_follow_request_type():
+    tampered = json.dumps(dict(PAYLOAD, type="help", xp=1000, coins=1000))
+    result, _ = outcome_of(tampered, "hint")
+    assert (result["type"], result["xp"], result["coins"]) == ("hint", 5, 1)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Desculpe, não consegui responder.",
+    json.dumps([PAYLOAD], ensure_ascii=False)[:1],
+    VALID.replace('"', "'"),
+    '{"type": "help", "xp": 10}',
+    "{" * 50,
+    "}{][",
+])
+def test_unusable_output_fails(text):
+    result, outcome = outcome_of(text)
+    assert result is None
+    assert outcome == "failed"
+
+
+def malformed_outputs(count, seed):
+    """The drifts seen in practice: fences, prose, truncation, dropped characters, wrong types, garbage."""
+    rng = random.Random(seed)
+    drifted = dict(PAYLOAD, xp="10", steps="Leia o enunciado", examples=None)
+    mutations = [
+        lambda: VALID,
+        lambda: f"```json\n{VALID}\n```",
+        lambda: f"Claro! Aqui está:\n{VALID}\nEspero ter ajudado.",
+        lambda: VALID[:rng.randint(1, len(VALID) - 1)],
+        lambda: "".join(ch for ch in VALID if rng.random() > 0.01),
+        lambda: json.dumps(drifted, ensure_ascii=False),
+        lambda: json.dumps([PAYLOAD], ensure_ascii=False),
+        lambda: "".join(chr(rng.randint(32, 0x2FF)) for _ in range(rng.randint(0, 400))),
+        lambda: VALID.replace('"', "'"),
+        lambda: "{" * rng.randint(1, 50) + VALID,
+    ]
+    return [rng.choice(mutations)() for _ in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_malformed_corpus(seed):
+    for text in malformed_outputs(400, seed):
+        result = parse_ai_response(text, "help")
+        if result is not None:
+            assert result["type"] == "help"
+            assert all(isinstance(step, str) for step in result["steps"])
+            assert result["intro"] or result["explanation"] or result["steps"] or result["final_answer"]
+        parser = PartialJSONParser()
+        parser.feed(text)
+        snapshot = parser.snapshot()
+        assert snapshot is None or isinstance(snapshot, dict)
+
+
+def test_partial_parser_every_prefix():
+    parser = PartialJSONParser()
+    previous = {}
+    for i, ch in enumerate("Resposta: " + VALID + " fim"):
+        parser.feed(ch)
+        snapshot = parser.snapshot()
+        assert snapshot is None or isinstance(snapshot, dict)
+        if snapshot is not None:
+            # Fields never disappear once seen
+            assert set(previous) <= set(snapshot)
+            previous = snapshot
+    assert parser.complete
+    assert parser.snapshot() == PAYLOAD
+
+
+def test_partial_parser_ignores_text_after_object():
+    parser = PartialJSONParser()
+    parser.feed(VALID + ' {"intro": "outro"}')
+    assert parser.snapshot() == PAYLOAD
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_partial_events_rebuild_streamed_fields(chunk_size):
+    parser = PartialJSONParser()
+    sent = {"intro": "", "steps": [], "explanation": ""}
+    rebuilt = {"intro": "", "steps": [], "explanation": ""}
+    for start in range(0, len(VALID), chunk_size):
+        parser.feed(VALID[start:start + chunk_size])
+        snapshot = parser.snapshot()
+        if snapshot is None:
+            continue
+        for event, data in partial_ai_events(snapshot, sent):
+            if event == "step":
+                while len(rebuilt["steps"]) <= data["index"]:
+                    rebuilt["steps"].append("")
+                rebuilt["steps"][data["index"]] += data["delta"]
+            else:
+                rebuilt[event] += data["delta"]
+    assert rebuilt == {field: PAYLOAD[field] for field in ("intro", "steps", "explanation")}
+    assert partial_ai_events(parser.snapshot(), sent) == []
+
+
+def test_partial_events_skip_non_text():
+    sent = {"intro": "", "steps": [], "explanation": ""}
+    events = partial_ai_events({"intro": 3, "steps": "texto", "explanation": None}, sent)
+    assert events == []
+    events = partial_ai_events({"steps": [{"a": 1}, "Passo"]}, sent)
+    assert events == [("step", {"index": 1, "delta": "Passo"})]